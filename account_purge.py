@@ -0,0 +1,207 @@
+"""Deleting large accounts in the background, in bounded batches.
+
+Deleting a user is one DELETE of their row; the foreign keys cascade to
+their messages, follows, likes and timeline entries. For an account with
+hundreds of thousands of those rows that one statement still runs for
+seconds and holds its locks the whole time, so once an account has more
+than ACCOUNT_PURGE_THRESHOLD rows (by its counters) `delete_user` queues
+it in `account_purges` instead and returns straight away. A queued
+account can't be followed and its messages can't be liked.
+
+A background thread then works through the queue. Each batch of at most
+ACCOUNT_PURGE_BATCH follows, likes or messages is deleted in its own
+short transaction, with the counters of the other users involved updated
+alongside it. The user's row goes last, which also removes them from the
+queue. That transaction first locks the row, so nothing new can refer to
+it, and updates counters for anything that arrived during the batches
+before the cascade removes it. Until then their profile can still be seen.
+
+Queued purges survive a restart: `flask purge-accounts` runs whatever is
+left, and so does the thread the next time an account is queued.
+"""
+
+import logging
+import threading
+
+from sqlalchemy import func, select
+
+import counters
+from fragment_cache import fragment_cache
+from models import db, delete_returning, AccountPurge, Follows, Likes, Message, User
+
+ACCOUNT_PURGE_THRESHOLD = 10000
+
+ACCOUNT_PURGE_BATCH = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class AccountPurger:
+    """Runs queued account purges on a background thread."""
+
+    def __init__(self, threshold=ACCOUNT_PURGE_THRESHOLD, batch=ACCOUNT_PURGE_BATCH):
+        self.threshold = threshold
+        self.batch = batch
+
+        self._app = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._again = False
+
+    def init_app(self, app):
+        self._app = app
+        self.threshold = app.config.get('ACCOUNT_PURGE_THRESHOLD', self.threshold)
+        self.batch = app.config.get('ACCOUNT_PURGE_BATCH', self.batch)
+
+    def is_large(self, user):
+        """Is `user` too big to delete in one transaction?"""
+
+        rows = sum(getattr(user, name) for name in counters.COUNTERS)
+        return rows >= self.threshold
+
+    def is_queued(self, user_id):
+        """Is `user_id` waiting to be purged?"""
+
+        return db.session.query(
+            AccountPurge.query.filter(AccountPurge.user_id == user_id).exists()
+        ).scalar()
+
+    def schedule(self, user_id):
+        """Queue `user_id` for purging (committing) and start the thread."""
+
+        db.session.merge(AccountPurge(user_id=user_id))
+        db.session.commit()
+        self.start()
+
+    def start(self):
+        with self._lock:
+            self._again = True
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='account-purge', daemon=True)
+                self._thread.start()
+
+    def join(self):
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._again:
+                    self._thread = None
+                    return
+                self._again = False
+
+            try:
+                self.run_pending()
+            except Exception:
+                logger.exception("account purge failed")
+
+    def run_pending(self):
+        """Purge every queued account. Returns how many were purged."""
+
+        with self._app.app_context():
+            try:
+                user_ids = [user_id for (user_id,) in (db.session
+                            .query(AccountPurge.user_id)
+                            .order_by(AccountPurge.requested_at))]
+                db.session.commit()
+
+                for user_id in user_ids:
+                    self.purge(user_id)
+
+                return len(user_ids)
+            finally:
+                db.session.remove()
+
+    def purge(self, user_id):
+        """Delete `user_id` and everything of theirs, a batch at a time."""
+
+        steps = [self._delete_following, self._delete_followers,
+                 self._delete_likes, self._delete_messages]
+
+        for step in steps:
+            while step(user_id):
+                db.session.commit()
+
+        # locking the row keeps new follows and likes from referring to it;
+        # whatever slipped in during the batches is counted before the
+        # cascade takes it
+        user = (User
+                .query
+                .filter(User.id == user_id)
+                .with_for_update()
+                .first())
+        if user is not None:
+            counters.forget_user(user_id)
+            db.session.delete(user)
+        db.session.commit()
+        fragment_cache.invalidate_user(user_id)
+
+    def _delete_follows(self, column, user_id, other, counter):
+        follows = Follows.__table__
+        batch = (select([getattr(follows.c, other)])
+                 .where(getattr(follows.c, column) == user_id)
+                 .limit(self.batch))
+        others = delete_returning(
+            follows,
+            (getattr(follows.c, column) == user_id)
+            & getattr(follows.c, other).in_(batch),
+            getattr(follows.c, other))
+
+        if others:
+            counters.bump(others, **{counter: -1})
+        return len(others)
+
+    def _delete_following(self, user_id):
+        return self._delete_follows('user_following_id', user_id,
+                                    'user_being_followed_id', 'followers_count')
+
+    def _delete_followers(self, user_id):
+        return self._delete_follows('user_being_followed_id', user_id,
+                                    'user_following_id', 'following_count')
+
+    def _delete_likes(self, user_id):
+        likes = Likes.__table__
+        batch = (select([likes.c.message_id])
+                 .where(likes.c.user_id == user_id)
+                 .limit(self.batch))
+        message_ids = delete_returning(
+            likes,
+            (likes.c.user_id == user_id) & likes.c.message_id.in_(batch),
+            likes.c.message_id)
+
+        counters.count_likes([(user_id, message_id, -1) for message_id in message_ids])
+        return len(message_ids)
+
+    def _delete_messages(self, user_id):
+        message_ids = [message_id for (message_id,) in (db.session
+                       .query(Message.id)
+                       .filter(Message.user_id == user_id)
+                       .limit(self.batch))]
+        if not message_ids:
+            return 0
+
+        # their likes go by cascade, so the likers' counts drop here
+        likers = (db.session
+                  .query(Likes.user_id, func.count())
+                  .filter(Likes.message_id.in_(message_ids))
+                  .group_by(Likes.user_id))
+        by_count = {}
+        for liker_id, count in likers:
+            by_count.setdefault(count, []).append(liker_id)
+        for count, liker_ids in by_count.items():
+            counters.bump(liker_ids, likes_count=-count)
+
+        (Message
+         .query
+         .filter(Message.id.in_(message_ids))
+         .delete(synchronize_session=False))
+
+        return len(message_ids)
+
+
+account_purger = AccountPurger()
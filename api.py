@@ -0,0 +1,272 @@
+"""Versioned JSON API for mobile and polling clients.
+
+    GET /api/v1/timeline                  the logged-in user's home timeline
+    GET /api/v1/users/<id>                a profile
+    GET /api/v1/users/<id>/messages       a user's messages
+    GET /api/v1/messages/<id>             one message
+
+Lists are pages of `{"items": [...], "next_cursor": ...}`; pass the cursor
+back as `?before=` for the next page, and `?limit=` for a shorter one.
+`?fields=id,text,user.username` picks the fields returned, from the
+*_FIELDS tables below; the default is all of them.
+
+Queries select just the columns for the requested fields and rows are
+serialized straight from the result tuples, so no ORM objects are built.
+Responses carry the same validators as the pages (see http_cache.py) and
+are gzipped for clients that accept it once they reach API_GZIP_MIN_BYTES.
+"""
+
+import gzip
+import json
+from datetime import datetime
+
+from flask import Blueprint, abort, current_app, g, request
+from werkzeug.exceptions import HTTPException
+
+import http_cache
+from models import db, User, Message, TimelineEntry
+from pagination import PAGE_SIZE, paginate
+import partitions
+import timelines
+
+API_GZIP_MIN_BYTES = 1024
+
+API_GZIP_LEVEL = 6
+
+USER_FIELDS = {
+    'id': User.id,
+    'username': User.username,
+    'image_url': User.image_url,
+    'header_image_url': User.header_image_url,
+    'bio': User.bio,
+    'location': User.location,
+    'messages_count': User.messages_count,
+    'following_count': User.following_count,
+    'followers_count': User.followers_count,
+    'likes_count': User.likes_count,
+}
+
+MESSAGE_FIELDS = {
+    'id': Message.id,
+    'text': Message.text,
+    'timestamp': Message.timestamp,
+    'likes_count': Message.likes_count,
+    'user.id': Message.user_id,
+    'user.username': User.username,
+    'user.image_url': User.image_url,
+}
+
+MESSAGE_KEYS = [Message.timestamp, Message.id]
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+##############################################################################
+# Projection and serialization
+
+
+def requested_fields(available):
+    """Names from the `fields` query parameter, or all of `available`."""
+
+    fields = request.args.get('fields')
+    if not fields:
+        return list(available)
+
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(unknown)}")
+
+    return names
+
+
+def serializer(names):
+    """Function making a dict of one row's values for `names`.
+
+    Dotted names nest: 'user.username' becomes {"user": {"username": ...}}.
+    """
+
+    paths = [name.split('.') for name in names]
+
+    def serialize(values):
+        obj = {}
+        for path, value in zip(paths, values):
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            target = obj
+            for part in path[:-1]:
+                target = target.setdefault(part, {})
+            target[path[-1]] = value
+        return obj
+
+    return serialize
+
+
+def json_response(payload):
+    return current_app.response_class(
+        json.dumps(payload, separators=(',', ':')),
+        mimetype='application/json')
+
+
+def message_query(names, *extra, with_author=False):
+    """Query selecting `extra` columns then those of the named message fields.
+
+    Joins the authors only when an author field other than the id is asked
+    for, or `with_author` is set because `extra` needs them.
+    """
+
+    query = (db.session
+             .query(*extra, *[MESSAGE_FIELDS[name] for name in names])
+             .select_from(Message))
+
+    if with_author or any(name.startswith('user.') and name != 'user.id'
+                          for name in names):
+        query = query.join(User, User.id == Message.user_id)
+
+    return query
+
+
+def message_page(query, keys, names, recent=None):
+    """JSON page of `query`, whose rows start with the `keys` columns."""
+
+    try:
+        limit = min(int(request.args.get('limit', PAGE_SIZE)), PAGE_SIZE)
+    except ValueError:
+        abort(400, "limit must be a number")
+    if limit < 1:
+        abort(400, "limit must be positive")
+
+    page = paginate(query, keys,
+                    before=request.args.get('before'),
+                    per_page=limit,
+                    cursor_of=lambda row: row[:len(keys)],
+                    recent=recent)
+
+    serialize = serializer(names)
+    return json_response({
+        'items': [serialize(row[len(keys):]) for row in page.items],
+        'next_cursor': page.next_cursor,
+    })
+
+
+##############################################################################
+# Endpoints
+
+
+@api.route('/timeline')
+def timeline():
+    """Messages of the logged-in user and the users they follow."""
+
+    if not g.user:
+        abort(401)
+
+    cached = http_cache.not_modified(*timelines.home_version(g.user.id), g.user)
+    if cached:
+        return cached
+
+    names = requested_fields(MESSAGE_FIELDS)
+
+    recent = None
+    if timelines.enabled():
+        keys = timelines.HOME_KEYS
+        query = (message_query(names, *keys)
+                 .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+                 .filter(TimelineEntry.user_id == g.user.id))
+    else:
+        keys = MESSAGE_KEYS
+        query = (message_query(names, *keys)
+                 .filter(Message.user_id.in_(timelines.home_user_ids(g.user.id))))
+        recent = partitions.recent()
+
+    return message_page(query, keys, names, recent)
+
+
+@api.route('/users/<int:user_id>')
+def user(user_id):
+    names = requested_fields(USER_FIELDS)
+
+    row = (db.session
+           .query(User.updated_at, *[USER_FIELDS[name] for name in names])
+           .filter(User.id == user_id)
+           .first())
+    if row is None:
+        abort(404)
+
+    cached = http_cache.not_modified(row[0])
+    if cached:
+        return cached
+
+    return json_response(serializer(names)(row[1:]))
+
+
+@api.route('/users/<int:user_id>/messages')
+def user_messages(user_id):
+    row = (db.session
+           .query(User.updated_at, User.messages_count)
+           .filter(User.id == user_id)
+           .first())
+    if row is None:
+        abort(404)
+    updated_at, messages_count = row
+
+    # posting or deleting a message bumps the author's counters, so updated_at
+    cached = http_cache.not_modified(updated_at)
+    if cached:
+        return cached
+
+    names = requested_fields(MESSAGE_FIELDS)
+    query = message_query(names, *MESSAGE_KEYS).filter(Message.user_id == user_id)
+
+    return message_page(query, MESSAGE_KEYS, names,
+                        partitions.recent(messages_count))
+
+
+@api.route('/messages/<int:message_id>')
+def message(message_id):
+    names = requested_fields(MESSAGE_FIELDS)
+
+    # liking a message touches its author, so the author's updated_at
+    # versions its like count
+    row = (message_query(names, User.updated_at, with_author=True)
+           .filter(Message.id == message_id)
+           .first())
+    if row is None:
+        abort(404)
+
+    cached = http_cache.not_modified(message_id, row[0])
+    if cached:
+        return cached
+
+    return json_response(serializer(names)(row[1:]))
+
+
+##############################################################################
+# Errors and compression
+
+
+@api.errorhandler(HTTPException)
+def json_error(exc):
+    response = json_response({'error': exc.description})
+    response.status_code = exc.code
+    return response
+
+
+@api.after_request
+def compress(response):
+    """Gzip JSON bodies big enough to be worth it, if the client accepts gzip."""
+
+    response.vary.add('Accept-Encoding')
+
+    if (response.status_code != 200
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers
+            or not request.accept_encodings.quality('gzip')):
+        return response
+
+    body = response.get_data()
+    if len(body) < current_app.config.get('API_GZIP_MIN_BYTES', API_GZIP_MIN_BYTES):
+        return response
+
+    response.set_data(gzip.compress(body, API_GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
@@ -1,11 +1,29 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import (Flask, render_template, request, flash, redirect, session, g,
+                   abort, jsonify)
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import ObjectDeletedError
 
+from api import api
 from forms import UserAddForm, LoginForm, MessageForm, EditUserForm
-from models import db, connect_db, User, Message, Likes, Follows
+from models import db, connect_db, hasher, User, Message, Likes, Follows
+from pagination import paginate
+import partitions
+from account_purge import account_purger
+import counters
+from fragment_cache import fragment_cache
+import http_cache
+from instrumentation import sql_instrumentation
+import migrations
+import query_plans
+from search import search_users
+import template_cache
+import timelines
+from user_cache import user_cache
+from write_behind import write_behind
 
 CURR_USER_KEY = "curr_user"
 
@@ -17,12 +35,105 @@ app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Connection pool per process; pre-ping and recycle drop connections the
+# server or a proxy has closed before a request trips over them.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+}
+
+# Comma-separated read replica URLs; reads of GET requests go there (see
+# db_routing.py).
+app.config['SQLALCHEMY_REPLICA_URIS'] = [
+    url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+app.config['REPLICA_MAX_LAG'] = float(os.environ.get('REPLICA_MAX_LAG', 10))
+app.config['REPLICA_STICKY_SECONDS'] = float(
+    os.environ.get('REPLICA_STICKY_SECONDS', 5))
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# bcrypt cost for new hashes (weaker hashes are upgraded at login) and how
+# many processes per web process may hash at once; 0 hashes on the request
+# thread (see passwords.py).
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['BCRYPT_POOL_SIZE'] = int(os.environ.get('BCRYPT_POOL_SIZE', 2))
+
+# Materialize home timelines on write (see timelines.py); run
+# `flask rebuild-timelines` after turning this on for an existing db.
+app.config['TIMELINE_FANOUT'] = (
+    os.environ.get('TIMELINE_FANOUT', 'false').lower() == 'true')
+
+# Share of requests whose SQL is timed and tallied per endpoint, and the
+# request time past which they're logged (see instrumentation.py).
+app.config['SQL_SAMPLE_RATE'] = float(os.environ.get('SQL_SAMPLE_RATE', 0))
+app.config['SQL_SLOW_REQUEST_MS'] = int(
+    os.environ.get('SQL_SLOW_REQUEST_MS', 500))
+
+# Memory cap for rendered message cards (see fragment_cache.py), and
+# whether /_metrics serves cache and SQL stats.
+app.config['FRAGMENT_CACHE_BYTES'] = int(
+    os.environ.get('FRAGMENT_CACHE_BYTES', 32 * 1024 * 1024))
+app.config['METRICS_ENABLED'] = (
+    os.environ.get('METRICS_ENABLED', 'false').lower() == 'true')
+
+# Queue likes (and optionally new messages) and commit them in batches
+# every WRITE_BEHIND_INTERVAL_MS or WRITE_BEHIND_BATCH writes; a crash
+# loses up to one interval of them (see write_behind.py).
+app.config['WRITE_BEHIND_LIKES'] = (
+    os.environ.get('WRITE_BEHIND_LIKES', 'false').lower() == 'true')
+app.config['WRITE_BEHIND_MESSAGES'] = (
+    os.environ.get('WRITE_BEHIND_MESSAGES', 'false').lower() == 'true')
+app.config['WRITE_BEHIND_INTERVAL_MS'] = int(
+    os.environ.get('WRITE_BEHIND_INTERVAL_MS', 50))
+app.config['WRITE_BEHIND_BATCH'] = int(os.environ.get('WRITE_BEHIND_BATCH', 500))
+
+# Set once `flask partition-messages` has split messages into monthly
+# partitions: first pages then only read the last MESSAGE_RECENT_DAYS, and
+# `flask maintain-partitions` archives months older than
+# MESSAGE_ARCHIVE_MONTHS (0 keeps everything). See partitions.py.
+app.config['MESSAGE_PARTITIONS'] = (
+    os.environ.get('MESSAGE_PARTITIONS', 'false').lower() == 'true')
+app.config['MESSAGE_RECENT_DAYS'] = int(os.environ.get('MESSAGE_RECENT_DAYS', 31))
+app.config['MESSAGE_ARCHIVE_MONTHS'] = int(
+    os.environ.get('MESSAGE_ARCHIVE_MONTHS', 0))
+
+# Accounts with more rows than this (follows, likes and messages, by their
+# counters) are deleted in the background, ACCOUNT_PURGE_BATCH rows per
+# transaction (see account_purge.py).
+app.config['ACCOUNT_PURGE_THRESHOLD'] = int(
+    os.environ.get('ACCOUNT_PURGE_THRESHOLD', 10000))
+app.config['ACCOUNT_PURGE_BATCH'] = int(os.environ.get('ACCOUNT_PURGE_BATCH', 1000))
+
+# JSON API responses at least this big are gzipped (see api.py).
+app.config['API_GZIP_MIN_BYTES'] = int(os.environ.get('API_GZIP_MIN_BYTES', 1024))
+
+# Keep compiled templates in TEMPLATE_CACHE_DIR (fill it at build time with
+# `flask precompile-templates`), and with TEMPLATE_WARMUP load them all at
+# startup rather than on first use (see template_cache.py).
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('TEMPLATE_CACHE_DIR', '')
+app.config['TEMPLATE_WARMUP'] = (
+    os.environ.get('TEMPLATE_WARMUP', 'false').lower() == 'true')
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+hasher.init_app(app)
+sql_instrumentation.init_app(app)
+fragment_cache.init_app(app)
+write_behind.init_app(app)
+account_purger.init_app(app)
+
+app.url_defaults(http_cache.static_version)
+app.after_request(http_cache.add_cache_headers)
+
+app.register_blueprint(api)
+
+# last, so warmup sees the blueprints' templates too
+template_cache.init_app(app)
 
 
 ##############################################################################
@@ -34,12 +145,30 @@ def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = user_cache.get(session[CURR_USER_KEY])
 
     else:
         g.user = None
 
 
+@app.errorhandler(ObjectDeletedError)
+def current_user_deleted(exc):
+    """Log out a cached current user whose row another process deleted.
+
+    The user cache can't tell without a query, so it shows as this error
+    once the request loads one of their uncached columns.
+    """
+
+    db.session.rollback()
+    if (CURR_USER_KEY not in session
+            or user_cache.reload(session[CURR_USER_KEY]) is not None):
+        # some other row went away
+        raise exc
+
+    do_logout()
+    return redirect("/")
+
+
 def do_login(user):
     """Log in user."""
 
@@ -100,6 +229,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # saves the password hash if authenticate upgraded it
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -124,17 +255,30 @@ def logout():
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username (best
+    SEARCH_LIMIT matches), or a 'before' cursor to page through older
+    sign-ups.
     """
 
     search = request.args.get('q')
 
-    if not search:
-        users = User.query.all()
+    if search:
+        users = search_users(search)
+        next_cursor = None
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        page = paginate(User.query, [User.id], before=request.args.get('before'))
+        users, next_cursor = page
 
-    return render_template('users/index.html', users=users)
+    if g.user:
+        following_ids = Follows.following_among(
+            g.user.id, [user.id for user in users])
+    else:
+        following_ids = set()
+
+    return render_template('users/index.html',
+                           users=users,
+                           next_cursor=next_cursor,
+                           following_ids=following_ids)
 
 
 @app.route('/users/<int:user_id>')
@@ -143,15 +287,65 @@ def users_show(user_id):
 
     user = User.query.get_or_404(user_id)
 
+    cached = http_cache.not_modified(user, g.user)
+    if cached:
+        return cached
+
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    page = paginate(Message.with_authors().filter(Message.user_id == user_id),
+                    [Message.timestamp, Message.id],
+                    before=request.args.get('before'),
+                    recent=partitions.recent(user.messages_count))
+
+    return render_template('users/show.html',
+                           user=user,
+                           following=follows_user(user),
+                           messages=page.items,
+                           next_cursor=page.next_cursor)
+
+
+def follows_user(user):
+    """Does the logged-in user follow `user`? For the profile header.
+
+    Views pass this to templates instead of them asking g.user, which in
+    asgi.py would query the database from inside the render.
+    """
+
+    return g.user is not None and g.user.is_following(user)
+
+
+# what a user card shows, so follow lists don't load whole rows
+USER_CARD_COLUMNS = [User.id, User.username, User.image_url, User.header_image_url]
+
+
+def follow_list(user_id, template, edge, other):
+    """Render a page of the users at the `other` end of `user_id`'s follows.
+
+    `edge` is the follows column holding `user_id` and `other` the one
+    holding the listed users; pages walk the follows index on (edge, other).
+    """
+
+    user = User.query.get_or_404(user_id)
+
+    page = paginate(db.session
+                    .query(*USER_CARD_COLUMNS)
+                    .join(Follows, other == User.id)
+                    .filter(edge == user_id),
+                    [other],
+                    before=request.args.get('before'),
+                    cursor_of=lambda card: [card.id])
+
+    # the profile header's follow button is asked about along with the cards
+    following_ids = Follows.following_among(
+        g.user.id, [user.id] + [card.id for card in page.items])
+
+    return render_template(template,
+                           user=user,
+                           following=user.id in following_ids,
+                           users=page.items,
+                           next_cursor=page.next_cursor,
+                           following_ids=following_ids)
 
 
 @app.route('/users/<int:user_id>/following')
@@ -162,8 +356,8 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    return follow_list(user_id, 'users/following.html',
+                       Follows.user_following_id, Follows.user_being_followed_id)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -174,8 +368,8 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    return follow_list(user_id, 'users/followers.html',
+                       Follows.user_being_followed_id, Follows.user_following_id)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -187,7 +381,17 @@ def add_follow(follow_id):
         return redirect("/")
 
     followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    if account_purger.is_queued(followed_user.id):
+        abort(404)
+
+    # following twice, say from a stale page, changes nothing
+    if Follows.add(g.user.id, followed_user.id):
+        counters.bump(g.user.id, following_count=1)
+        counters.bump(followed_user.id, followers_count=1)
+
+        if timelines.enabled():
+            timelines.add_follow(g.user.id, followed_user.id)
+
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -201,8 +405,13 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    if Follows.remove(g.user.id, follow_id):
+        counters.bump(g.user.id, following_count=-1)
+        counters.bump(follow_id, followers_count=-1)
+
+        if timelines.enabled():
+            timelines.remove_follow(g.user.id, follow_id)
+
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -239,6 +448,7 @@ def profile():
                 g.user.bio = form.bio.data
                 db.session.add(g.user)
                 db.session.commit()
+                fragment_cache.invalidate_user(g.user.id)
                 return redirect(f'/users/{g.user.id}')
 
             except IntegrityError:
@@ -259,30 +469,59 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
-    db.session.commit()
+    user_id = g.user.id
+
+    if account_purger.is_large(g.user):
+        account_purger.schedule(user_id)
+    else:
+        counters.forget_user(user_id)
+        db.session.delete(g.user)
+        db.session.commit()
+        fragment_cache.invalidate_user(user_id)
 
     return redirect("/signup")
 
-@app.route('/users/add_like/<message_id>', methods=["POST"])
+@app.route('/users/add_like/<int:message_id>', methods=["POST"])
 def like_message(message_id):
-    """Like a message"""
+    """Like a message. Liking it again changes nothing."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    
+
     msg = Message.query.get_or_404(message_id)
-    new_like = Likes(user_id=g.user.id, message_id=msg.id)
-    try:
-        db.session.add(new_like)
+    if account_purger.is_queued(msg.user_id):
+        abort(404)
+
+    if write_behind.likes_enabled:
+        write_behind.like(g.user.id, msg.id, 1)
+    elif Likes.add(g.user.id, msg.id):
+        counters.count_like(g.user.id, msg, 1)
         db.session.commit()
-    except IntegrityError:
-        return redirect('/')
 
-    return render_template('/users/likes.html', user=g.user)
+    return redirect("/")
+
+
+@app.route('/users/remove_like/<int:message_id>', methods=["POST"])
+def unlike_message(message_id):
+    """Unlike a message. Unliking it again changes nothing."""
 
-@app.route('/users/<user_id>/likes')
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    msg = Message.query.get_or_404(message_id)
+
+    if write_behind.likes_enabled:
+        write_behind.like(g.user.id, msg.id, -1)
+    elif Likes.remove(g.user.id, msg.id):
+        counters.count_like(g.user.id, msg, -1)
+        db.session.commit()
+
+    return redirect("/")
+
+
+@app.route('/users/<int:user_id>/likes')
 def show_liked_messages(user_id):
     """Show a users liked messages"""
 
@@ -290,8 +529,19 @@ def show_liked_messages(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    likes = g.user.likes
-    return render_template('/users/likes.html', user=g.user, messages=likes)
+    user = User.query.get_or_404(user_id)
+    page = paginate(Message
+                    .with_authors()
+                    .join(Likes, Likes.message_id == Message.id)
+                    .filter(Likes.user_id == user_id),
+                    [Message.timestamp, Message.id],
+                    before=request.args.get('before'))
+
+    return render_template('/users/likes.html',
+                           user=user,
+                           following=follows_user(user),
+                           messages=page.items,
+                           next_cursor=page.next_cursor)
 
 
 ##############################################################################
@@ -311,8 +561,18 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        if write_behind.messages_enabled:
+            write_behind.add_message(g.user.id, form.text.data)
+            return redirect(f"/users/{g.user.id}")
+
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        counters.bump(g.user.id, messages_count=1)
+
+        if timelines.enabled():
+            db.session.flush()
+            timelines.fan_out(msg)
+
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
@@ -324,8 +584,15 @@ def messages_add():
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = Message.query.get_or_404(message_id)
+
+    cached = http_cache.not_modified(msg.id, msg.user, g.user)
+    if cached:
+        return cached
+
+    return render_template('messages/show.html',
+                           message=msg,
+                           following=follows_user(msg.user))
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -336,9 +603,13 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get(message_id)
-    db.session.delete(msg)
+    # DELETEs of the user's own message and its likes, without loading it;
+    # its timeline entries go by cascade
+    if not counters.delete_message(message_id, g.user.id):
+        abort(404)
+
     db.session.commit()
+    fragment_cache.invalidate_message(message_id)
 
     flash("Message deleted", "success")
     return redirect(f"/users/{g.user.id}")
@@ -355,36 +626,173 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users, with a
+      'before' cursor to page further back
     """
-    follower_ids = [follower.id for follower in g.user.following] + [g.user.id] 
+
     if g.user:
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(follower_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        cached = http_cache.not_modified(*timelines.home_version(g.user.id),
+                                         g.user)
+        if cached:
+            return cached
+
+        before = request.args.get('before')
+
+        if timelines.enabled():
+            page = paginate(timelines.home_query(g.user.id),
+                            timelines.HOME_KEYS,
+                            before=before,
+                            cursor_of=lambda msg: [msg.timestamp, msg.id])
+        else:
+            page = paginate(Message
+                            .with_authors()
+                            .filter(Message.user_id.in_(
+                                timelines.home_user_ids(g.user.id))),
+                            [Message.timestamp, Message.id],
+                            before=before,
+                            recent=partitions.recent())
 
-        return render_template('home.html', messages=messages)
+        likes = Likes.liked_among(g.user.id, [msg.id for msg in page.items])
+
+        return render_template('home.html',
+                               messages=page.items,
+                               likes=likes,
+                               next_cursor=page.next_cursor)
 
     else:
         return render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+# Metrics
+
+
+@app.route('/_metrics')
+def metrics():
+    """Cache and SQL stats for this process, as JSON (if METRICS_ENABLED)."""
+
+    if not app.config['METRICS_ENABLED']:
+        abort(404)
+
+    return jsonify(fragment_cache=fragment_cache.stats(),
+                   user_cache=user_cache.stats(),
+                   sql=sql_instrumentation.stats(),
+                   write_behind=write_behind.stats())
+
+
+##############################################################################
+# Maintenance commands
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Backfill materialized home timelines from follows and messages."""
+
+    count = timelines.rebuild()
+    print(f"Wrote {count} timeline entries.")
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Recompute the denormalized counters on users and messages."""
+
+    fixed = counters.reconcile()
+    print(f"Fixed counters for {fixed} users.")
+
+    fixed = counters.reconcile_messages()
+    print(f"Fixed like counts for {fixed} messages.")
+
+
+@app.cli.command('purge-accounts')
+def purge_accounts():
+    """Finish deleting large accounts queued by delete_user."""
+
+    count = account_purger.run_pending()
+    print(f"Purged {count} accounts.")
+
+
+@app.cli.command('partition-messages')
+def partition_messages():
+    """Convert messages into a table partitioned by month (Postgres)."""
+
+    with db.engine.begin() as conn:
+        converted = partitions.convert(conn)
+
+    if converted:
+        print("Partitioned messages; set MESSAGE_PARTITIONS=true.")
+    else:
+        print("messages is already partitioned.")
+
+
+@app.cli.command('maintain-partitions')
+@click.option('--archive-dir', type=click.Path(file_okay=False, exists=True),
+              help="write archived months here as .csv.gz instead of to messages_archive")
+def maintain_partitions(archive_dir):
+    """Create the coming months' message partitions and archive old ones."""
+
+    with db.engine.begin() as conn:
+        created = partitions.create_partitions(conn)
+    print(f"Created {len(created)} partitions.")
+
+    months = app.config['MESSAGE_ARCHIVE_MONTHS']
+    if months:
+        with db.engine.begin() as conn:
+            archived = partitions.archive(conn, partitions.archive_cutoff(months),
+                                          archive_dir)
+        print(f"Archived {len(archived)} partitions.")
+
+
+@app.cli.command('precompile-templates')
+def precompile_templates():
+    """Compile every template into TEMPLATE_CACHE_DIR."""
+
+    if not app.config['TEMPLATE_CACHE_DIR']:
+        raise click.UsageError("set TEMPLATE_CACHE_DIR to the cache directory")
+
+    names = template_cache.compile_templates(app)
+    print(f"Compiled {len(names)} templates into {app.config['TEMPLATE_CACHE_DIR']}.")
+
+
+@app.cli.command('db-status')
+def db_status():
+    """List schema migrations and whether each is applied."""
+
+    done = migrations.applied(db.engine)
+    for version, name in migrations.discover():
+        print(f"[{'x' if version in done else ' '}] {name}")
+
+
+@app.cli.command('db-upgrade')
+def db_upgrade():
+    """Apply pending schema migrations."""
+
+    count = migrations.upgrade(db.engine)
+    print(f"Applied {count} migrations.")
+
+
+@app.cli.command('check-seq-scans')
+@click.option('--user-id', type=int,
+              help="user to view the pages as (default: the one following most)")
+def check_seq_scans(user_id):
+    """Flag queries of the main pages that have to read a whole table."""
+
+    if user_id is None:
+        user_id = (db.session
+                   .query(User.id)
+                   .order_by(User.following_count.desc())
+                   .limit(1)
+                   .scalar())
+    message_id = (db.session
+                  .query(Message.id)
+                  .order_by(Message.id.desc())
+                  .limit(1)
+                  .scalar())
+
+    flagged = query_plans.check_routes(query_plans.route_paths(user_id, message_id),
+                                       {CURR_USER_KEY: user_id})
+    for path, statement, tables in flagged:
+        print(f"{path}: full scan of {', '.join(tables)}\n    {statement}\n")
+
+    print(f"{len(flagged)} queries fall back to full table scans.")
+    if flagged:
+        raise SystemExit(1)
@@ -0,0 +1,352 @@
+"""Async serving mode: the read-heavy pages on an async database driver.
+
+    pip install -r requirements-async.txt
+    uvicorn asgi:app --workers 4
+
+The home page, profiles, message pages and the user directory are served
+by async handlers here. They query Postgres through `databases` (asyncpg)
+using SQLAlchemy Core selects on the tables defined in models.py, so a
+worker waiting on the database can keep serving other clients. Every
+other request, including the same pages when a flash message is pending,
+is passed through to the Flask app unchanged, so both modes share the
+models, templates, session cookie and HTTP validators.
+
+Pages still render with Flask's Jinja templates. That happens in a worker
+thread inside a Flask request context, with `g.user` set to the viewer
+loaded here. Results are plain model instances that are never added to a
+session, so templates can read them but nothing lazy-loads.
+
+This tree is on SQLAlchemy 1.3, which has no async engine; `databases`
+runs the same Core statements on asyncpg instead.
+"""
+
+from databases import Database
+from flask import g, render_template
+from itsdangerous import BadSignature
+from sqlalchemy import case, func, not_, select
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Match, Route
+from werkzeug.exceptions import HTTPException as WerkzeugHTTPException
+
+from app import app as flask_app, CURR_USER_KEY
+import http_cache
+from models import User, Message, Follows, Likes, TimelineEntry
+from pagination import PAGE_SIZE, before_filter, make_page
+import partitions
+from search import SEARCH_LIMIT, backend, escape_like, search_users
+import timelines
+
+database = Database(flask_app.config['SQLALCHEMY_DATABASE_URI'])
+
+users = User.__table__
+messages = Message.__table__
+follows = Follows.__table__
+likes = Likes.__table__
+timeline_entries = TimelineEntry.__table__
+
+
+##############################################################################
+# Session, queries and rendering
+
+
+def flask_session(request):
+    """The Flask session stored in the request's cookie, or {}."""
+
+    cookie = request.cookies.get(flask_app.session_cookie_name)
+    if not cookie:
+        return {}
+
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        return serializer.loads(
+            cookie,
+            max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+async def fetch_user(user_id):
+    row = await database.fetch_one(users.select().where(users.c.id == user_id))
+    return User(**dict(row)) if row else None
+
+
+async def current_user(request):
+    user_id = flask_session(request).get(CURR_USER_KEY)
+    return await fetch_user(user_id) if user_id is not None else None
+
+
+async def fetch_users(query):
+    return [User(**dict(row)) for row in await database.fetch_all(query)]
+
+
+async def fetch_messages(query):
+    """Messages from `query`, with their authors loaded in one more query."""
+
+    msgs = [Message(**dict(row)) for row in await database.fetch_all(query)]
+
+    author_ids = {msg.user_id for msg in msgs}
+    if author_ids:
+        authors = {user.id: user for user in await fetch_users(
+            users.select().where(users.c.id.in_(author_ids)))}
+        for msg in msgs:
+            msg.user = authors[msg.user_id]
+
+    return msgs
+
+
+async def is_following(viewer, user_id):
+    """Does `viewer` follow `user_id`?
+
+    Templates get this instead of asking g.user, whose ORM query would run
+    sync inside the render.
+    """
+
+    if viewer is None or viewer.id == user_id:
+        return False
+
+    row = await database.fetch_one(
+        select([follows.c.user_following_id])
+        .where(follows.c.user_following_id == viewer.id)
+        .where(follows.c.user_being_followed_id == user_id))
+    return row is not None
+
+
+async def fetch_page(query, keys, before, fetch=fetch_messages, cursor_of=None,
+                     recent=None):
+    """Async counterpart of pagination.paginate for a Core select."""
+
+    def ordered(query, limit):
+        return query.order_by(*[key.desc() for key in keys]).limit(limit)
+
+    if recent is not None and not before:
+        rows = await fetch(ordered(query.where(recent), PAGE_SIZE + 1))
+        if len(rows) <= PAGE_SIZE:
+            rows += await fetch(ordered(query.where(not_(recent)),
+                                        PAGE_SIZE + 1 - len(rows)))
+        return make_page(rows, keys, PAGE_SIZE, cursor_of)
+
+    if before:
+        try:
+            query = query.where(before_filter(keys, before))
+        except WerkzeugHTTPException as exc:
+            raise HTTPException(exc.code)
+
+    rows = await fetch(ordered(query, PAGE_SIZE + 1))
+
+    return make_page(rows, keys, PAGE_SIZE, cursor_of)
+
+
+def in_flask(request, viewer, view):
+    """Run `view()` in a Flask request context and convert its response."""
+
+    with flask_app.test_request_context(
+            request.url.path,
+            method=request.method,
+            query_string=request.url.query,
+            headers=list(request.headers.items())):
+        g.user = viewer
+        rv = view()
+        if rv is None:
+            return None
+        response = http_cache.add_cache_headers(flask_app.make_response(rv))
+
+    return Response(response.get_data(),
+                    status_code=response.status_code,
+                    headers=dict(response.headers))
+
+
+async def not_modified(request, viewer, *validators):
+    """A 304 if the client's copy is current (see http_cache.not_modified)."""
+
+    return await run_in_threadpool(
+        in_flask, request, viewer,
+        lambda: http_cache.not_modified(*validators))
+
+
+async def render(request, viewer, template, validators=None, **context):
+    def view():
+        if validators is not None:
+            http_cache.not_modified(*validators)
+        return render_template(template, **context)
+
+    return await run_in_threadpool(in_flask, request, viewer, view)
+
+
+##############################################################################
+# Pages
+
+
+async def homepage(request):
+    viewer = await current_user(request)
+    if viewer is None:
+        return await render(request, None, 'home-anon.html')
+
+    home_user_ids = timelines.home_user_ids(viewer.id)
+
+    version = await database.fetch_one(timelines.home_version_query(viewer.id))
+    validators = (*version.values(), viewer)
+
+    cached = await not_modified(request, viewer, *validators)
+    if cached:
+        return cached
+
+    if flask_app.config['TIMELINE_FANOUT']:
+        query = (select([messages])
+                 .select_from(messages.join(
+                     timeline_entries,
+                     timeline_entries.c.message_id == messages.c.id))
+                 .where(timeline_entries.c.user_id == viewer.id))
+        keys = [timeline_entries.c.timestamp, timeline_entries.c.message_id]
+        recent = None
+    else:
+        query = (messages
+                 .select()
+                 .where(messages.c.user_id.in_(home_user_ids)))
+        keys = [messages.c.timestamp, messages.c.id]
+        recent = in_flask_value(partitions.recent)
+
+    page = await fetch_page(query, keys, request.query_params.get('before'),
+                            cursor_of=lambda msg: [msg.timestamp, msg.id],
+                            recent=recent)
+
+    liked = set()
+    if page.items:
+        liked = {row['message_id'] for row in await database.fetch_all(
+            select([likes.c.message_id])
+            .where(likes.c.user_id == viewer.id)
+            .where(likes.c.message_id.in_([msg.id for msg in page.items])))}
+
+    return await render(request, viewer, 'home.html', validators,
+                        messages=page.items,
+                        likes=liked,
+                        next_cursor=page.next_cursor)
+
+
+async def users_show(request):
+    viewer = await current_user(request)
+    user = await fetch_user(request.path_params['user_id'])
+    if user is None:
+        raise HTTPException(404)
+
+    cached = await not_modified(request, viewer, user, viewer)
+    if cached:
+        return cached
+
+    page = await fetch_page(messages.select().where(messages.c.user_id == user.id),
+                            [messages.c.timestamp, messages.c.id],
+                            request.query_params.get('before'),
+                            recent=in_flask_value(partitions.recent,
+                                                  user.messages_count))
+
+    return await render(request, viewer, 'users/show.html', (user, viewer),
+                        user=user,
+                        following=await is_following(viewer, user.id),
+                        messages=page.items,
+                        next_cursor=page.next_cursor)
+
+
+async def messages_show(request):
+    viewer = await current_user(request)
+    msgs = await fetch_messages(
+        messages.select().where(messages.c.id == request.path_params['message_id']))
+    if not msgs:
+        raise HTTPException(404)
+
+    msg = msgs[0]
+    validators = (msg.id, msg.user, viewer)
+
+    cached = await not_modified(request, viewer, *validators)
+    if cached:
+        return cached
+
+    return await render(request, viewer, 'messages/show.html', validators,
+                        message=msg,
+                        following=await is_following(viewer, msg.user_id))
+
+
+async def list_users(request):
+    viewer = await current_user(request)
+    search = request.query_params.get('q')
+
+    if search and await run_in_threadpool(in_flask_value, backend) == 'trigram':
+        needle = escape_like(search)
+        is_prefix = users.c.username.ilike(f"{needle}%", escape='\\')
+        found = await fetch_users(
+            users.select()
+            .where(users.c.username.ilike(f"%{needle}%", escape='\\'))
+            .order_by(case([(is_prefix, 0)], else_=1),
+                      func.length(users.c.username),
+                      users.c.username)
+            .limit(SEARCH_LIMIT))
+        next_cursor = None
+    elif search:
+        # the in-process ngram index lives on the sync side
+        found = await run_in_threadpool(in_flask_value, search_users, search)
+        next_cursor = None
+    else:
+        found, next_cursor = await fetch_page(users.select(), [users.c.id],
+                                              request.query_params.get('before'),
+                                              fetch=fetch_users)
+
+    following_ids = set()
+    if viewer is not None and found:
+        following_ids = {row['user_being_followed_id'] for row in await database.fetch_all(
+            select([follows.c.user_being_followed_id])
+            .where(follows.c.user_following_id == viewer.id)
+            .where(follows.c.user_being_followed_id.in_([user.id for user in found])))}
+
+    return await render(request, viewer, 'users/index.html',
+                        users=found,
+                        next_cursor=next_cursor,
+                        following_ids=following_ids)
+
+
+def in_flask_value(fn, *args):
+    """`fn(*args)` inside a Flask app context, for sync helpers that need one."""
+
+    with flask_app.app_context():
+        return fn(*args)
+
+
+##############################################################################
+# Dispatch
+
+
+async_pages = Starlette(
+    routes=[
+        Route('/', homepage),
+        Route('/users', list_users),
+        Route('/users/{user_id:int}', users_show),
+        Route('/messages/{message_id:int}', messages_show),
+    ],
+    on_startup=[database.connect],
+    on_shutdown=[database.disconnect],
+)
+
+flask_pages = WSGIMiddleware(flask_app)
+
+
+def handled_async(scope):
+    """Is this a request one of the async pages can answer?"""
+
+    if scope['method'] not in ('GET', 'HEAD'):
+        return False
+
+    if not any(route.matches(scope)[0] == Match.FULL
+               for route in async_pages.routes):
+        return False
+
+    # rendering a flash clears it from the session, which only Flask saves
+    return '_flashes' not in flask_session(Request(scope))
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'http' and not handled_async(scope):
+        await flask_pages(scope, receive, send)
+    else:
+        await async_pages(scope, receive, send)
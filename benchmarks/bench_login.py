@@ -0,0 +1,68 @@
+"""Benchmark login throughput at several bcrypt costs.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_login --costs 10 11 12 --logins 64 --pool-size 4
+
+For each cost, checks `--logins` passwords from `--concurrency` threads
+(standing in for web workers) through a PasswordHasher, once with the
+process pool and once hashing inline, and reports logins per second.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+from passwords import PasswordHasher
+
+PASSWORD = 'correct horse battery staple'
+
+
+def logins_per_second(hasher, hashed, logins, concurrency):
+    """Time `logins` password checks spread over `concurrency` threads."""
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as threads:
+        results = list(threads.map(lambda _: hasher.check(hashed, PASSWORD),
+                                   range(logins)))
+    elapsed = time.perf_counter() - start
+
+    assert all(results)
+    return logins / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--costs', type=int, nargs='+', default=[10, 11, 12, 13])
+    parser.add_argument('--logins', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--pool-size', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    print(f"{'cost':>4}  {'ms/hash':>8}  {'inline/s':>9}  "
+          f"{'pool({})/s'.format(args.pool_size):>10}")
+
+    for cost in args.costs:
+        inline = PasswordHasher(rounds=cost, pool_size=0)
+        pooled = PasswordHasher(rounds=cost, pool_size=args.pool_size)
+
+        start = time.perf_counter()
+        hashed = inline.hash(PASSWORD)
+        hash_ms = (time.perf_counter() - start) * 1000
+
+        # start the pool's workers outside the timed run
+        pooled.check(hashed, PASSWORD)
+
+        inline_rate = logins_per_second(inline, hashed, args.logins,
+                                        args.concurrency)
+        pooled_rate = logins_per_second(pooled, hashed, args.logins,
+                                        args.concurrency)
+        pooled.shutdown()
+
+        print(f"{cost:>4}  {hash_ms:>8.1f}  {inline_rate:>9.1f}  "
+              f"{pooled_rate:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+"""Route-level load benchmark replaying a recorded traffic mix.
+
+Run from the repository root against a scratch database (it is dropped and
+re-seeded for every scale):
+
+    DATABASE_URL=postgresql:///warbler-bench python -m benchmarks.bench_routes \\
+        --scale 1000,10000,20000 --scale 10000,200000,500000 \\
+        --requests 2000 --concurrency 8 --save-baseline bench_baseline.json
+
+For each --scale (users,messages,follows) this generates data with
+generator/create_csvs.py, loads it with bulk_load, then replays a JSONL
+request log through the Flask app from --concurrency client threads and
+reports, per route: requests, errors, p50/p95/p99 latency, requests/sec
+and database queries per request.
+
+The request log (--traffic) has one JSON object per line:
+
+    {"method": "GET", "path": "/", "user_id": 12}
+    {"method": "POST", "path": "/messages/new", "user_id": 12, "data": {"text": "hi"}}
+
+`user_id` logs the request in as that user. Without --traffic, a log
+mixing the home page, profiles, directory search, follow/unfollow, new
+messages and likes is synthesized for the seeded data (--write-traffic
+saves it for reuse). Each user's requests replay in order on one thread,
+so a follow is always seen before the matching unfollow.
+
+--save-baseline writes the results as JSON; --compare reads such a file
+and prints each route's p95 and throughput change against it.
+"""
+
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///warbler-bench')
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app, CURR_USER_KEY
+from bulk_load import load_tables
+from models import db, User, Message, Follows
+import counters
+import timelines
+
+GENERATOR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         'generator', 'create_csvs.py')
+
+# share of each kind of request in a synthesized traffic log
+TRAFFIC_MIX = [
+    ('homepage', 40),
+    ('users_show', 20),
+    ('list_users', 10),
+    ('show_liked_messages', 5),
+    ('like_message', 10),
+    ('add_follow', 5),
+    ('messages_add', 5),
+    ('stop_following', 5),
+]
+
+SEARCH_TERMS = ['a', 'sun', 'river', 'gold', 'walk', 'tree', 'star', 'wind']
+
+_queries = threading.local()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    _queries.count = getattr(_queries, 'count', 0) + 1
+
+
+##############################################################################
+# Data
+
+
+def seed(users, messages, follows, seed=0):
+    """Drop and re-seed the benchmark database at the given scale."""
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        subprocess.run([sys.executable, GENERATOR,
+                        '--users', str(users),
+                        '--messages', str(messages),
+                        '--follows', str(follows),
+                        '--seed', str(seed),
+                        '--out-dir', out_dir],
+                       check=True)
+
+        db.drop_all()
+        db.create_all()
+        load_tables(db.engine,
+                    [(User.__table__, os.path.join(out_dir, 'users.csv')),
+                     (Message.__table__, os.path.join(out_dir, 'messages.csv')),
+                     (Follows.__table__, os.path.join(out_dir, 'follows.csv'))],
+                    progress=lambda line: None)
+
+    with app.app_context():
+        counters.reconcile()
+        if timelines.enabled():
+            timelines.rebuild()
+
+
+def synthesize_traffic(num_requests, num_users, num_messages, seed=0):
+    """A traffic log following TRAFFIC_MIX over the seeded ids."""
+
+    rng = random.Random(seed)
+    kinds = [kind for kind, weight in TRAFFIC_MIX for _ in range(weight)]
+    followed = defaultdict(list)
+    log = []
+
+    for _ in range(num_requests):
+        user_id = rng.randint(1, num_users)
+        kind = rng.choice(kinds)
+        entry = {'method': 'GET', 'user_id': user_id, 'route': kind}
+
+        if kind == 'homepage':
+            entry['path'] = '/'
+        elif kind == 'users_show':
+            entry['path'] = f'/users/{rng.randint(1, num_users)}'
+        elif kind == 'list_users':
+            entry['path'] = f'/users?q={rng.choice(SEARCH_TERMS)}'
+        elif kind == 'show_liked_messages':
+            entry['path'] = f'/users/{user_id}/likes'
+        elif kind == 'like_message':
+            entry.update(method='POST',
+                         path=f'/users/add_like/{rng.randint(1, num_messages)}')
+        elif kind == 'messages_add':
+            entry.update(method='POST', path='/messages/new',
+                         data={'text': f'benchmark warble {rng.random()}'})
+        elif kind == 'add_follow':
+            other = rng.randint(1, num_users)
+            followed[user_id].append(other)
+            entry.update(method='POST', path=f'/users/follow/{other}')
+        elif kind == 'stop_following' and followed[user_id]:
+            other = followed[user_id].pop()
+            entry.update(method='POST', path=f'/users/stop-following/{other}')
+        else:
+            entry.update(path='/', route='homepage')
+
+        log.append(entry)
+
+    return log
+
+
+def read_traffic(path):
+    with open(path) as log_file:
+        return [json.loads(line) for line in log_file if line.strip()]
+
+
+def route_of(entry):
+    """Endpoint name for a logged request, like 'users_show'."""
+
+    if 'route' in entry:
+        return entry['route']
+
+    adapter = app.url_map.bind('localhost')
+    try:
+        endpoint, _ = adapter.match(entry['path'].split('?')[0],
+                                    method=entry.get('method', 'GET'))
+    except Exception:
+        return 'unknown'
+    return endpoint
+
+
+##############################################################################
+# Replay
+
+
+def replay(log, concurrency):
+    """Replay `log` from `concurrency` threads. Returns (samples, wall seconds).
+
+    Each sample is (route, seconds, queries, status).
+    """
+
+    partitions = defaultdict(list)
+    for entry in log:
+        partitions[entry.get('user_id', 0) % concurrency].append(entry)
+
+    def run(entries):
+        client = app.test_client()
+        samples = []
+
+        for entry in entries:
+            with client.session_transaction() as sess:
+                if entry.get('user_id'):
+                    sess[CURR_USER_KEY] = entry['user_id']
+                else:
+                    sess.pop(CURR_USER_KEY, None)
+
+            _queries.count = 0
+            start = time.perf_counter()
+            resp = client.open(entry['path'],
+                               method=entry.get('method', 'GET'),
+                               data=entry.get('data'))
+            elapsed = time.perf_counter() - start
+
+            samples.append((route_of(entry), elapsed, _queries.count,
+                            resp.status_code))
+
+        return samples
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as threads:
+        results = list(threads.map(run, partitions.values()))
+    wall = time.perf_counter() - start
+
+    return [sample for samples in results for sample in samples], wall
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(samples, wall):
+    """Per-route stats: count, errors, p50/p95/p99 ms, rps, queries/request."""
+
+    by_route = defaultdict(list)
+    for sample in samples:
+        by_route[sample[0]].append(sample)
+
+    summary = {}
+    for route, route_samples in sorted(by_route.items()):
+        latencies = sorted(seconds * 1000 for _, seconds, _, _ in route_samples)
+        summary[route] = {
+            'requests': len(route_samples),
+            'errors': sum(status >= 500 for *_, status in route_samples),
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'rps': len(route_samples) / wall,
+            'queries': sum(q for _, _, q, _ in route_samples) / len(route_samples),
+        }
+
+    return summary
+
+
+def print_summary(label, summary, baseline=None):
+    print(f"\n== {label}")
+    print(f"{'route':<22}{'reqs':>7}{'errs':>6}{'p50ms':>9}{'p95ms':>9}"
+          f"{'p99ms':>9}{'req/s':>9}{'q/req':>7}")
+
+    for route, stats in summary.items():
+        line = (f"{route:<22}{stats['requests']:>7}{stats['errors']:>6}"
+                f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}"
+                f"{stats['p99_ms']:>9.1f}{stats['rps']:>9.1f}"
+                f"{stats['queries']:>7.1f}")
+
+        before = (baseline or {}).get(route)
+        if before:
+            line += (f"   p95 {stats['p95_ms'] / before['p95_ms'] - 1:+.0%}"
+                     f"  req/s {stats['rps'] / before['rps'] - 1:+.0%}")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Warbler routes.")
+    parser.add_argument('--scale', action='append',
+                        help="users,messages,follows to seed (repeatable)")
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--traffic', help="JSONL request log to replay")
+    parser.add_argument('--write-traffic', help="save the synthesized log here")
+    parser.add_argument('--save-baseline', help="write results to this JSON file")
+    parser.add_argument('--compare', help="baseline JSON file to compare against")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {}
+    for scale in args.scale or ['1000,10000,20000']:
+        users, messages, follows = (int(n) for n in scale.split(','))
+        print(f"seeding {users:,} users, {messages:,} messages, {follows:,} follows")
+        seed(users, messages, follows, args.seed)
+
+        if args.traffic:
+            log = read_traffic(args.traffic)
+        else:
+            log = synthesize_traffic(args.requests, users, messages, args.seed)
+            if args.write_traffic:
+                with open(args.write_traffic, 'w') as log_file:
+                    log_file.writelines(json.dumps(entry) + '\n' for entry in log)
+
+        samples, wall = replay(log, args.concurrency)
+        results[scale] = summarize(samples, wall)
+        print_summary(f"{scale}: {len(samples)} requests in {wall:.1f}s "
+                      f"({len(samples) / wall:.1f} req/s)",
+                      results[scale], baseline.get(scale))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
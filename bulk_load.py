@@ -0,0 +1,147 @@
+"""Streaming CSV loader for large seed datasets.
+
+`load_csv` reads a CSV file a chunk at a time and commits each chunk, so
+memory use stays flat however big the file is:
+
+- on Postgres each chunk goes through `COPY ... FROM STDIN`
+- elsewhere (SQLite) each chunk is one executemany INSERT, with each field
+  converted to its column's type and empty fields of nullable columns
+  loaded as NULL, as COPY does
+
+Before loading, `load_tables` can drop a table's secondary indexes and
+recreate them once all rows are in, which is much faster than updating
+them row by row. Afterwards it moves id sequences past the loaded ids and
+refreshes planner statistics.
+"""
+
+import csv
+from datetime import date, datetime
+import io
+import time
+
+from sqlalchemy import text
+
+CHUNK_SIZE = 50000
+
+
+def _copy_chunk(conn, table, columns, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    raw = conn.connection
+    with raw.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            buffer)
+    raw.commit()
+
+
+def _converter(column):
+    """Function turning a CSV field into a value for `column`."""
+
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        python_type = str
+
+    if python_type in (datetime, date):
+        parse = python_type.fromisoformat
+    elif python_type is bool:
+        parse = lambda value: value.lower() in ('t', 'true', '1')
+    elif python_type in (int, float):
+        parse = python_type
+    else:
+        parse = str
+
+    def convert(value):
+        if value == '' and column.nullable:
+            return None
+        return parse(value)
+
+    return convert
+
+
+def _insert_chunk(conn, table, columns, rows):
+    converters = [_converter(table.c[name]) for name in columns]
+    with conn.begin():
+        conn.execute(table.insert(), [
+            {name: convert(value)
+             for name, convert, value in zip(columns, converters, row)}
+            for row in rows])
+
+
+def load_csv(engine, table, path, chunk_size=CHUNK_SIZE, progress=print):
+    """Load the CSV file at `path` into `table`, committing every `chunk_size` rows.
+
+    The CSV header names the columns. Calls `progress` with a status line
+    after each chunk. Returns the number of rows loaded.
+    """
+
+    load_chunk = _copy_chunk if engine.dialect.name == 'postgresql' else _insert_chunk
+    start = time.perf_counter()
+    loaded = 0
+
+    with open(path, newline='') as csv_file, engine.connect() as conn:
+        reader = csv.reader(csv_file)
+        columns = next(reader)
+        chunk = []
+
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                load_chunk(conn, table, columns, chunk)
+                loaded += len(chunk)
+                chunk = []
+                _report(progress, table, loaded, start)
+
+        if chunk:
+            load_chunk(conn, table, columns, chunk)
+            loaded += len(chunk)
+            _report(progress, table, loaded, start)
+
+    return loaded
+
+
+def _report(progress, table, loaded, start):
+    elapsed = time.perf_counter() - start
+    progress(f"{table.name}: {loaded:,} rows, {loaded / elapsed:,.0f} rows/sec")
+
+
+def reset_sequence(conn, table):
+    """Move `table`'s id sequence past its largest id (Postgres only)."""
+
+    if conn.dialect.name != 'postgresql' or 'id' not in table.c:
+        return
+
+    conn.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+        f"COALESCE(MAX(id), 0) + 1, false) FROM {table.name}"))
+
+
+def load_tables(engine, tables_and_paths, chunk_size=CHUNK_SIZE,
+                rebuild_indexes=True, progress=print):
+    """Load several (table, csv path) pairs in order, then tidy up.
+
+    With `rebuild_indexes`, each table's secondary indexes are dropped
+    before its load and recreated after it.
+    """
+
+    for table, path in tables_and_paths:
+        indexes = list(table.indexes) if rebuild_indexes else []
+        for index in indexes:
+            index.drop(engine)
+
+        load_csv(engine, table, path, chunk_size, progress)
+
+        for index in indexes:
+            progress(f"{table.name}: building index {index.name}")
+            index.create(engine)
+
+        with engine.begin() as conn:
+            reset_sequence(conn, table)
+
+    if engine.dialect.name == 'postgresql':
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level='AUTOCOMMIT').execute(
+                text('ANALYZE'))
@@ -0,0 +1,219 @@
+"""Denormalized per-user counters.
+
+Profiles show how many messages, follows, followers and likes a user has,
+and timelines how many likes each message has. Counting those by loading
+each relationship hydrated every row of it, so they are kept as columns on
+`users` and `messages` instead. Routes adjust them with
+single `UPDATE ... SET n = n + 1` statements in the same transaction as
+the change they count, and `flask reconcile-counters` recomputes them from
+scratch if they ever drift.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import func, or_, select
+
+from models import db, delete_returning, User, Message, Follows, Likes
+
+COUNTERS = ('messages_count', 'following_count', 'followers_count', 'likes_count')
+
+
+def bump(user_ids, **deltas):
+    """Add `deltas` (like messages_count=1) to the counters of `user_ids`.
+
+    `user_ids` is a single id or a select of ids. Runs in the current
+    transaction.
+    """
+
+    if isinstance(user_ids, int):
+        condition = User.id == user_ids
+    else:
+        condition = User.id.in_(user_ids)
+
+    values = {getattr(User, name): getattr(User, name) + delta
+              for name, delta in deltas.items()}
+
+    User.query.filter(condition).update(values, synchronize_session=False)
+
+
+def count_like(user_id, message, delta=1):
+    """Update counters for `user_id` liking (1) or unliking (-1) `message`."""
+
+    bump(user_id, likes_count=delta)
+
+    (Message
+     .query
+     .filter(Message.id == message.id)
+     .update({Message.likes_count: Message.likes_count + delta},
+             synchronize_session=False))
+
+    # the author's pages show the new count, so they get a new version
+    (User
+     .query
+     .filter(User.id == message.user_id)
+     .update({User.updated_at: datetime.utcnow()},
+             synchronize_session=False))
+
+
+def count_likes(changes):
+    """Update counters for many likes (1) and unlikes (-1) at once.
+
+    `changes` is a list of (user_id, message_id, delta), each an actual
+    change. Runs a few grouped UPDATEs however long it is.
+    """
+
+    by_user = defaultdict(int)
+    by_message = defaultdict(int)
+    for user_id, message_id, delta in changes:
+        by_user[user_id] += delta
+        by_message[message_id] += delta
+
+    for delta, user_ids in _group_by_delta(by_user).items():
+        bump(user_ids, likes_count=delta)
+
+    for delta, message_ids in _group_by_delta(by_message).items():
+        (Message
+         .query
+         .filter(Message.id.in_(message_ids))
+         .update({Message.likes_count: Message.likes_count + delta},
+                 synchronize_session=False))
+
+    if by_message:
+        (User
+         .query
+         .filter(User.id.in_(select([Message.user_id])
+                             .where(Message.id.in_(list(by_message)))))
+         .update({User.updated_at: datetime.utcnow()},
+                 synchronize_session=False))
+
+
+def _group_by_delta(deltas):
+    """{delta: [ids]} of a {id: delta} dict, leaving out zeros."""
+
+    groups = defaultdict(list)
+    for id, delta in deltas.items():
+        if delta:
+            groups[delta].append(id)
+    return groups
+
+
+def delete_message(message_id, author_id):
+    """Delete `author_id`'s message `message_id`, updating the counters.
+
+    Its likes go first, returning who liked it, then the message itself.
+    Counters change only once that DELETE shows the message was there and
+    theirs, so asking for someone else's message changes nothing. Returns
+    whether it was deleted.
+    """
+
+    own = (select([Message.id])
+           .where(Message.id == message_id)
+           .where(Message.user_id == author_id))
+
+    likers = delete_returning(Likes.__table__,
+                              Likes.message_id.in_(own),
+                              Likes.user_id)
+
+    deleted = delete_returning(Message.__table__,
+                               (Message.id == message_id) & (Message.user_id == author_id),
+                               Message.id)
+
+    if not deleted:
+        return False
+
+    bump(author_id, messages_count=-1)
+    if likers:
+        bump(likers, likes_count=-1)
+    return True
+
+
+def forget_user(user_id):
+    """Update other users' counters for a user who is about to be deleted."""
+
+    bump(select([Follows.user_being_followed_id])
+         .where(Follows.user_following_id == user_id),
+         followers_count=-1)
+    bump(select([Follows.user_following_id])
+         .where(Follows.user_being_followed_id == user_id),
+         following_count=-1)
+
+    # likes by other users on this user's messages go with the messages
+    lost_likes = (select([func.count()])
+                  .select_from(Likes.__table__.join(
+                      Message.__table__, Message.id == Likes.message_id))
+                  .where(Likes.user_id == User.id)
+                  .where(Message.user_id == user_id)
+                  .as_scalar())
+    likers = (select([Likes.user_id])
+              .select_from(Likes.__table__.join(
+                  Message.__table__, Message.id == Likes.message_id))
+              .where(Message.user_id == user_id))
+
+    (User
+     .query
+     .filter(User.id.in_(likers), User.id != user_id)
+     .update({User.likes_count: User.likes_count - lost_likes},
+             synchronize_session=False))
+
+    # and other users' messages lose this user's likes
+    liked = select([Likes.message_id]).where(Likes.user_id == user_id)
+    (Message
+     .query
+     .filter(Message.id.in_(liked), Message.user_id != user_id)
+     .update({Message.likes_count: Message.likes_count - 1},
+             synchronize_session=False))
+
+
+def actual_counts():
+    """Correlated subqueries computing each counter from the source tables."""
+
+    return {
+        'messages_count': (select([func.count()])
+                           .where(Message.user_id == User.id)
+                           .as_scalar()),
+        'following_count': (select([func.count()])
+                            .where(Follows.user_following_id == User.id)
+                            .as_scalar()),
+        'followers_count': (select([func.count()])
+                            .where(Follows.user_being_followed_id == User.id)
+                            .as_scalar()),
+        'likes_count': (select([func.count()])
+                        .where(Likes.user_id == User.id)
+                        .as_scalar()),
+    }
+
+
+def reconcile():
+    """Recompute every user counter from scratch. Returns how many users drifted."""
+
+    actual = actual_counts()
+    drifted = or_(*[getattr(User, name) != count
+                    for name, count in actual.items()])
+
+    fixed = (User
+             .query
+             .filter(drifted)
+             .update({getattr(User, name): count
+                      for name, count in actual.items()},
+                     synchronize_session=False))
+    db.session.commit()
+
+    return fixed
+
+
+def reconcile_messages():
+    """Recompute every message's like count. Returns how many drifted."""
+
+    actual = (select([func.count()])
+              .where(Likes.message_id == Message.id)
+              .as_scalar())
+
+    fixed = (Message
+             .query
+             .filter(Message.likes_count != actual)
+             .update({Message.likes_count: actual},
+                     synchronize_session=False))
+    db.session.commit()
+
+    return fixed
@@ -0,0 +1,211 @@
+"""Read replica routing for the Flask-SQLAlchemy session.
+
+`db` in models.py is a RoutingSQLAlchemy. Its sessions send the queries of
+GET and HEAD requests to a read replica from SQLALCHEMY_REPLICA_URIS and
+everything else to the primary:
+
+- flushes, and INSERT/UPDATE/DELETE statements, always go to the primary
+- so does anything outside a request (CLI commands, background threads)
+- after a request commits a write, that browser reads from the primary
+  for REPLICA_STICKY_SECONDS (a timestamp in the Flask session), so a new
+  message or follow is on the very next page even if replicas are behind
+- a background thread checks each replica's lag every
+  REPLICA_LAG_CHECK_SECONDS, so a slow or unreachable replica never stalls
+  a request; one more than REPLICA_MAX_LAG seconds behind, unreachable or
+  not checked yet is skipped, and with none left reads go to the primary
+- the replica is picked once per request, so all of a page's reads see
+  the same snapshot of the data
+
+With no replicas configured every query goes to the primary, as before.
+Replica engines are created with the same SQLALCHEMY_ENGINE_OPTIONS as
+the primary.
+"""
+
+import itertools
+import threading
+import time
+
+from flask import has_request_context, request, session as flask_session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_STICKY_SECONDS = 5
+
+REPLICA_MAX_LAG = 10
+
+REPLICA_LAG_CHECK_SECONDS = 5
+
+# seconds of replay lag; 0 when a replica has replayed all it received,
+# NULL (so 0) on a server that isn't a replica
+REPLICA_LAG_SQL = """
+    SELECT COALESCE(
+        CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+             ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END, 0)
+"""
+
+STICKY_KEY = 'primary_until'
+
+READ_ENGINE_KEY = 'warbler.read_engine'
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+class Replica:
+    """One read replica engine and its last known lag."""
+
+    def __init__(self, url, engine_options):
+        self.url = url
+        self.engine = create_engine(url, **engine_options)
+        # unknown until the first check
+        self.lag = float('inf')
+        self.checked_at = None
+
+    def check(self):
+        try:
+            with self.engine.connect() as conn:
+                self.lag = float(conn.execute(REPLICA_LAG_SQL).scalar())
+        except DBAPIError:
+            self.lag = float('inf')
+        self.checked_at = time.monotonic()
+
+
+class ReplicaSet:
+    """The replicas of one app, picked round robin among the healthy ones."""
+
+    def __init__(self, urls, engine_options, max_lag=REPLICA_MAX_LAG,
+                 check_seconds=REPLICA_LAG_CHECK_SECONDS):
+        self.replicas = [Replica(url, engine_options) for url in urls]
+        self.max_lag = max_lag
+        self.check_seconds = check_seconds
+
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Check every replica's lag now."""
+
+        for replica in self.replicas:
+            replica.check()
+
+    def start(self):
+        """Start the thread checking lags every `check_seconds`, if not running."""
+
+        with self._lock:
+            if self._thread is None and self.replicas:
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name='replica-lag', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.check_seconds)
+
+    def _healthy(self, replica):
+        return replica.lag <= self.max_lag
+
+    def engine_for_read(self):
+        """Engine of a replica that's caught up enough, or None."""
+
+        if not self.replicas:
+            return None
+
+        self.start()
+
+        start = next(self._turn)
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            if self._healthy(replica):
+                return replica.engine
+
+        return None
+
+    def dispose(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        self._stop.set()
+        if thread is not None:
+            thread.join()
+
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+
+def replicas(app):
+    """The ReplicaSet for `app`, created from its config on first use."""
+
+    replica_set = app.extensions.get('replicas')
+    if replica_set is None:
+        replica_set = app.extensions['replicas'] = ReplicaSet(
+            app.config.get('SQLALCHEMY_REPLICA_URIS', []),
+            app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+            app.config.get('REPLICA_MAX_LAG', REPLICA_MAX_LAG),
+            app.config.get('REPLICA_LAG_CHECK_SECONDS',
+                           REPLICA_LAG_CHECK_SECONDS))
+    return replica_set
+
+
+def reads_pinned_to_primary():
+    return flask_session.get(STICKY_KEY, 0) > time.time()
+
+
+def request_read_engine(app):
+    """The replica engine for this request's reads, or None; picked once."""
+
+    # on the request rather than g, which can outlive one request
+    if READ_ENGINE_KEY not in request.environ:
+        request.environ[READ_ENGINE_KEY] = (
+            None if reads_pinned_to_primary() else replicas(app).engine_for_read())
+    return request.environ[READ_ENGINE_KEY]
+
+
+class RoutingSession(SignallingSession):
+    """Session sending reads of read-only requests to a replica."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+
+        if (not self._flushing
+                and not self.info.get('wrote')
+                and has_request_context()
+                and request.method in READ_METHODS):
+            engine = request_read_engine(self.app)
+            if engine is not None:
+                return engine
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy whose sessions are RoutingSessions."""
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_write(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _stick_to_primary(session):
+    wrote = session.info.pop('wrote', False)
+    app = getattr(session, 'app', None)
+
+    if wrote and app is not None and has_request_context() and replicas(app).replicas:
+        sticky = app.config.get('REPLICA_STICKY_SECONDS', REPLICA_STICKY_SECONDS)
+        flask_session[STICKY_KEY] = time.time() + sticky
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_write(session):
+    session.info.pop('wrote', None)
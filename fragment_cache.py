@@ -0,0 +1,148 @@
+"""Per-process cache of rendered message cards.
+
+Every timeline, profile and likes page renders the same `<li>` body for a
+message: author avatar and name, date and text. `message_card(msg)` in a
+template returns that markup from here when it can, rendering
+`messages/card.html` only on a miss.
+
+Entries are keyed by message id plus the author fields the card shows, so
+a profile edit can never serve an old name or avatar; `invalidate_user`
+and `invalidate_message` just free the dead entries early. Anything that
+depends on the viewer (like buttons) stays outside the card.
+
+The cache holds at most FRAGMENT_CACHE_BYTES of markup, evicting the
+least recently used cards first. `stats()` reports hits, misses and an
+estimate of the render time saved (hits times the average miss render).
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+from flask import render_template
+from markupsafe import Markup
+from sqlalchemy import event
+
+from models import db
+
+FRAGMENT_CACHE_BYTES = 32 * 1024 * 1024
+
+CARD_TEMPLATE = 'messages/card.html'
+
+
+class FragmentCache:
+    """LRU cache of rendered message cards, capped by size."""
+
+    def __init__(self, max_bytes=FRAGMENT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._by_message = {}
+        self._by_author = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.render_seconds = 0.0
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get('FRAGMENT_CACHE_BYTES', self.max_bytes)
+        app.add_template_global(self.message_card)
+
+    @staticmethod
+    def key(msg):
+        author = msg.user
+        return (msg.id, author.id, author.username, author.image_url)
+
+    def message_card(self, msg):
+        """Rendered card markup for `msg`."""
+
+        key = self.key(msg)
+
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return html
+
+        start = time.perf_counter()
+        html = Markup(render_template(CARD_TEMPLATE, msg=msg))
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.misses += 1
+            self.render_seconds += elapsed
+            self._put(key, html)
+
+        return html
+
+    def _put(self, key, html):
+        if key in self._entries or len(html) > self.max_bytes:
+            return
+
+        self._entries[key] = html
+        self._by_message.setdefault(key[0], set()).add(key)
+        self._by_author.setdefault(key[1], set()).add(key)
+        self.bytes += len(html)
+
+        while self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        self.bytes -= len(self._entries.pop(key))
+
+        for index, id in ((self._by_message, key[0]), (self._by_author, key[1])):
+            keys = index[id]
+            keys.discard(key)
+            if not keys:
+                del index[id]
+
+    def invalidate_user(self, user_id):
+        """Drop every card by `user_id`, after a profile edit or delete."""
+
+        with self._lock:
+            for key in list(self._by_author.get(user_id, ())):
+                self._remove(key)
+
+    def invalidate_message(self, message_id):
+        """Drop the cards of a deleted message."""
+
+        with self._lock:
+            for key in list(self._by_message.get(message_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_message.clear()
+            self._by_author.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            avg_render = self.render_seconds / self.misses if self.misses else 0
+
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'avg_render_ms': avg_render * 1000,
+                'render_ms_saved': self.hits * avg_render * 1000,
+            }
+
+
+fragment_cache = FragmentCache()
+
+
+@event.listens_for(db.metadata, 'after_drop')
+def _clear_on_drop(target, connection, **kw):
+    # ids start over in a recreated database
+    fragment_cache.clear()
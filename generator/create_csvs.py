@@ -2,15 +2,27 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, for example a
+multi-million row dataset for capacity tests:
+
+    python generator/create_csvs.py --users 1000000 --messages 10000000 \\
+        --follows 50000000 --out-dir /tmp/warbler-big
+
+Output is deterministic for a given --seed, needs no network access, and
+is built in NumPy batches and streamed to disk, so memory use depends on
+--batch-size rather than on the number of rows. Message authorship and
+follower counts follow a power law, so a few users are very popular and
+most have a handful of followers.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import os
+
+import numpy as np
+
+from helpers import (CITIES, WORDS, power_law_weights, random_timestamps,
+                     random_words)
 
 MAX_WARBLER_LENGTH = 140
 
@@ -18,60 +30,141 @@ USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'heade
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+# bcrypt hash of "password"
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-fake = Faker()
-
-# Generate random profile image URLs to use for users
-
-image_urls = [
+IMAGE_URLS = np.array([
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
     for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
     for i in range(count)
-]
-
-# Generate random header image URLs to use for users
-
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
-
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+])
+
+HEADER_IMAGE_URLS = np.array([
+    "/static/images/warbler-hero.jpg",
+    "/static/images/signed-out-home.jpg",
+])
+
+EMAIL_DOMAINS = np.array(["example.com", "example.net", "example.org"])
+
+
+def batches(total, batch_size):
+    """(start, stop) ranges covering 0..total in steps of `batch_size`."""
+
+    for start in range(0, total, batch_size):
+        yield start, min(start + batch_size, total)
+
+
+def write_users(path, rng, num_users, batch_size):
+    with open(path, 'w', newline='') as users_csv:
+        writer = csv.writer(users_csv)
+        writer.writerow(USERS_CSV_HEADERS)
+
+        for start, stop in batches(num_users, batch_size):
+            size = stop - start
+            ids = np.arange(start + 1, stop + 1).astype(str).astype(object)
+
+            # the id suffix keeps usernames and emails unique
+            usernames = (WORDS[rng.randint(len(WORDS), size=size)].astype(object)
+                         + WORDS[rng.randint(len(WORDS), size=size)] + ids)
+            emails = (usernames + '@'
+                      + EMAIL_DOMAINS[rng.randint(len(EMAIL_DOMAINS), size=size)])
+
+            writer.writerows(zip(
+                emails,
+                usernames,
+                IMAGE_URLS[rng.randint(len(IMAGE_URLS), size=size)],
+                [PASSWORD_HASH] * size,
+                random_words(rng, size, 4, 10) + '.',
+                HEADER_IMAGE_URLS[rng.randint(len(HEADER_IMAGE_URLS), size=size)],
+                CITIES[rng.randint(len(CITIES), size=size)],
+            ))
+
+
+def write_messages(path, rng, num_users, num_messages, batch_size, alpha, end):
+    # a few prolific posters, many occasional ones
+    posting = power_law_weights(rng, num_users, alpha)
+
+    with open(path, 'w', newline='') as messages_csv:
+        writer = csv.writer(messages_csv)
+        writer.writerow(MESSAGES_CSV_HEADERS)
+
+        for start, stop in batches(num_messages, batch_size):
+            size = stop - start
+            text = random_words(rng, size, 3, 30).astype(f'U{MAX_WARBLER_LENGTH}')
+
+            writer.writerows(zip(
+                text,
+                random_timestamps(rng, size, end),
+                rng.choice(num_users, size=size, p=posting) + 1,
+            ))
+
+
+def write_follows(path, rng, num_users, num_follows, batch_size, alpha):
+    """Write about `num_follows` distinct follows with power-law follower counts.
+
+    Followers are processed in id ranges. Within a range, followers are
+    uniform and followed users are drawn by popularity, then duplicates and
+    self-follows are dropped and the shortfall redrawn. A pair can only come
+    from its follower's range, so pairs are unique across the whole file
+    without ever enumerating all possible pairs.
+    """
+
+    popularity = power_law_weights(rng, num_users, alpha)
+    written = 0
+
+    with open(path, 'w', newline='') as follows_csv:
+        writer = csv.writer(follows_csv)
+        writer.writerow(FOLLOWS_CSV_HEADERS)
+
+        for start, stop in batches(num_users, batch_size):
+            share = num_follows * stop // num_users - written
+            wanted = min(share, (stop - start) * (num_users - 1))
+            pairs = np.empty(0, dtype=np.int64)
+
+            while len(pairs) < wanted:
+                draw = 2 * (wanted - len(pairs))
+                followers = rng.randint(start, stop, size=draw).astype(np.int64)
+                followed = rng.choice(num_users, size=draw, p=popularity)
+                keep = followers != followed
+                codes = followers[keep] * num_users + followed[keep]
+                pairs = np.union1d(pairs, codes)
+
+            pairs = rng.permutation(pairs)[:wanted]
+            written += len(pairs)
+
+            writer.writerows(zip(pairs % num_users + 1, pairs // num_users + 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate Warbler CSV data.")
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=100000,
+                        help="rows (or followers) generated per batch")
+    parser.add_argument('--alpha', type=float, default=1.0,
+                        help="power-law exponent for popularity and activity")
+    parser.add_argument('--end', default='2019-01-01',
+                        help="messages are dated in the two years before this")
+    parser.add_argument('--out-dir', default='generator')
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    # separate streams so changing one row count doesn't reshuffle the rest
+    user_rng, message_rng, follow_rng = (
+        np.random.RandomState([args.seed, stream]) for stream in range(3))
+
+    write_users(os.path.join(args.out_dir, 'users.csv'),
+                user_rng, args.users, args.batch_size)
+    write_messages(os.path.join(args.out_dir, 'messages.csv'),
+                   message_rng, args.users, args.messages, args.batch_size,
+                   args.alpha, args.end)
+    write_follows(os.path.join(args.out_dir, 'follows.csv'),
+                  follow_rng, args.users, args.follows, args.batch_size,
+                  args.alpha)
+
+
+if __name__ == '__main__':
+    main()
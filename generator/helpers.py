@@ -1,14 +1,84 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+import numpy as np
 
+# Small offline vocabulary for usernames, bios and warbles.
+WORDS = np.array("""
+    able about account across act add after again air all almost also always
+    among animal answer apple area arm art ask away baby back bad ball bank
+    bar base bear beat bed bird bit black blue board boat body book born box
+    boy bread break bring brother brown build burn buy call camp car card
+    care carry case cat catch cause cell center chair chance change check
+    child city class clean clear climb close cloud coast cold color come
+    cook cool copy corn cost count cover cow cross crowd cry cup current cut
+    dance dark day dead deal dear deep desert design dinner dog door down
+    draw dream dress drink drive drop dry duck early earth east easy eat edge
+    egg end enjoy even event every eye face fact fair fall farm fast father
+    field fight fill film find fine fire fish fit flat floor flow flower fly
+    follow food foot forest form free fresh friend front fruit full fun game
+    garden gas gift girl glad glass gold good grass gray great green ground
+    group grow guess hair half hall hand happy hard hat head hear heart heat
+    help high hill hold home hope horse hot hour house huge ice idea inch
+    iron island join joy jump keep key kind king kitchen lake land large
+    late laugh lead learn leave letter light line lion list little live long
+    look lost loud love low luck main make man map mark market meet melody
+    metal milk mind minute miss moon morning mountain move music name nation
+    near need new night noise north note ocean offer old open orange page
+    paint paper park party path peace pen people pick picture piece plain
+    plan plant play point pool poor port power press pretty print proud pull
+    push quick quiet race rain reach read ready real red rest rich ride
+    right ring river road rock roll room rose round rule run safe sail salt
+    sand save say school sea season seat seed send serve shape share ship
+    shoe shop short show side sign silver simple sing sister sit sky sleep
+    slow small smile snow soft soil song sound south space speak spring
+    square star start station stay steam step stone stop store storm story
+    street strong sugar summer sun table tail talk tall teach team tell test
+    thank thick thin think tiny tire today tool top touch town track trade
+    train travel tree trip true try turn type under valley view visit voice
+    wait walk wall warm wash watch water wave way wear weather week west
+    wheel white wide wild win wind window winter wish wood word work world
+    write yard year yellow young zoo
+""".split())
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+CITIES = np.array("""
+    Springfield Riverton Fairview Lakewood Greenville Oakland Salem Madison
+    Georgetown Clinton Franklin Marion Ashland Burlington Dover Milton
+    Newport Oxford Kingston Arlington Bristol Chester Dayton Hudson
+""".split())
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
 
-    return datetime.fromtimestamp(random_timestamp)
+def random_words(rng, rows, min_words, max_words):
+    """Array of `rows` strings of `min_words`..`max_words` random words each."""
+
+    counts = rng.randint(min_words, max_words + 1, size=rows)
+    picks = rng.randint(len(WORDS), size=(rows, max_words))
+
+    text = WORDS[picks[:, 0]].astype(object)
+    for column in range(1, max_words):
+        more = counts > column
+        text[more] = text[more] + ' ' + WORDS[picks[more, column]]
+
+    return text
+
+
+def power_law_weights(rng, size, alpha):
+    """Probabilities over `size` items following a Zipf-like power law.
+
+    The i-th most popular item gets weight 1 / i**alpha; which item gets
+    which rank is shuffled so popularity isn't tied to id order.
+    """
+
+    weights = 1.0 / np.arange(1, size + 1) ** alpha
+    weights /= weights.sum()
+    return weights[rng.permutation(size)]
+
+
+def random_timestamps(rng, size, end, year_gap=2):
+    """Array of `size` ISO timestamps spread over the `year_gap` years before `end`."""
+
+    end = np.datetime64(end, 'us')
+    span = np.timedelta64(365 * year_gap, 'D').astype('timedelta64[us]').astype(np.int64)
+    offsets = (rng.uniform(0, 1, size=size) * span).astype(np.int64)
+
+    stamps = end - offsets.astype('timedelta64[us]')
+    return np.char.replace(np.datetime_as_string(stamps, unit='us'), 'T', ' ')
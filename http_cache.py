@@ -0,0 +1,125 @@
+"""HTTP caching: conditional GETs for pages, long-lived static assets.
+
+Read routes compute a validator from a few cheap values (ids, and the
+`updated_at` of the users whose data the page shows) and call
+`not_modified(...)` before running their heavy queries:
+
+    cached = http_cache.not_modified(user.updated_at, g.user)
+    if cached:
+        return cached
+
+If the browser's If-None-Match (or If-Modified-Since) still matches, that
+returns an empty 304 and the view stops there. Otherwise the view renders
+as usual and the ETag and Last-Modified headers go on its response.
+
+`users.updated_at` moves whenever a user's row changes, including every
+counter bump, so a new or deleted message, follow or like shows up as a
+new version of the users involved. The viewer is part of every validator
+since pages show their follow and like state.
+
+Pages are `private, no-cache`: browsers keep them but revalidate every
+time, and shared caches don't store them. Pages without a validator are
+`no-store`. Static files linked through `url_for('static', ...)` get a
+`v=<mtime>` parameter and are cached for STATIC_MAX_AGE; editing the
+file changes the URL.
+"""
+
+from datetime import datetime
+from hashlib import sha1
+import os
+
+from flask import current_app, g, request, session
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+# static files requested without a version parameter
+STATIC_UNVERSIONED_MAX_AGE = 60 * 60
+
+
+def _version(part):
+    """A stable string for one validator part."""
+
+    if hasattr(part, 'updated_at'):
+        return f"{type(part).__name__}:{part.id}:{part.updated_at.isoformat()}"
+    if isinstance(part, datetime):
+        return part.isoformat()
+    return repr(part)
+
+
+def _last_modified(parts):
+    stamps = [part.updated_at if hasattr(part, 'updated_at') else part
+              for part in parts]
+    stamps = [stamp for stamp in stamps if isinstance(stamp, datetime)]
+    return max(stamps).replace(microsecond=0) if stamps else None
+
+
+def not_modified(*parts):
+    """A 304 response if the client has the current version of this page.
+
+    `parts` are what the page depends on: ids, datetimes, and model
+    objects with an `updated_at`. Returns None when the view should
+    render, after arranging for the validators to go on its response.
+    """
+
+    # a pending flash message has to be rendered, whatever the data says
+    if '_flashes' in session:
+        return None
+
+    versions = [request.path, request.query_string.decode()]
+    versions.extend(_version(part) for part in parts)
+    etag = sha1("\n".join(versions).encode()).hexdigest()
+    last_modified = _last_modified(parts)
+
+    g.http_validators = (etag, last_modified)
+
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        fresh = (last_modified is not None
+                 and request.if_modified_since is not None
+                 and last_modified <= request.if_modified_since.replace(tzinfo=None))
+
+    if not fresh:
+        return None
+
+    return current_app.response_class(status=304)
+
+
+def static_version(endpoint, values):
+    """url_defaults hook adding `v=<mtime>` to static file URLs."""
+
+    if endpoint != 'static' or 'filename' not in values or 'v' in values:
+        return
+
+    path = os.path.join(current_app.static_folder, values['filename'])
+    try:
+        values['v'] = int(os.stat(path).st_mtime)
+    except OSError:
+        pass
+
+
+def add_cache_headers(response):
+    """after_request hook setting Cache-Control and validators."""
+
+    if request.endpoint == 'static':
+        if 'v' in request.args:
+            response.headers['Cache-Control'] = (
+                f'public, max-age={STATIC_MAX_AGE}, immutable')
+        else:
+            response.headers['Cache-Control'] = (
+                f'public, max-age={STATIC_UNVERSIONED_MAX_AGE}')
+        return response
+
+    validators = g.pop('http_validators', None)
+
+    if validators is not None and response.status_code in (200, 304):
+        etag, last_modified = validators
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Cookie')
+    else:
+        response.headers['Cache-Control'] = 'no-store'
+
+    return response
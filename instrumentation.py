@@ -0,0 +1,249 @@
+"""SQL instrumentation hooked on SQLAlchemy engine events.
+
+`QueryCounter` records every statement run while it's active, for tests.
+
+`SQLInstrumentation` is cheap enough to leave on in production. On a
+sampled share of requests (SQL_SAMPLE_RATE, 0 to 1) it times every
+statement and keeps per-endpoint totals: requests, queries, DB time and
+the slowest statement seen. Requests slower than SQL_SLOW_REQUEST_MS are
+logged with the fingerprints of the statements they ran, so "same query
+with different ids" groups together.
+
+With SQL_QUERY_GUARD on, every request is measured and one running more
+than its budget of queries raises QueryBudgetExceeded, so tests fail when
+a change sneaks an N+1 into a route. The budget is the endpoint's entry in
+SQL_QUERY_BUDGETS, else SQL_QUERY_BUDGET; None means no limit.
+"""
+
+import logging
+import random
+import re
+import threading
+import time
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SQL_SAMPLE_RATE = 0.0
+
+SQL_SLOW_REQUEST_MS = 500
+
+SQL_SLOW_REQUEST_STATEMENTS = 5
+
+# literals and bind params, then runs of placeholders, collapse to '?'
+_LITERALS = re.compile(r"'(?:[^']|'')*'|%\(\w+\)s|%s|\$\d+|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+_VALUES_LISTS = re.compile(r"(\(\?\))(?:\s*,\s*\(\?\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement):
+    """`statement` with literals and parameter lists replaced by '?'.
+
+        >>> fingerprint("SELECT * FROM users WHERE id IN (1, 2, 3)")
+        'SELECT * FROM users WHERE id IN (?)'
+    """
+
+    statement = _LITERALS.sub('?', statement)
+    statement = _PLACEHOLDER_LISTS.sub('?', statement)
+    statement = _VALUES_LISTS.sub(r'\1', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request ran more queries than its budget allows."""
+
+
+class QueryCounter:
+    """Context manager recording every SQL statement run while it's active.
+
+        with QueryCounter() as queries:
+            client.get('/')
+        assert queries.count <= 4
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, 'before_cursor_execute', self._record)
+
+
+class RequestQueries:
+    """Statements and their timings for one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = []
+        self._statement_started = None
+
+    @property
+    def count(self):
+        return len(self.timings)
+
+    @property
+    def db_seconds(self):
+        return sum(seconds for _, seconds in self.timings)
+
+    def slowest(self):
+        """(statement, seconds) of the slowest statement, or (None, 0)."""
+
+        return max(self.timings, key=lambda timing: timing[1],
+                   default=(None, 0))
+
+    def by_fingerprint(self):
+        """[(fingerprint, count, seconds)], most total time first."""
+
+        groups = {}
+        for statement, seconds in self.timings:
+            fp = fingerprint(statement)
+            count, total = groups.get(fp, (0, 0))
+            groups[fp] = (count + 1, total + seconds)
+
+        return sorted(((fp, count, total) for fp, (count, total) in groups.items()),
+                      key=lambda group: group[2], reverse=True)
+
+
+class SQLInstrumentation:
+    """Per-request query counts and DB time, per-endpoint stats and guards."""
+
+    def __init__(self):
+        self.sample_rate = SQL_SAMPLE_RATE
+        self.slow_request_ms = SQL_SLOW_REQUEST_MS
+        self.guard = False
+        self.budget = None
+        self.budgets = {}
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def init_app(self, app):
+        self.sample_rate = app.config.get('SQL_SAMPLE_RATE', self.sample_rate)
+        self.slow_request_ms = app.config.get('SQL_SLOW_REQUEST_MS',
+                                              self.slow_request_ms)
+        self.guard = app.config.get('SQL_QUERY_GUARD', self.guard)
+        self.budget = app.config.get('SQL_QUERY_BUDGET', self.budget)
+        self.budgets = app.config.get('SQL_QUERY_BUDGETS', self.budgets)
+        self.logger = app.logger
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+        if not event.contains(Engine, 'before_cursor_execute', _before_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_execute)
+
+    def budget_for(self, endpoint):
+        return self.budgets.get(endpoint, self.budget)
+
+    ##########################################################################
+    # Request hooks
+
+    def _start(self):
+        if self.guard or random.random() < self.sample_rate:
+            g.sql_queries = RequestQueries()
+
+    def _finish(self, response):
+        queries = g.pop('sql_queries', None)
+        if queries is None:
+            return response
+
+        endpoint = request.endpoint or 'unknown'
+        elapsed_ms = (time.perf_counter() - queries.started) * 1000
+
+        self._record(endpoint, queries)
+
+        if elapsed_ms > self.slow_request_ms:
+            self._log_slow(endpoint, elapsed_ms, queries)
+
+        budget = self.budget_for(endpoint)
+        if self.guard and budget is not None and queries.count > budget:
+            raise QueryBudgetExceeded(
+                f"{endpoint} ran {queries.count} queries, budget is {budget}:\n"
+                + "\n".join(f"  {count} x {fp}"
+                            for fp, count, _ in queries.by_fingerprint()))
+
+        return response
+
+    def _record(self, endpoint, queries):
+        statement, seconds = queries.slowest()
+
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, {
+                'requests': 0,
+                'queries': 0,
+                'db_seconds': 0.0,
+                'max_queries': 0,
+                'slowest_seconds': 0.0,
+                'slowest': None,
+            })
+            stats['requests'] += 1
+            stats['queries'] += queries.count
+            stats['db_seconds'] += queries.db_seconds
+            stats['max_queries'] = max(stats['max_queries'], queries.count)
+            if seconds > stats['slowest_seconds']:
+                stats['slowest_seconds'] = seconds
+                stats['slowest'] = fingerprint(statement)
+
+    def _log_slow(self, endpoint, elapsed_ms, queries):
+        top = queries.by_fingerprint()[:SQL_SLOW_REQUEST_STATEMENTS]
+        self.logger.warning(
+            "slow request %s %s (%s): %.0f ms, %d queries, %.0f ms in db\n%s",
+            request.method, request.full_path.rstrip('?'), endpoint, elapsed_ms,
+            queries.count, queries.db_seconds * 1000,
+            "\n".join(f"  {count} x {total * 1000:.1f} ms  {fp}"
+                      for fp, count, total in top))
+
+    ##########################################################################
+    # Reporting
+
+    def stats(self):
+        """{endpoint: totals and averages} for sampled requests so far."""
+
+        with self._lock:
+            endpoints = {endpoint: dict(stats)
+                         for endpoint, stats in self._endpoints.items()}
+
+        for stats in endpoints.values():
+            stats['avg_queries'] = stats['queries'] / stats['requests']
+            stats['avg_db_ms'] = stats['db_seconds'] * 1000 / stats['requests']
+
+        return endpoints
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+
+def _current_queries():
+    return g.get('sql_queries') if has_app_context() else None
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    queries = _current_queries()
+    if queries is not None:
+        queries._statement_started = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    queries = _current_queries()
+    if queries is not None and queries._statement_started is not None:
+        queries.timings.append(
+            (statement, time.perf_counter() - queries._statement_started))
+        queries._statement_started = None
+
+
+sql_instrumentation = SQLInstrumentation()
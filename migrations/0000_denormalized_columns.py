@@ -0,0 +1,56 @@
+"""Add the denormalized counters, updated_at and the timeline table.
+
+Databases created before these were added to models.py lack them. The
+counters are filled in from the tables they count; on a database that
+already has the columns nothing changes.
+"""
+
+UPGRADE_SQL = """
+    ALTER TABLE users
+        ADD COLUMN IF NOT EXISTS messages_count INTEGER NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS following_count INTEGER NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS followers_count INTEGER NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS likes_count INTEGER NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL
+            DEFAULT timezone('utc', now());
+
+    ALTER TABLE messages
+        ADD COLUMN IF NOT EXISTS likes_count INTEGER NOT NULL DEFAULT 0;
+
+    CREATE TABLE IF NOT EXISTS timeline_entries (
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        message_id INTEGER NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+        timestamp TIMESTAMP NOT NULL,
+        PRIMARY KEY (user_id, message_id)
+    );
+
+    CREATE INDEX IF NOT EXISTS ix_timeline_entries_user_id_timestamp
+        ON timeline_entries (user_id, timestamp, message_id);
+"""
+
+COUNT_SQL = """
+    UPDATE users SET
+        messages_count = (SELECT COUNT(*) FROM messages
+                          WHERE messages.user_id = users.id),
+        following_count = (SELECT COUNT(*) FROM follows
+                           WHERE follows.user_following_id = users.id),
+        followers_count = (SELECT COUNT(*) FROM follows
+                           WHERE follows.user_being_followed_id = users.id),
+        likes_count = (SELECT COUNT(*) FROM likes
+                       WHERE likes.user_id = users.id);
+"""
+
+
+def needed(conn):
+    """Is the users table missing its counters?"""
+
+    return conn.execute(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = current_schema() "
+        "AND table_name = 'users' AND column_name = 'messages_count'").scalar() is None
+
+
+def upgrade(conn):
+    if needed(conn):
+        conn.execute(UPGRADE_SQL)
+        conn.execute(COUNT_SQL)
@@ -0,0 +1,48 @@
+"""Key likes by (user_id, message_id) instead of a surrogate id.
+
+The old table had a unique constraint on message_id alone, so only one
+user could ever like a message, and no index on user_id. This drops the id
+column and the constraint, removes rows missing either id (and any
+duplicates, keeping the first), makes (user_id, message_id) the primary
+key and indexes message_id for "who liked this" lookups. Message like
+counts are recomputed afterwards.
+"""
+
+UPGRADE_SQL = """
+    DELETE FROM likes WHERE user_id IS NULL OR message_id IS NULL;
+
+    DELETE FROM likes AS later
+    USING likes AS earlier
+    WHERE later.user_id = earlier.user_id
+      AND later.message_id = earlier.message_id
+      AND later.id > earlier.id;
+
+    ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_message_id_key;
+    ALTER TABLE likes DROP CONSTRAINT likes_pkey;
+    ALTER TABLE likes DROP COLUMN id;
+    ALTER TABLE likes
+        ALTER COLUMN user_id SET NOT NULL,
+        ALTER COLUMN message_id SET NOT NULL,
+        ADD PRIMARY KEY (user_id, message_id);
+
+    CREATE INDEX ix_likes_message_id ON likes (message_id);
+
+    UPDATE messages
+    SET likes_count = (SELECT COUNT(*) FROM likes
+                       WHERE likes.message_id = messages.id);
+"""
+
+
+def needed(conn):
+    """Does the likes table still have its surrogate id?"""
+
+    return conn.execute(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = current_schema() "
+        "AND table_name = 'likes' AND column_name = 'id'").scalar() is not None
+
+
+def upgrade(conn):
+    if needed(conn):
+        conn.execute(UPGRADE_SQL)
+
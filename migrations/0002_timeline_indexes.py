@@ -0,0 +1,27 @@
+"""Indexes for the profile, home timeline and following queries.
+
+- messages (user_id, timestamp, id): a profile page, and each followed
+  user's part of a home page, is one backwards range scan in page order
+  instead of a scan of all messages and a sort
+- follows (user_following_id, user_being_followed_id): "who does this
+  user follow", used by the home page and the follow buttons, is an
+  index-only scan. The primary key leads with user_being_followed_id, so
+  it already serves "who follows this user".
+
+Both are built concurrently, so writes carry on while they build.
+"""
+
+from migrations import create_index_concurrently
+
+CONCURRENT = True
+
+INDEXES = [
+    ('ix_messages_user_id_timestamp', 'messages', ['user_id', 'timestamp', 'id']),
+    ('ix_follows_user_following_id', 'follows',
+     ['user_following_id', 'user_being_followed_id']),
+]
+
+
+def upgrade(conn):
+    for name, table, columns in INDEXES:
+        create_index_concurrently(conn, name, table, columns)
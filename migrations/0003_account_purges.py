@@ -0,0 +1,12 @@
+"""Add the queue of large accounts waiting to be purged in batches."""
+
+UPGRADE_SQL = """
+    CREATE TABLE IF NOT EXISTS account_purges (
+        user_id INTEGER PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE,
+        requested_at TIMESTAMP NOT NULL
+    );
+"""
+
+
+def upgrade(conn):
+    conn.execute(UPGRADE_SQL)
@@ -0,0 +1,25 @@
+"""Trigram index for username search (see search.py).
+
+A schema made by create_all gets it from search.py's after_create hook;
+this adds it to databases that predate it, which otherwise keep searching
+with the in-process ngram index. Built concurrently, so sign-ups and
+renames carry on meanwhile. Where pg_trgm isn't available this does
+nothing and search stays on the ngram backend.
+
+Running workers pick their search backend once, so restart them after
+this has run.
+"""
+
+from migrations import create_index_concurrently
+from search import trigram_available
+
+CONCURRENT = True
+
+
+def upgrade(conn):
+    if not trigram_available(conn):
+        return
+
+    conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    create_index_concurrently(conn, 'ix_users_username_trgm', 'users',
+                              ['username gin_trgm_ops'], using='gin')
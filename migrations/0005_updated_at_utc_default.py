@@ -0,0 +1,12 @@
+"""Default users.updated_at to UTC, as the app writes it.
+
+0000 first added the column with `DEFAULT now()`, the server's local time.
+"""
+
+UPGRADE_SQL = """
+    ALTER TABLE users ALTER COLUMN updated_at SET DEFAULT timezone('utc', now());
+"""
+
+
+def upgrade(conn):
+    conn.execute(UPGRADE_SQL)
@@ -0,0 +1,130 @@
+"""Versioned schema migrations.
+
+Each module here named like `0002_some_change.py` is one migration, applied
+in order of its number. The versions applied to a database are recorded
+in its `schema_migrations` table:
+
+    flask db-status       list migrations and whether each is applied
+    flask db-upgrade      apply the pending ones
+
+A migration module has an `upgrade(conn)` function. It runs in a
+transaction together with recording its version, unless the module sets
+`CONCURRENT = True`. Such migrations run on an autocommit connection so
+they can use CREATE INDEX CONCURRENTLY (see `create_index_concurrently`)
+and build indexes on a live database without blocking writes; they have
+to be safe to re-run if interrupted.
+
+A database made from scratch by `db.create_all()` already has the current
+schema, so `stamp` records every migration as applied without running it.
+"""
+
+import importlib
+import os
+import re
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, func, select
+
+MIGRATION_MODULE = re.compile(r'^(\d{4})_\w+\.py$')
+
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('version', String, primary_key=True),
+    Column('applied_at', DateTime, nullable=False, server_default=func.now()),
+)
+
+
+def discover():
+    """[(version, module name)] of every migration, in order."""
+
+    found = []
+    for filename in os.listdir(os.path.dirname(__file__)):
+        match = MIGRATION_MODULE.match(filename)
+        if match:
+            found.append((match.group(1), filename[:-3]))
+
+    return sorted(found)
+
+
+def load(name):
+    return importlib.import_module(f'{__name__}.{name}')
+
+
+def applied(engine):
+    """Set of versions recorded as applied to `engine`'s database."""
+
+    schema_migrations.create(engine, checkfirst=True)
+
+    with engine.connect() as conn:
+        return _versions(conn)
+
+
+def pending(engine):
+    done = applied(engine)
+    return [(version, name) for version, name in discover()
+            if version not in done]
+
+
+def _versions(conn):
+    return {version for (version,) in
+            conn.execute(select([schema_migrations.c.version]))}
+
+
+def _record(conn, version):
+    conn.execute(schema_migrations.insert().values(version=version))
+
+
+def upgrade(engine, progress=print):
+    """Apply every pending migration, in order. Returns how many ran."""
+
+    todo = pending(engine)
+
+    for version, name in todo:
+        module = load(name)
+        progress(f"applying {name}")
+
+        if getattr(module, 'CONCURRENT', False):
+            with engine.connect() as conn:
+                module.upgrade(conn.execution_options(
+                    isolation_level='AUTOCOMMIT'))
+            with engine.begin() as conn:
+                _record(conn, version)
+        else:
+            with engine.begin() as conn:
+                module.upgrade(conn)
+                _record(conn, version)
+
+    return len(todo)
+
+
+def stamp(engine):
+    """Record every migration as applied, for a freshly created schema."""
+
+    with engine.begin() as conn:
+        schema_migrations.create(conn, checkfirst=True)
+        done = _versions(conn)
+        for version, name in discover():
+            if version not in done:
+                _record(conn, version)
+
+
+def create_index_concurrently(conn, name, table, columns, unique=False, using=None):
+    """CREATE INDEX CONCURRENTLY, replacing an invalid leftover of `name`.
+
+    `using` names the index method, like 'gin'; columns can carry an
+    operator class, like 'username gin_trgm_ops'.
+
+    A concurrent build that fails leaves an INVALID index behind, which
+    `IF NOT EXISTS` would otherwise keep forever. `conn` must be in
+    autocommit mode.
+    """
+
+    invalid = conn.execute(
+        "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = indexrelid "
+        "WHERE relname = %s AND NOT indisvalid", (name,)).scalar()
+    if invalid:
+        conn.execute(f'DROP INDEX CONCURRENTLY "{name}"')
+
+    conn.execute(
+        f'CREATE {"UNIQUE " if unique else ""}INDEX CONCURRENTLY IF NOT EXISTS '
+        f'"{name}" ON "{table}" {f"USING {using} " if using else ""}'
+        f'({", ".join(columns)})')
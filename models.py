@@ -2,11 +2,87 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from db_routing import RoutingSQLAlchemy
+from passwords import PasswordHasher
+
+hasher = PasswordHasher()
+db = RoutingSQLAlchemy()
+
+
+class utcnow(FunctionElement):
+    """The current UTC time as a naive timestamp, as `datetime.utcnow()`."""
+
+    type = db.DateTime()
+
+
+@compiles(utcnow)
+def _utcnow(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is already UTC
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    # now() is in the session's time zone
+    return "timezone('utc', now())"
+
+
+def insert_ignoring_duplicates(table, dialect):
+    """INSERT into `table` that skips rows whose key already exists.
+
+    Postgres and SQLite both do this in the statement; others return None,
+    and callers insert in a savepoint and catch the IntegrityError instead.
+    """
+
+    if dialect.name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect.name == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    return None
+
+
+def insert_new(table, **values):
+    """Insert one row unless its key exists. True if it was inserted."""
+
+    statement = table.insert().values(**values)
+    ignoring = insert_ignoring_duplicates(
+        table, db.session.get_bind(clause=statement).dialect)
+
+    if ignoring is not None:
+        return db.session.execute(ignoring.values(**values)).rowcount == 1
+
+    try:
+        with db.session.begin_nested():
+            db.session.execute(statement)
+    except IntegrityError:
+        return False
+    return True
+
+
+def delete_returning(table, condition, column):
+    """DELETE the rows of `table` matching `condition`. Their `column` values.
+
+    `column` together with `condition` has to pick out single rows, like
+    the other half of a composite key. Postgres returns the values from the
+    DELETE itself; elsewhere they are selected, locked where the database
+    can, and exactly those rows deleted in the same transaction.
+    """
+
+    statement = table.delete().where(condition)
+
+    if db.session.get_bind(clause=statement).dialect.name == 'postgresql':
+        return [value for (value,) in db.session.execute(statement.returning(column))]
+
+    values = [value for (value,) in db.session.execute(
+        db.select([column]).where(condition).with_for_update())]
+    if values:
+        db.session.execute(statement.where(column.in_(values)))
+    return values
 
 
 class Follows(db.Model):
@@ -26,26 +102,155 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key leads with the followed user; this one answers
+    # "who does this user follow" (see migrations/0002_timeline_indexes.py)
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
+    @classmethod
+    def add(cls, follower_id, followed_id):
+        """Follow a user with one upsert. True if not following already."""
+
+        return insert_new(cls.__table__,
+                          user_following_id=follower_id,
+                          user_being_followed_id=followed_id)
+
+    @classmethod
+    def remove(cls, follower_id, followed_id):
+        """Unfollow a user with one delete. True if they were followed."""
+
+        result = db.session.execute(
+            cls.__table__
+            .delete()
+            .where(cls.user_following_id == follower_id)
+            .where(cls.user_being_followed_id == followed_id))
+        return result.rowcount == 1
+
+    @classmethod
+    def following_among(cls, follower_id, user_ids):
+        """Set of the `user_ids` that `follower_id` follows, in one query.
+
+        An index range scan of ix_follows_user_following_id, so it's as
+        current as the database and costs the same for any follower.
+        """
+
+        if not user_ids:
+            return set()
+
+        return {followed_id for (followed_id,) in (db.session
+                .query(cls.user_being_followed_id)
+                .filter(cls.user_following_id == follower_id,
+                        cls.user_being_followed_id.in_(user_ids)))}
+
 
 class Likes(db.Model):
-    """Mapping user likes to warbles."""
+    """Mapping user likes to warbles.
+
+    Keyed by (user_id, message_id), so a user likes a message at most once
+    and "what has this user liked" is a primary key range scan. The
+    message_id index answers "who liked this message".
+    """
 
-    __tablename__ = 'likes' 
+    __tablename__ = 'likes'
 
-    id = db.Column(
+    user_id = db.Column(
         db.Integer,
-        primary_key=True
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    __table_args__ = (
+        db.Index('ix_likes_message_id', 'message_id'),
+    )
+
+    @classmethod
+    def add(cls, user_id, message_id):
+        """Like a message with one upsert. True if it wasn't liked already."""
+
+        return insert_new(cls.__table__, user_id=user_id, message_id=message_id)
+
+    @classmethod
+    def remove(cls, user_id, message_id):
+        """Unlike a message with one delete. True if it was liked."""
+
+        result = db.session.execute(
+            cls.__table__
+            .delete()
+            .where(cls.user_id == user_id)
+            .where(cls.message_id == message_id))
+        return result.rowcount == 1
+
+    @classmethod
+    def liked_among(cls, user_id, message_ids):
+        """Set of the `message_ids` that `user_id` has liked, in one query."""
+
+        if not message_ids:
+            return set()
+
+        return {message_id for (message_id,) in (db.session
+                .query(cls.message_id)
+                .filter(cls.user_id == user_id,
+                        cls.message_id.in_(message_ids)))}
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into a user's home timeline.
+
+    Only populated when fan-out on write is enabled (see timelines.py).
+    """
+
+    __tablename__ = 'timeline_entries'
+
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        primary_key=True,
+    )
+
+    # copied from the message so a timeline page is one index range scan
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_id_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+    )
+
+
+class AccountPurge(db.Model):
+    """A large account waiting to be deleted in batches (see account_purge.py).
+
+    The row goes when the user's row finally does, by cascade.
+    """
+
+    __tablename__ = 'account_purges'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    requested_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
     )
 
 
@@ -94,25 +299,68 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message')
+    # Denormalized counts shown on profiles, kept in step by counters.py
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Moves on every change to the row, counter bumps included; pages use
+    # it as their HTTP validator (see http_cache.py)
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        server_default=utcnow(),
+    )
+
+    # the foreign keys cascade deletes, so deleting a user doesn't load these
+    messages = db.relationship('Message', passive_deletes=True)
 
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_being_followed_id == id),
-        secondaryjoin=(Follows.user_following_id == id)
+        secondaryjoin=(Follows.user_following_id == id),
+        passive_deletes=True,
     )
 
     following = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_following_id == id),
-        secondaryjoin=(Follows.user_being_followed_id == id)
+        secondaryjoin=(Follows.user_being_followed_id == id),
+        passive_deletes=True,
     )
 
     likes = db.relationship(
         'Message',
-        secondary="likes"
+        secondary="likes",
+        passive_deletes=True,
     )
 
     def __repr__(self):
@@ -121,14 +369,12 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return bool(Follows.following_among(other_user.id, [self.id]))
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return bool(Follows.following_among(self.id, [other_user.id]))
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -137,7 +383,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -158,13 +404,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made at an outdated bcrypt cost, it is replaced
+        with a fresh one; the caller's next commit saves it.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -188,7 +439,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -197,8 +448,31 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # Denormalized like count, kept in step by counters.py
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     user = db.relationship('User')
 
+    # profile pages and home timelines read one user's messages newest first
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp', 'id'),
+    )
+
+    @classmethod
+    def with_authors(cls):
+        """Query for messages that loads each author in the same SELECT.
+
+        Use this for any list of messages whose template shows `msg.user`;
+        a plain query lazy-loads one author per row.
+        """
+
+        return cls.query.options(db.joinedload(cls.user))
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
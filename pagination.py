@@ -0,0 +1,116 @@
+"""Keyset (cursor) pagination.
+
+Pages are fetched with `WHERE (key columns) < (cursor) ORDER BY key DESC
+LIMIT n` rather than OFFSET, so page 1000 costs the same index range scan
+as page 1. The cursor is the key of the last row on the previous page,
+encoded for use as a `?before=` query parameter.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import abort
+from sqlalchemy import not_, tuple_, DateTime
+
+PAGE_SIZE = 100
+
+EPOCH = datetime(1970, 1, 1)
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def encode_cursor(values):
+    """Encode a row key, like (timestamp, id), as a URL-safe string."""
+
+    parts = []
+    for value in values:
+        if isinstance(value, datetime):
+            value = (value - EPOCH) // timedelta(microseconds=1)
+        parts.append(str(value))
+
+    return '_'.join(parts)
+
+
+def decode_cursor(cursor, keys):
+    """Decode a cursor made by `encode_cursor` for the given key columns.
+
+    Aborts with a 400 if the cursor is malformed.
+    """
+
+    parts = cursor.split('_')
+    if len(parts) != len(keys):
+        abort(400)
+
+    try:
+        numbers = [int(part) for part in parts]
+    except ValueError:
+        abort(400)
+
+    return tuple(EPOCH + timedelta(microseconds=number)
+                 if isinstance(key.type, DateTime) else number
+                 for key, number in zip(keys, numbers))
+
+
+def before_filter(keys, before):
+    """Condition selecting rows older than the `before` cursor."""
+
+    values = decode_cursor(before, keys)
+    if len(keys) == 1:
+        return keys[0] < values[0]
+    return tuple_(*keys) < tuple_(*values)
+
+
+def make_page(rows, keys, per_page=PAGE_SIZE, cursor_of=None):
+    """Page of the first `per_page` of `rows`, fetched with one extra row.
+
+    The extra row, if there, means another page follows.
+    """
+
+    items = rows[:per_page]
+    next_cursor = None
+
+    if len(rows) > per_page:
+        if cursor_of is None:
+            def cursor_of(row):
+                return [getattr(row, key.key) for key in keys]
+        next_cursor = encode_cursor(cursor_of(items[-1]))
+
+    return Page(items, next_cursor)
+
+
+def paginate(query, keys, before=None, per_page=PAGE_SIZE, cursor_of=None,
+             recent=None):
+    """Return one Page of `query`, newest first by `keys`.
+
+    `keys` is a list of columns forming a unique sort key, for example
+    [Message.timestamp, Message.id]. `before` is a cursor from a previous
+    page. `cursor_of` maps a result row to its key values; by default the
+    attributes named after the key columns are used.
+
+    `recent` is an optional lower bound on the first key, like a recent
+    timestamp, which lets Postgres read only the newest partitions (see
+    partitions.py). A first page fetches the rows inside it first. When
+    they don't fill the page, a second query fetches the rest from before
+    it: two queries, though together they read no more than one would.
+    """
+
+    if recent is not None and not before:
+        rows = fetch_rows(query.filter(recent), keys, per_page + 1)
+        if len(rows) <= per_page:
+            rows += fetch_rows(query.filter(not_(recent)), keys,
+                               per_page + 1 - len(rows))
+        return make_page(rows, keys, per_page, cursor_of)
+
+    if before:
+        query = query.filter(before_filter(keys, before))
+
+    return make_page(fetch_rows(query, keys, per_page + 1), keys, per_page, cursor_of)
+
+
+def fetch_rows(query, keys, limit):
+    """The first `limit` rows of `query`, newest first by `keys`."""
+
+    return (query
+            .order_by(*[key.desc() for key in keys])
+            .limit(limit)
+            .all())
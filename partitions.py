@@ -0,0 +1,240 @@
+"""Monthly partitions of the messages table, and archival of old months.
+
+By default `messages` is one plain table. On Postgres it can be converted
+once into a table partitioned by month on `timestamp`:
+
+    flask partition-messages          convert (takes a lock for the copy)
+    flask maintain-partitions         create the coming months' partitions
+                                      and archive months past the cutoff
+
+and MESSAGE_PARTITIONS set so the app knows. Run maintain-partitions
+daily, from cron or similar.
+
+A partitioned table can only have unique keys that include the partition
+key, so its primary key becomes (id, timestamp) and likes and
+timeline_entries can no longer have foreign keys to it. A trigger deletes
+a message's likes and timeline entries instead, as the cascades did.
+Models keep treating `id` as the key; ids still come from one sequence.
+
+Pages of newest messages first look only at the last MESSAGE_RECENT_DAYS
+(see `recent`), which Postgres answers from the newest partitions alone,
+and fetch the rest of the page from the older ones when that doesn't fill
+it.
+
+Archiving detaches each month older than MESSAGE_ARCHIVE_MONTHS and
+either attaches it to `messages_archive` or, given a directory, writes it
+to a gzipped CSV file there and drops it. Archived messages leave
+timelines and profiles, and their authors' message counts drop to match.
+Their likes rows stay, so like counts don't change.
+"""
+
+from datetime import datetime, timedelta
+import gzip
+import os
+import re
+
+from flask import current_app
+
+from models import Message
+from pagination import PAGE_SIZE
+
+MESSAGE_RECENT_DAYS = 31
+
+PARTITION_MONTHS_AHEAD = 3
+
+PARTITION_NAME = re.compile(r'^messages_y(\d{4})m(\d{2})$')
+
+CONVERT_SQL = """
+    LOCK TABLE messages IN ACCESS EXCLUSIVE MODE;
+    ALTER TABLE messages RENAME TO messages_unpartitioned;
+    ALTER SEQUENCE messages_id_seq OWNED BY NONE;
+    CREATE TABLE messages (LIKE messages_unpartitioned INCLUDING DEFAULTS)
+        PARTITION BY RANGE ("timestamp");
+    CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+"""
+
+# after the partitions for the existing rows are created
+COPY_SQL = """
+    INSERT INTO messages SELECT * FROM messages_unpartitioned;
+
+    -- CASCADE takes the likes and timeline_entries foreign keys with it
+    DROP TABLE messages_unpartitioned CASCADE;
+    ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+
+    ALTER TABLE messages ADD PRIMARY KEY (id, "timestamp");
+    ALTER TABLE messages
+        ADD FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE;
+    CREATE INDEX ix_messages_user_id_timestamp ON messages (user_id, "timestamp", id);
+    CREATE INDEX ix_messages_id ON messages (id);
+
+    CREATE OR REPLACE FUNCTION messages_cascade_delete() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM likes WHERE message_id = OLD.id;
+        DELETE FROM timeline_entries WHERE message_id = OLD.id;
+        RETURN OLD;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER messages_cascade_delete AFTER DELETE ON messages
+        FOR EACH ROW EXECUTE FUNCTION messages_cascade_delete();
+"""
+
+ARCHIVE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS messages_archive (LIKE messages)
+        PARTITION BY RANGE ("timestamp")
+"""
+
+
+def enabled():
+    """Is the messages table partitioned, as far as this app is told?"""
+
+    return current_app.config.get('MESSAGE_PARTITIONS', False)
+
+
+def recent(rows=None):
+    """Condition limiting a newest-first message page to the recent partitions.
+
+    None when messages aren't partitioned, or when `rows`, the size of the
+    whole listing if known, is no more than a page: the window couldn't
+    fill that page, so `paginate` reads all partitions in one query.
+    """
+
+    if not enabled() or (rows is not None and rows <= PAGE_SIZE):
+        return None
+
+    days = current_app.config.get('MESSAGE_RECENT_DAYS', MESSAGE_RECENT_DAYS)
+    return Message.timestamp >= datetime.utcnow() - timedelta(days=days)
+
+
+def month_start(when):
+    return datetime(when.year, when.month, 1)
+
+
+def next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'messages_y{month.year:04d}m{month.month:02d}'
+
+
+def partitions(conn, parent='messages'):
+    """{month: partition name} of the monthly partitions of `parent`."""
+
+    names = conn.execute(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = CAST(%s AS regclass)", (parent,))
+
+    found = {}
+    for (name,) in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            found[datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+    return found
+
+
+def is_partitioned(conn):
+    return conn.execute(
+        "SELECT relkind = 'p' FROM pg_class "
+        "WHERE oid = CAST('messages' AS regclass)").scalar()
+
+
+def create_partition(conn, month):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF messages "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}')")
+
+
+def create_partitions(conn, ahead=PARTITION_MONTHS_AHEAD, start=None):
+    """Create partitions from the month of `start` (default now) to `ahead` months on.
+
+    Returns the names of those that didn't exist yet.
+    """
+
+    existing = partitions(conn)
+    month = month_start(start or datetime.utcnow())
+    last = month_start(datetime.utcnow())
+    for _ in range(ahead):
+        last = next_month(last)
+
+    created = []
+    while month <= last:
+        if month not in existing:
+            create_partition(conn, month)
+            created.append(partition_name(month))
+        month = next_month(month)
+
+    return created
+
+
+def convert(conn, ahead=PARTITION_MONTHS_AHEAD):
+    """Turn the plain messages table into a monthly partitioned one.
+
+    Copies every row, so run it in a quiet moment; `conn` should be in a
+    transaction, which holds an exclusive lock on messages throughout.
+    """
+
+    if is_partitioned(conn):
+        return False
+
+    oldest = conn.execute('SELECT min("timestamp") FROM messages').scalar()
+
+    conn.execute(CONVERT_SQL)
+    create_partitions(conn, ahead, start=oldest)
+    conn.execute(COPY_SQL)
+
+    return True
+
+
+def archive(conn, before, directory=None):
+    """Move every monthly partition wholly before `before` out of messages.
+
+    With `directory`, each goes to <directory>/<partition>.csv.gz and is
+    dropped; otherwise it's attached to messages_archive. Returns the
+    names of the archived partitions.
+    """
+
+    archived = []
+    if directory is None:
+        conn.execute(ARCHIVE_TABLE_SQL)
+
+    for month, name in sorted(partitions(conn).items()):
+        if next_month(month) > before:
+            continue
+
+        # timelines only show the newest messages; these are long gone from view
+        conn.execute(f"DELETE FROM timeline_entries "
+                     f"WHERE message_id IN (SELECT id FROM {name})")
+        conn.execute(f"UPDATE users "
+                     f"SET messages_count = users.messages_count - archived.count, "
+                     f"    updated_at = timezone('utc', now()) "
+                     f"FROM (SELECT user_id, count(*) FROM {name} GROUP BY user_id) "
+                     f"     AS archived "
+                     f"WHERE users.id = archived.user_id")
+        conn.execute(f"ALTER TABLE messages DETACH PARTITION {name}")
+
+        if directory is None:
+            conn.execute(
+                f"ALTER TABLE messages_archive ATTACH PARTITION {name} "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}')")
+        else:
+            path = os.path.join(directory, f'{name}.csv.gz')
+            with gzip.open(path, 'wt', newline='') as out:
+                with conn.connection.cursor() as cursor:
+                    cursor.copy_expert(
+                        f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", out)
+            conn.execute(f"DROP TABLE {name}")
+
+        archived.append(name)
+
+    return archived
+
+
+def archive_cutoff(months):
+    """Start of the month `months` months before this one."""
+
+    month = month_start(datetime.utcnow())
+    for _ in range(months):
+        month = month_start(month - timedelta(days=1))
+    return month
@@ -0,0 +1,115 @@
+"""Password hashing on a small, bounded process pool.
+
+bcrypt is deliberately slow (about 250 ms at cost 12). Signup, login and
+profile edits run it on a pool of BCRYPT_POOL_SIZE worker processes per
+web process. The request thread still waits the full hashing time for its
+result; what the pool buys is a cap on how many hashes run at once, so a
+login burst queues for the pool instead of taking every CPU from the
+pages being served. Each web process gets its own pool, so keep it small:
+with N web processes there are N * BCRYPT_POOL_SIZE hashing processes. A
+pool size of 0 hashes inline, which is handy in tests and one-off scripts.
+If a worker dies, say to the OOM killer, the broken pool is replaced and
+the hash retried once, then run inline.
+
+The bcrypt cost is BCRYPT_LOG_ROUNDS. When a user logs in with a hash made
+at a lower cost, `needs_rehash` says so and the caller can store a fresh
+hash while it still has the plaintext password. Stronger hashes are kept
+if the cost is lowered.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import threading
+
+import bcrypt
+
+BCRYPT_LOG_ROUNDS = 12
+
+BCRYPT_POOL_SIZE = 2
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_cost(hashed):
+    """The cost factor a bcrypt hash was made with, like 12 for '$2b$12$...'."""
+
+    return int(hashed.split('$')[2])
+
+
+class PasswordHasher:
+    """bcrypt hashing and checking, run on a process pool."""
+
+    def __init__(self, rounds=BCRYPT_LOG_ROUNDS, pool_size=BCRYPT_POOL_SIZE):
+        self.rounds = rounds
+        self.pool_size = pool_size
+
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def init_app(self, app):
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', self.rounds)
+        self.pool_size = app.config.get('BCRYPT_POOL_SIZE', self.pool_size)
+
+    def _run(self, fn, *args):
+        if not self.pool_size:
+            return fn(*args)
+
+        for _ in range(2):
+            pool = self._get_pool()
+            try:
+                return pool.submit(fn, *args).result()
+            except BrokenProcessPool:
+                self._discard(pool)
+
+        return fn(*args)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn, not fork: workers shouldn't inherit db connections
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.pool_size,
+                    mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _discard(self, pool):
+        # a broken pool fails every later submit; another thread may
+        # already have replaced it
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def hash(self, password):
+        """bcrypt hash of `password` at the configured cost, as text."""
+
+        if not password:
+            raise ValueError('Password must be non-empty.')
+
+        return self._run(_hash, password.encode('UTF-8'), self.rounds)
+
+    def check(self, hashed, password):
+        """Does `password` match the bcrypt hash `hashed`?"""
+
+        if not password:
+            return False
+
+        return self._run(_check, hashed.encode('UTF-8'), password.encode('UTF-8'))
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made at a lower cost than the configured one?"""
+
+        return hash_cost(hashed) < self.rounds
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
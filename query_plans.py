@@ -0,0 +1,129 @@
+"""Flag route queries that fall back to reading whole tables.
+
+    flask check-seq-scans [--user-id 42]
+
+requests the main read pages as a logged-in user, captures every SELECT
+they run and EXPLAINs it with sequential scans disabled. On the small
+tables of a dev or test database the planner often prefers a seq scan
+anyway; with `enable_seqscan` off it only picks one when no index can
+serve the query, which is what a big database would be stuck with.
+
+Without seq scans the planner can still read a whole table through an
+index: an index scan with no index condition, only a Filter applied to
+every row (like `user_id = 1 OR user_id IN (...)` walking the timestamp
+index). Those are flagged too.
+
+Statements that read a whole table on purpose (the in-process username
+index loads everything) are listed in FULL_SCANS and not flagged.
+"""
+
+import re
+
+from flask import current_app
+
+from instrumentation import QueryCounter, fingerprint
+
+# fingerprints of statements meant to read every row
+FULL_SCANS = [
+    re.compile(r'^SELECT users\.id, users\.username FROM users$'),
+]
+
+EXPLAIN_SQL = "EXPLAIN (FORMAT JSON) "
+
+
+def route_paths(user_id, message_id):
+    """The read pages to check, around one user and one message."""
+
+    return [
+        '/',
+        '/users',
+        '/users?q=a',
+        f'/users/{user_id}',
+        f'/users/{user_id}/following',
+        f'/users/{user_id}/followers',
+        f'/users/{user_id}/likes',
+        f'/messages/{message_id}',
+    ]
+
+
+# scan nodes and the key holding the condition that limits what they read
+INDEX_SCANS = {
+    'Index Scan': 'Index Cond',
+    'Index Only Scan': 'Index Cond',
+    'Bitmap Heap Scan': 'Recheck Cond',
+}
+
+
+def full_scans(plan):
+    """Names of the relations a JSON plan node (and its children) reads whole.
+
+    That's a seq scan, or an index scan that filters rows without an
+    index condition.
+    """
+
+    found = []
+    node_type = plan.get('Node Type')
+    if node_type == 'Seq Scan':
+        found.append(plan['Relation Name'])
+    elif (node_type in INDEX_SCANS
+            and 'Filter' in plan
+            and INDEX_SCANS[node_type] not in plan):
+        found.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        found.extend(full_scans(child))
+    return found
+
+
+def explain(engine, statement, parameters):
+    """The JSON plan of `statement`, with sequential scans disabled."""
+
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(EXPLAIN_SQL + statement, parameters)
+            (result,), = cursor.fetchall()
+        return result[0]['Plan']
+    finally:
+        raw.rollback()
+        raw.close()
+
+
+def intended(statement):
+    return any(pattern.match(fingerprint(statement)) for pattern in FULL_SCANS)
+
+
+class _Capture(QueryCounter):
+    """QueryCounter keeping each SELECT's parameters too."""
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and not executemany:
+            self.statements.append((statement, parameters))
+
+
+def check_routes(paths, session, engine=None):
+    """[(path, statement, tables)] for each captured query that reads a whole table.
+
+    `session` is put in the test client's Flask session, to log in.
+    """
+
+    app = current_app._get_current_object()
+    engine = engine or app.extensions['sqlalchemy'].db.engine
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess.update(session)
+
+    flagged = []
+    for path in paths:
+        with _Capture() as captured:
+            client.get(path)
+
+        for statement, parameters in captured.statements:
+            if intended(statement):
+                continue
+            tables = full_scans(explain(engine, statement, parameters))
+            if tables:
+                flagged.append((path, statement, tables))
+
+    return flagged
@@ -0,0 +1,254 @@
+"""Username search for the user directory.
+
+`LIKE '%q%'` can't use a btree index, so every directory search used to be
+a sequential scan of `users`. Searches now go through one of two backends:
+
+- trigram: on Postgres with the `pg_trgm` extension, a GIN trigram index on
+  `users.username` answers `ILIKE '%q%'` directly.
+- ngram: everywhere else (SQLite, or Postgres without `pg_trgm`), an
+  in-process trigram -> user ids index, loaded on first search and kept up
+  to date by the ORM events of this process.
+
+Both rank prefix matches first, then shorter usernames, and return at most
+SEARCH_LIMIT users.
+
+The in-process index only sees renames and deletes made by its own process.
+It picks up other processes' sign-ups every NGRAM_REFRESH_SECONDS, and
+results are always re-checked against the database, so a stale index can
+miss a renamed user but never returns a wrong one.
+"""
+
+from collections import defaultdict
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import DDL, case, event, func
+from sqlalchemy.orm import Session
+
+from models import db, User
+
+SEARCH_LIMIT = 50
+
+NGRAM = 3
+
+NGRAM_REFRESH_SECONDS = 60
+
+TRIGRAM_INDEX_DDL = DDL(
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm; "
+    "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+    "ON users USING gin (username gin_trgm_ops)")
+
+
+def trigram_available(bind):
+    """Can the pg_trgm extension be used on this database?"""
+
+    if bind.dialect.name != 'postgresql':
+        return False
+
+    return bind.execute(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    ).scalar() is not None
+
+
+event.listen(
+    User.__table__,
+    'after_create',
+    TRIGRAM_INDEX_DDL.execute_if(
+        callable_=lambda ddl, target, bind, **kw: trigram_available(bind)))
+
+
+def ngrams(text):
+    """Set of lowercased NGRAM-character substrings of `text`."""
+
+    text = text.lower()
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+def rank(username, query):
+    """Sort key: prefix matches first, then shorter, then alphabetical."""
+
+    return (not username.lower().startswith(query.lower()),
+            len(username),
+            username)
+
+
+class NgramIndex:
+    """In-process trigram index of usernames."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = defaultdict(set)
+        self._usernames = {}
+        self._max_id = 0
+        self._refreshed_at = None
+
+    @property
+    def loaded(self):
+        return self._refreshed_at is not None
+
+    def add(self, user_id, username):
+        with self._lock:
+            self._discard(user_id)
+            self._usernames[user_id] = username
+            self._max_id = max(self._max_id, user_id)
+            for gram in ngrams(username):
+                self._postings[gram].add(user_id)
+
+    def remove(self, user_id):
+        with self._lock:
+            self._discard(user_id)
+
+    def _discard(self, user_id):
+        username = self._usernames.pop(user_id, None)
+        if username is None:
+            return
+
+        for gram in ngrams(username):
+            postings = self._postings[gram]
+            postings.discard(user_id)
+            if not postings:
+                del self._postings[gram]
+
+    def refresh(self, max_age=NGRAM_REFRESH_SECONDS):
+        """Load users this process hasn't indexed yet, at most every `max_age` s."""
+
+        if (self._refreshed_at is not None
+                and time.monotonic() - self._refreshed_at < max_age):
+            return
+
+        rows = (db.session
+                .query(User.id, User.username)
+                .filter(User.id > self._max_id)
+                .yield_per(10000))
+        for user_id, username in rows:
+            self.add(user_id, username)
+
+        self._refreshed_at = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._usernames.clear()
+            self._max_id = 0
+            self._refreshed_at = None
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Ids of indexed users whose username contains `query`, best first."""
+
+        needle = query.lower()
+
+        with self._lock:
+            grams = ngrams(needle)
+            if grams:
+                postings = sorted((self._postings.get(gram, set())
+                                   for gram in grams), key=len)
+                candidates = set.intersection(*postings)
+            else:
+                # shorter than one n-gram: union every gram containing it
+                candidates = set()
+                for gram, postings in self._postings.items():
+                    if needle in gram:
+                        candidates |= postings
+
+            matches = [(user_id, self._usernames[user_id])
+                       for user_id in candidates
+                       if needle in self._usernames[user_id].lower()]
+
+        matches.sort(key=lambda match: rank(match[1], query))
+        return [user_id for user_id, username in matches[:limit]]
+
+
+ngram_index = NgramIndex()
+
+_backends = {}
+
+
+def backend():
+    """Name of the search backend for the current app: 'trigram' or 'ngram'."""
+
+    configured = current_app.config.get('USER_SEARCH_BACKEND', 'auto')
+    if configured != 'auto':
+        return configured
+
+    url = str(db.engine.url)
+    if url not in _backends:
+        with db.engine.connect() as conn:
+            installed = trigram_available(conn) and conn.execute(
+                "SELECT 1 FROM pg_indexes "
+                "WHERE indexname = 'ix_users_username_trgm'").scalar()
+        _backends[url] = 'trigram' if installed else 'ngram'
+
+    return _backends[url]
+
+
+def escape_like(text):
+    """Escape LIKE wildcards so `text` only matches literally."""
+
+    return (text
+            .replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_'))
+
+
+def search_users(query, limit=SEARCH_LIMIT):
+    """Users whose username contains `query`, prefix matches first."""
+
+    if backend() == 'trigram':
+        needle = escape_like(query)
+        is_prefix = User.username.ilike(f"{needle}%", escape='\\')
+
+        return (User
+                .query
+                .filter(User.username.ilike(f"%{needle}%", escape='\\'))
+                .order_by(case([(is_prefix, 0)], else_=1),
+                          func.length(User.username),
+                          User.username)
+                .limit(limit)
+                .all())
+
+    ngram_index.refresh()
+    ids = ngram_index.search(query, limit)
+    users = User.query.filter(User.id.in_(ids)).all() if ids else []
+
+    # re-check against the database in case this process missed a rename
+    users = [user for user in users if query.lower() in user.username.lower()]
+    users.sort(key=lambda user: rank(user.username, query))
+    return users
+
+
+##############################################################################
+# Keep the in-process index in step with committed changes
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _queue_index_update(mapper, connection, user):
+    Session.object_session(user).info.setdefault('search_changes', []).append(
+        (user.id, user.username))
+
+
+@event.listens_for(User, 'after_delete')
+def _queue_index_delete(mapper, connection, user):
+    Session.object_session(user).info.setdefault('search_changes', []).append(
+        (user.id, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_index_changes(session):
+    changes = session.info.pop('search_changes', [])
+
+    # not loaded yet: the first search reads these from the database
+    if not ngram_index.loaded:
+        return
+
+    for user_id, username in changes:
+        if username is None:
+            ngram_index.remove(user_id)
+        else:
+            ngram_index.add(user_id, username)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_index_changes(session):
+    session.info.pop('search_changes', None)
@@ -1,20 +1,47 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db
+    python seed.py [--data-dir generator] [--chunk-size 50000] [--keep-indexes]
+
+Rows are streamed into the database (COPY on Postgres) and committed in
+chunks, so this works for multi-million row capacity-test datasets too.
+"""
+
+import argparse
+import os
+
+from app import app, db
+from bulk_load import CHUNK_SIZE, load_tables
 from models import User, Message, Follows
+import counters
+import migrations
+import timelines
 
+parser = argparse.ArgumentParser(description="Seed Warbler from CSV files.")
+parser.add_argument('--data-dir', default='generator',
+                    help="directory holding users.csv, messages.csv and follows.csv")
+parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                    help="rows per COPY/INSERT and commit")
+parser.add_argument('--keep-indexes', action='store_true',
+                    help="don't drop and rebuild secondary indexes around the load")
+args = parser.parse_args()
 
 db.drop_all()
 db.create_all()
+# a new schema is already current
+migrations.stamp(db.engine)
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
-
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+load_tables(
+    db.engine,
+    [(User.__table__, os.path.join(args.data_dir, 'users.csv')),
+     (Message.__table__, os.path.join(args.data_dir, 'messages.csv')),
+     (Follows.__table__, os.path.join(args.data_dir, 'follows.csv'))],
+    chunk_size=args.chunk_size,
+    rebuild_indexes=not args.keep_indexes,
+)
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
+with app.app_context():
+    print(f"Set counters for {counters.reconcile()} users.")
+    print(f"Set like counts for {counters.reconcile_messages()} messages.")
 
-db.session.commit()
+    if timelines.enabled():
+        print(f"Wrote {timelines.rebuild()} timeline entries.")
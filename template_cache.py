@@ -0,0 +1,52 @@
+"""On-disk Jinja bytecode cache, filled at build time.
+
+Jinja compiles each template to Python source and then to bytecode the
+first time a process loads it. Every new worker pays that for base.html,
+home.html, users/detail.html and the rest on its first requests. With
+TEMPLATE_CACHE_DIR set, compiled templates are kept there and later
+processes load the bytecode instead:
+
+    TEMPLATE_CACHE_DIR=/srv/warbler/jinja flask precompile-templates
+
+at build time fills the directory for the workers. An entry is only used
+while the template's source is unchanged and only by the Python version
+that wrote it, so a stale or foreign cache just compiles again.
+
+TEMPLATE_WARMUP additionally loads every template as the app starts, so
+workers have them all in memory before their first request.
+"""
+
+import logging
+import os
+
+from jinja2 import FileSystemBytecodeCache
+
+logger = logging.getLogger(__name__)
+
+
+def init_app(app):
+    directory = app.config.get('TEMPLATE_CACHE_DIR')
+    if directory:
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            # a read-only deploy can still start, compiling as before
+            logger.exception("template cache directory %s unusable", directory)
+        else:
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+    if app.config.get('TEMPLATE_WARMUP'):
+        compile_templates(app)
+
+
+def compile_templates(app):
+    """Load every template of `app` and its blueprints. Returns their names.
+
+    Loading puts each in the environment's in-memory cache and, with a
+    bytecode cache set, writes its bytecode there if it isn't yet.
+    """
+
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
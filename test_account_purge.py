@@ -0,0 +1,174 @@
+"""Account deletion tests: cascading deletes and the background purge."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_account_purge.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes, AccountPurge
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from account_purge import account_purger
+from app import app, CURR_USER_KEY
+import counters
+from instrumentation import QueryCounter
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class AccountPurgeTestCase(TestCase):
+    """Deletes lean on the foreign key cascades; big accounts go in batches."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        heavy = User.signup("heavy", "heavy@email.com", "password", None)
+        others = [User.signup(f"other{i}", f"other{i}@email.com", "password", None)
+                  for i in range(3)]
+        db.session.commit()
+
+        their_msg = Message(text="Someone else's", user=others[0])
+        db.session.add(their_msg)
+        db.session.add_all([Message(text=f"Heavy {i}", user=heavy) for i in range(5)])
+        heavy.following.extend(others)
+        others[1].following.append(heavy)
+        db.session.commit()
+
+        db.session.add(Likes(user_id=heavy.id, message_id=their_msg.id))
+        for msg in heavy.messages[:2]:
+            db.session.add(Likes(user_id=others[2].id, message_id=msg.id))
+        db.session.commit()
+        counters.reconcile()
+        counters.reconcile_messages()
+
+        self.heavy_id = heavy.id
+        self.other_ids = [user.id for user in others]
+        self.their_msg_id = their_msg.id
+        self.client = app.test_client()
+
+        self.threshold = account_purger.threshold
+        self.batch = account_purger.batch
+
+    def tearDown(self):
+        account_purger.threshold = self.threshold
+        account_purger.batch = self.batch
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def assert_heavy_gone(self):
+        self.assertIsNone(User.query.get(self.heavy_id))
+        self.assertEqual(Message.query.filter_by(user_id=self.heavy_id).count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(AccountPurge.query.count(), 0)
+
+        # every counter left matches the rows left
+        self.assertEqual(counters.reconcile(), 0)
+        self.assertEqual(counters.reconcile_messages(), 0)
+
+    def test_delete_user(self):
+        """A user with messages, follows and likes is one cascading DELETE"""
+
+        self.login(self.heavy_id)
+        with QueryCounter() as queries:
+            self.client.post("/users/delete")
+
+        self.assertFalse(any(statement.startswith("SELECT messages.")
+                             for statement in queries.statements))
+        self.assert_heavy_gone()
+
+    def test_background_purge(self):
+        account_purger.threshold = 5
+        account_purger.batch = 2
+
+        self.login(self.heavy_id)
+        self.client.post("/users/delete")
+        account_purger.join()
+
+        self.assert_heavy_gone()
+
+    def test_purge_resumes(self):
+        """A purge queued before a restart is finished by run_pending"""
+
+        db.session.add(AccountPurge(user_id=self.heavy_id))
+        db.session.commit()
+
+        self.assertEqual(account_purger.run_pending(), 1)
+        self.assert_heavy_gone()
+
+    def test_delete_message(self):
+        self.login(self.other_ids[0])
+        self.client.post(f"/messages/{self.their_msg_id}/delete")
+
+        self.assertIsNone(Message.query.get(self.their_msg_id))
+        self.assertEqual(counters.reconcile(), 0)
+
+    def test_delete_others_message(self):
+        """Only the author can delete a message"""
+
+        self.login(self.heavy_id)
+        resp = self.client.post(f"/messages/{self.their_msg_id}/delete")
+
+        self.assertEqual(resp.status_code, 404)
+        self.assertIsNotNone(Message.query.get(self.their_msg_id))
+
+    def test_delete_others_message_changes_no_counters(self):
+        """Counters only change when the DELETE removed the message"""
+
+        self.assertFalse(counters.delete_message(self.their_msg_id, self.heavy_id))
+
+        # still in the same transaction
+        self.assertEqual(counters.reconcile(), 0)
+        self.assertEqual(counters.reconcile_messages(), 0)
+
+    def test_queued_account_frozen(self):
+        """A queued account can't gain follows or likes"""
+
+        db.session.add(AccountPurge(user_id=self.heavy_id))
+        db.session.commit()
+        heavy_msg_id = Message.query.filter_by(user_id=self.heavy_id).first().id
+
+        self.login(self.other_ids[0])
+        follow = self.client.post(f"/users/follow/{self.heavy_id}")
+        like = self.client.post(f"/users/add_like/{heavy_msg_id}")
+
+        self.assertEqual((follow.status_code, like.status_code), (404, 404))
+        self.assertEqual(counters.reconcile(), 0)
+
+    def test_purge_counts_late_rows(self):
+        """Rows added during the batches are counted before the final cascade"""
+
+        account_purger.batch = 2
+        delete_messages = account_purger._delete_messages
+        late = []
+
+        def delete_messages_then_follow(user_id):
+            deleted = delete_messages(user_id)
+            if not deleted and not late:
+                late.append(Follows(user_following_id=self.other_ids[0],
+                                    user_being_followed_id=user_id))
+                db.session.add(late[0])
+                counters.bump(self.other_ids[0], following_count=1)
+                counters.bump(user_id, followers_count=1)
+            return deleted
+
+        account_purger._delete_messages = delete_messages_then_follow
+        try:
+            db.session.add(AccountPurge(user_id=self.heavy_id))
+            db.session.commit()
+            account_purger.run_pending()
+        finally:
+            del account_purger._delete_messages
+
+        self.assertTrue(late)
+        self.assert_heavy_gone()
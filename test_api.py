@@ -0,0 +1,128 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_api.py
+
+
+import gzip
+import json
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from instrumentation import QueryCounter
+
+db.create_all()
+
+
+class ApiTestCase(TestCase):
+    """Projected, paginated JSON for timelines, profiles and messages."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        viewer = User.signup("viewer", "viewer@email.com", "password", None)
+        author = User.signup("author", "author@email.com", "password", None)
+        viewer.following.append(author)
+        db.session.add_all([Message(text=f"message {i}", user=author)
+                            for i in range(30)])
+        db.session.commit()
+
+        self.viewer_id = viewer.id
+        self.author_id = author.id
+        self.message_id = Message.query.first().id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.viewer_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def get_json(self, url, **kwargs):
+        resp = self.client.get(url, **kwargs)
+        return resp, json.loads(resp.data)
+
+    def test_timeline(self):
+        resp, data = self.get_json("/api/v1/timeline?limit=20")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(data['items']), 20)
+        self.assertEqual(data['items'][0]['user'],
+                         {'id': self.author_id, 'username': 'author',
+                          'image_url': '/static/images/default-pic.png'})
+
+        resp, rest = self.get_json(f"/api/v1/timeline?before={data['next_cursor']}")
+
+        self.assertEqual(len(rest['items']), 10)
+        self.assertIsNone(rest['next_cursor'])
+        self.assertEqual(len({item['id'] for item in data['items'] + rest['items']}), 30)
+
+    def test_timeline_needs_login(self):
+        with app.test_client() as client:
+            resp = client.get("/api/v1/timeline")
+
+        self.assertEqual(resp.status_code, 401)
+        self.assertIn('error', json.loads(resp.data))
+
+    def test_fields(self):
+        resp, data = self.get_json(f"/api/v1/users/{self.author_id}/messages?fields=id,text")
+
+        self.assertEqual(set(data['items'][0]), {'id', 'text'})
+
+    def test_fields_projected(self):
+        """Only the requested columns are selected, and no join for none of the author's"""
+
+        with QueryCounter() as queries:
+            self.client.get(f"/api/v1/users/{self.author_id}/messages?fields=text")
+
+        statement = queries.statements[-1]
+        self.assertNotIn("messages.likes_count", statement)
+        self.assertNotIn("JOIN users", statement)
+
+    def test_unknown_field(self):
+        resp, data = self.get_json(f"/api/v1/users/{self.author_id}?fields=password")
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("password", data['error'])
+
+    def test_user(self):
+        resp, data = self.get_json(f"/api/v1/users/{self.author_id}")
+
+        self.assertEqual(data['username'], "author")
+        self.assertIn('messages_count', data)
+        self.assertNotIn('password', data)
+        self.assertNotIn('email', data)
+
+    def test_user_not_modified(self):
+        resp = self.client.get(f"/api/v1/users/{self.author_id}")
+        resp = self.client.get(f"/api/v1/users/{self.author_id}",
+                               headers={'If-None-Match': resp.headers['ETag']})
+
+        self.assertEqual(resp.status_code, 304)
+
+    def test_message(self):
+        resp, data = self.get_json(f"/api/v1/messages/{self.message_id}")
+
+        self.assertEqual(data['id'], self.message_id)
+        self.assertEqual(data['user']['username'], "author")
+
+        resp, data = self.get_json("/api/v1/messages/99999")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_gzip(self):
+        resp = self.client.get(f"/api/v1/users/{self.author_id}/messages",
+                               headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(len(json.loads(gzip.decompress(resp.data))['items']), 30)
+
+        resp = self.client.get(f"/api/v1/users/{self.author_id}/messages")
+        self.assertNotIn('Content-Encoding', resp.headers)
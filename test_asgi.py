@@ -0,0 +1,135 @@
+"""Async serving mode tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_asgi.py
+
+
+from datetime import datetime, timedelta
+import os
+from unittest import IsolatedAsyncioTestCase, skipIf
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from instrumentation import QueryCounter
+
+try:
+    import httpx
+    import asgi
+except ImportError:
+    asgi = None
+
+db.create_all()
+
+
+@skipIf(asgi is None, "async extras not installed (requirements-async.txt)")
+class AsgiTestCase(IsolatedAsyncioTestCase):
+    """The async pages match the Flask ones; the rest pass through."""
+
+    async def asyncSetUp(self):
+        db.drop_all()
+        db.create_all()
+
+        viewer = User.signup("viewer", "viewer@email.com", "password", None)
+        author = User.signup("author", "author@email.com", "password", None)
+        viewer.following.append(author)
+        db.session.add(Message(text="hello from author", user=author))
+        db.session.commit()
+
+        self.viewer_id = viewer.id
+        self.author_id = author.id
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+            cookie = next(cookie for cookie in client.cookie_jar
+                          if cookie.name == app.session_cookie_name)
+
+        await asgi.database.connect()
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=asgi.app),
+            base_url="http://localhost",
+            cookies={app.session_cookie_name: cookie.value})
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await asgi.database.disconnect()
+        db.session.rollback()
+
+    async def test_homepage(self):
+        resp = await self.client.get("/")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("hello from author", resp.text)
+        self.assertIn("@viewer", resp.text)
+
+    async def test_homepage_recent_window(self):
+        """With partitions on, older messages fill the rest of the page"""
+
+        db.session.add(Message(text="hello from last year", user_id=self.author_id,
+                               timestamp=datetime.utcnow() - timedelta(days=365)))
+        db.session.commit()
+
+        app.config['MESSAGE_PARTITIONS'] = True
+        try:
+            resp = await self.client.get("/")
+        finally:
+            app.config['MESSAGE_PARTITIONS'] = False
+
+        self.assertIn("hello from author", resp.text)
+        self.assertIn("hello from last year", resp.text)
+
+    async def test_users_show_not_modified(self):
+        resp = await self.client.get(f"/users/{self.author_id}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("hello from author", resp.text)
+
+        resp = await self.client.get(f"/users/{self.author_id}",
+                                     headers={'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status_code, 304)
+
+    async def test_same_etag_as_flask(self):
+        """Both modes validate a browser's copy the same way"""
+
+        resp = await self.client.get(f"/users/{self.author_id}")
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+            flask_resp = client.get(f"/users/{self.author_id}")
+
+        self.assertEqual(resp.headers['ETag'], flask_resp.headers['ETag'])
+
+    async def test_follow_state_without_orm(self):
+        """Follow buttons come from the async query, not g.user in the render"""
+
+        msg_id = Message.query.one().id
+
+        with QueryCounter() as queries:
+            profile = await self.client.get(f"/users/{self.author_id}")
+            message = await self.client.get(f"/messages/{msg_id}")
+
+        self.assertEqual(queries.count, 0)
+        self.assertIn(f'action="/users/stop-following/{self.author_id}"', profile.text)
+        self.assertIn(f'action="/users/stop-following/{self.author_id}"', message.text)
+
+    async def test_missing_message(self):
+        resp = await self.client.get("/messages/99999")
+
+        self.assertEqual(resp.status_code, 404)
+
+    async def test_list_users_search(self):
+        resp = await self.client.get("/users?q=auth")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@author", resp.text)
+        self.assertNotIn("@viewer</p>", resp.text)
+
+    async def test_other_routes_pass_through(self):
+        resp = await self.client.get("/users/profile")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Edit Your Profile", resp.text)
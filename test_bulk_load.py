@@ -0,0 +1,119 @@
+"""Bulk CSV loader tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_bulk_load.py
+
+
+import csv
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from bulk_load import load_csv, load_tables
+
+db.create_all()
+
+
+class BulkLoadTestCase(TestCase):
+    """Test chunked COPY and executemany loading."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.dir = tempfile.TemporaryDirectory()
+        self.users_csv = os.path.join(self.dir.name, 'users.csv')
+
+        with open(self.users_csv, 'w', newline='') as users:
+            writer = csv.writer(users)
+            writer.writerow(['id', 'email', 'username', 'password', 'bio'])
+            for i in range(1, 8):
+                writer.writerow([i, f"u{i}@email.com", f"user{i}", "HASH",
+                                 'says "hi", twice'])
+
+        self.messages_csv = os.path.join(self.dir.name, 'messages.csv')
+        with open(self.messages_csv, 'w', newline='') as messages:
+            writer = csv.writer(messages)
+            writer.writerow(['text', 'timestamp', 'user_id'])
+            writer.writerow(["first", "2017-01-21 11:04:53.522807", 1])
+            writer.writerow(["second", "2017-10-21 07:01:06.023966", 2])
+
+        self.follows_csv = os.path.join(self.dir.name, 'follows.csv')
+        with open(self.follows_csv, 'w', newline='') as follows:
+            writer = csv.writer(follows)
+            writer.writerow(['user_being_followed_id', 'user_following_id'])
+            writer.writerow([1, 2])
+            writer.writerow([2, 1])
+
+        self.progress = []
+
+    def tearDown(self):
+        self.dir.cleanup()
+        db.session.rollback()
+
+    def test_copy_in_chunks(self):
+        """Postgres loads go through COPY, committing every chunk"""
+
+        loaded = load_csv(db.engine, User.__table__, self.users_csv,
+                          chunk_size=3, progress=self.progress.append)
+
+        self.assertEqual(loaded, 7)
+        self.assertEqual(len(self.progress), 3)
+        self.assertEqual(User.query.count(), 7)
+        self.assertEqual(User.query.get(7).bio, 'says "hi", twice')
+
+    def test_sequences_reset_after_load(self):
+        """New rows get ids past the loaded ones"""
+
+        load_tables(db.engine, [(User.__table__, self.users_csv)],
+                    progress=self.progress.append)
+
+        user = User.signup("new", "new@email.com", "password", None)
+        db.session.commit()
+
+        self.assertEqual(user.id, 8)
+
+    def test_sqlite_fallback(self):
+        """Other databases load with executemany"""
+
+        engine = create_engine('sqlite://')
+        db.metadata.create_all(engine)
+
+        loaded = load_csv(engine, User.__table__, self.users_csv,
+                          chunk_size=5, progress=self.progress.append)
+
+        self.assertEqual(loaded, 7)
+        self.assertEqual(engine.execute("SELECT COUNT(*) FROM users").scalar(), 7)
+
+    def test_sqlite_round_trip(self):
+        """Typed fields and empty fields load on SQLite as they would by COPY"""
+
+        with open(self.users_csv, 'a', newline='') as users:
+            csv.writer(users).writerow([8, "u8@email.com", "user8", "HASH", ""])
+
+        engine = create_engine('sqlite://')
+        db.metadata.create_all(engine)
+
+        load_tables(engine,
+                    [(User.__table__, self.users_csv),
+                     (Message.__table__, self.messages_csv),
+                     (Follows.__table__, self.follows_csv)],
+                    progress=self.progress.append)
+
+        messages = engine.execute(
+            "SELECT text, timestamp, user_id FROM messages ORDER BY id").fetchall()
+        self.assertEqual([tuple(row) for row in messages],
+                         [("first", "2017-01-21 11:04:53.522807", 1),
+                          ("second", "2017-10-21 07:01:06.023966", 2)])
+        self.assertEqual(
+            engine.execute("SELECT COUNT(*) FROM follows").scalar(), 2)
+        self.assertIsNone(
+            engine.execute("SELECT bio FROM users WHERE id = 8").scalar())
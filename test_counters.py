@@ -0,0 +1,144 @@
+"""Denormalized counter tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_counters.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import counters
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CounterTestCase(TestCase):
+    """Test that routes keep user counters in step."""
+
+    def setUp(self):
+        """Create two users."""
+
+        db.drop_all()
+        db.create_all()
+
+        u1 = User.signup("test", "test1@email.com", "password", None)
+        u1.id = 1111
+        u2 = User.signup("test2", "test2@email.com", "password", None)
+        u2.id = 2222
+        db.session.commit()
+
+        self.u1_id = 1111
+        self.u2_id = 2222
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def counts(self, user_id):
+        user = User.query.get(user_id)
+        db.session.refresh(user)
+        return {name: getattr(user, name) for name in counters.COUNTERS}
+
+    def test_follow_counters(self):
+        """Following and unfollowing adjust both users' counters"""
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+
+            c.post("/users/follow/2222")
+            self.assertEqual(self.counts(self.u1_id)['following_count'], 1)
+            self.assertEqual(self.counts(self.u2_id)['followers_count'], 1)
+
+            c.post("/users/stop-following/2222")
+            self.assertEqual(self.counts(self.u1_id)['following_count'], 0)
+            self.assertEqual(self.counts(self.u2_id)['followers_count'], 0)
+
+    def test_message_and_like_counters(self):
+        """Posting, liking and deleting a message adjust the counters"""
+
+        with self.client as c:
+            self.login(c, self.u2_id)
+            c.post("/messages/new", data={"text": "Count me"})
+            msg_id = Message.query.one().id
+            self.assertEqual(self.counts(self.u2_id)['messages_count'], 1)
+
+            self.login(c, self.u1_id)
+            c.post(f"/users/add_like/{msg_id}")
+            self.assertEqual(self.counts(self.u1_id)['likes_count'], 1)
+            self.assertEqual(Message.query.get(msg_id).likes_count, 1)
+
+            self.login(c, self.u2_id)
+            c.post(f"/messages/{msg_id}/delete")
+            self.assertEqual(self.counts(self.u2_id)['messages_count'], 0)
+            self.assertEqual(self.counts(self.u1_id)['likes_count'], 0)
+
+    def test_delete_user_counters(self):
+        """Deleting a user updates the counters of the users they followed"""
+
+        with self.client as c:
+            self.login(c, self.u2_id)
+            c.post("/users/follow/1111")
+            c.post("/users/delete")
+
+        self.assertEqual(self.counts(self.u1_id)['followers_count'], 0)
+
+    def test_reconcile(self):
+        """Reconciling recomputes drifted counters from the source tables"""
+
+        db.session.add(Message(id=1, text="Uncounted", user_id=self.u1_id))
+        db.session.commit()
+        db.session.add(Likes(user_id=self.u2_id, message_id=1))
+        u1 = User.query.get(self.u1_id)
+        u1.following.append(User.query.get(self.u2_id))
+        db.session.commit()
+
+        self.assertEqual(counters.reconcile(), 2)
+        self.assertEqual(self.counts(self.u1_id), {'messages_count': 1,
+                                                   'following_count': 1,
+                                                   'followers_count': 0,
+                                                   'likes_count': 0})
+        self.assertEqual(self.counts(self.u2_id), {'messages_count': 0,
+                                                   'following_count': 0,
+                                                   'followers_count': 1,
+                                                   'likes_count': 1})
+        self.assertEqual(counters.reconcile(), 0)
+
+    def test_home_shows_likes(self):
+        """The home page marks the viewer's likes and shows like counts"""
+
+        db.session.add(Message(id=1, text="Liked", user_id=self.u1_id))
+        db.session.add(Message(id=2, text="Not liked", user_id=self.u1_id))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post("/users/add_like/1")
+            html = c.get("/").get_data(as_text=True)
+
+        self.assertEqual(html.count("btn-primary"), 1)
+        self.assertIn('<i class="fa fa-thumbs-up"></i> 1', html)
+
+    def test_reconcile_messages(self):
+        db.session.add(Message(id=1, text="Uncounted", user_id=self.u1_id))
+        db.session.commit()
+        db.session.add(Likes(user_id=self.u2_id, message_id=1))
+        db.session.commit()
+
+        self.assertEqual(counters.reconcile_messages(), 1)
+        self.assertEqual(Message.query.get(1).likes_count, 1)
+        self.assertEqual(counters.reconcile_messages(), 0)
@@ -0,0 +1,132 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_db_routing.py
+
+
+import os
+import threading
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from db_routing import replicas
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class RoutingTestCase(TestCase):
+    """GET reads go to the replica unless the browser just wrote."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        user = User.signup("testuser", "test@test.com", "password", None)
+        db.session.commit()
+        self.user_id = user.id
+
+        # the test database stands in for its own replica
+        app.config['SQLALCHEMY_REPLICA_URIS'] = [app.config['SQLALCHEMY_DATABASE_URI']]
+        app.extensions.pop('replicas', None)
+        self.replica = replicas(app).replicas[0]
+        replicas(app).refresh()
+
+        self.replica_statements = []
+        event.listen(self.replica.engine, 'before_cursor_execute', self.on_replica)
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def tearDown(self):
+        event.remove(self.replica.engine, 'before_cursor_execute', self.on_replica)
+        replicas(app).dispose()
+        app.config['SQLALCHEMY_REPLICA_URIS'] = []
+        app.extensions.pop('replicas', None)
+        db.session.rollback()
+
+    def on_replica(self, conn, cursor, statement, *args):
+        self.replica_statements.append(statement)
+
+    def test_reads_use_replica(self):
+        resp = self.client.get(f"/users/{self.user_id}")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(any("FROM messages" in statement
+                            for statement in self.replica_statements))
+
+    def test_writes_use_primary(self):
+        self.client.post("/messages/new", data={"text": "hello"})
+
+        self.assertFalse(any("INSERT" in statement or "UPDATE" in statement
+                             for statement in self.replica_statements))
+        self.assertEqual(Message.query.count(), 1)
+
+    def test_read_your_writes(self):
+        """Right after posting, this browser reads from the primary"""
+
+        self.client.post("/messages/new", data={"text": "hello"})
+        self.replica_statements.clear()
+
+        resp = self.client.get(f"/users/{self.user_id}")
+
+        self.assertIn(b"hello", resp.data)
+        self.assertEqual(self.replica_statements, [])
+
+    def test_lagging_replica_skipped(self):
+        replicas(app).max_lag = -1
+
+        self.client.get(f"/users/{self.user_id}")
+
+        self.assertFalse(any("FROM messages" in statement
+                             for statement in self.replica_statements))
+
+    def test_unchecked_replica_skipped(self):
+        """Until its lag is known a replica gets no reads"""
+
+        self.replica.check = lambda: None
+        self.replica.lag = float('inf')
+
+        self.client.get(f"/users/{self.user_id}")
+
+        self.assertFalse(any("FROM messages" in statement
+                             for statement in self.replica_statements))
+
+    def test_lag_checked_off_request_path(self):
+        """Requests never wait on a lag check"""
+
+        checks = []
+        self.replica.check = lambda: checks.append(threading.current_thread())
+
+        self.client.get(f"/users/{self.user_id}")
+        replicas(app).dispose()
+
+        self.assertNotIn(threading.current_thread(), checks)
+
+    def test_replica_picked_once_per_request(self):
+        picks = []
+        engine_for_read = replicas(app).engine_for_read
+
+        def pick():
+            picks.append(1)
+            return engine_for_read()
+
+        replicas(app).engine_for_read = pick
+
+        self.client.get(f"/users/{self.user_id}")
+
+        self.assertEqual(len(picks), 1)
+
+    def test_pool_options(self):
+        self.assertEqual(db.engine.pool.size(),
+                         app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'])
+        self.assertTrue(db.engine.pool._pre_ping)
@@ -0,0 +1,118 @@
+"""Follow state and follow/unfollow route tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_follows.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FollowsTestCase(TestCase):
+    """Follow state comes from the follows table, and follows are idempotent."""
+
+    def setUp(self):
+        """Create three users; 1 follows 2."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.users = []
+        for user_id in (1, 2, 3):
+            user = User.signup(f"user{user_id}", f"u{user_id}@email.com",
+                               "password", None)
+            user.id = user_id
+            self.users.append(user)
+        db.session.commit()
+
+        db.session.add(Follows(user_following_id=1, user_being_followed_id=2))
+        self.users[0].following_count = 1
+        self.users[1].followers_count = 1
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def post_as(self, user_id, url):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+            return c.post(url)
+
+    def counts(self, user_id):
+        db.session.expire_all()
+        user = User.query.get(user_id)
+        return user.following_count, user.followers_count
+
+    def test_following_among(self):
+        """Only the followed ids among those asked about come back"""
+
+        self.assertEqual(Follows.following_among(1, [1, 2, 3]), {2})
+        self.assertEqual(Follows.following_among(2, [1, 3]), set())
+        self.assertEqual(Follows.following_among(1, []), set())
+
+    def test_sees_other_writers(self):
+        """Follows written outside this session show at once"""
+
+        u1, u2, u3 = self.users
+        with db.engine.begin() as conn:
+            conn.execute("INSERT INTO follows (user_following_id, user_being_followed_id) "
+                         "VALUES (1, 3)")
+            conn.execute("DELETE FROM follows WHERE user_following_id = 1 "
+                         "AND user_being_followed_id = 2")
+
+        self.assertTrue(u1.is_following(u3))
+        self.assertFalse(u1.is_followed_by(u3))
+        self.assertFalse(u1.is_following(u2))
+        self.assertFalse(u2.is_followed_by(u1))
+
+    def test_follow_twice(self):
+        """Following someone already followed changes nothing"""
+
+        self.post_as(1, "/users/follow/3")
+        self.post_as(1, "/users/follow/3")
+
+        self.assertEqual(Follows.following_among(1, [2, 3]), {2, 3})
+        self.assertEqual(self.counts(1)[0], 2)
+        self.assertEqual(self.counts(3)[1], 1)
+
+    def test_unfollow_twice(self):
+        """Unfollowing someone not followed changes nothing"""
+
+        resp = self.post_as(1, "/users/stop-following/3")
+        self.assertNotEqual(resp.status_code, 500)
+
+        self.post_as(1, "/users/stop-following/2")
+        self.post_as(1, "/users/stop-following/2")
+
+        self.assertEqual(Follows.following_among(1, [2, 3]), set())
+        self.assertEqual(self.counts(1)[0], 0)
+        self.assertEqual(self.counts(2)[1], 0)
+
+    def test_directory_follow_buttons(self):
+        """The user directory shows Unfollow only for followed users"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            resp = c.get("/users")
+            html = resp.get_data(as_text=True)
+
+            self.assertIn('action="/users/stop-following/2"', html)
+            self.assertIn('action="/users/follow/3"', html)
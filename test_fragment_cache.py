@@ -0,0 +1,109 @@
+"""Message card fragment cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_fragment_cache.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from fragment_cache import fragment_cache, FragmentCache
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FragmentCacheTestCase(TestCase):
+    """Cards render once, and never show a stale author."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        user = User.signup("testuser", "test@test.com", "password", None)
+        db.session.add_all([Message(text="first", user=user),
+                            Message(text="second", user=user)])
+        db.session.commit()
+        self.user_id = user.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+        fragment_cache.clear()
+        fragment_cache.hits = fragment_cache.misses = 0
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_cards_cached(self):
+        self.client.get(f"/users/{self.user_id}")
+        self.assertEqual(fragment_cache.stats()['misses'], 2)
+
+        resp = self.client.get("/")
+
+        self.assertIn(b"first", resp.data)
+        stats = fragment_cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['size'], 2)
+        self.assertGreater(stats['bytes'], 0)
+
+    def test_profile_edit_shows_new_name(self):
+        self.client.get(f"/users/{self.user_id}")
+
+        self.client.post("/users/profile", data={
+            "username": "renamed",
+            "email": "test@test.com",
+            "image_url": "",
+            "header_image_url": "",
+            "bio": "",
+            "password": "password",
+        })
+
+        resp = self.client.get(f"/users/{self.user_id}")
+
+        self.assertIn(b"@renamed", resp.data)
+        self.assertNotIn(b"@testuser", resp.data)
+        self.assertEqual(fragment_cache.stats()['size'], 2)
+
+    def test_destroy_invalidates(self):
+        self.client.get(f"/users/{self.user_id}")
+        msg_id = Message.query.filter_by(text="first").one().id
+
+        self.client.post(f"/messages/{msg_id}/delete")
+
+        self.assertEqual(fragment_cache.stats()['size'], 1)
+
+    def test_memory_cap(self):
+        """Least recently used cards go first once the cap is reached"""
+
+        cache = FragmentCache(max_bytes=1000)
+        msgs = Message.query.order_by(Message.id).all()
+
+        with app.test_request_context():
+            first = cache.message_card(msgs[0])
+            cache.max_bytes = len(first) + 1
+            cache.message_card(msgs[1])
+
+        self.assertEqual(cache.stats()['size'], 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertLessEqual(cache.bytes, cache.max_bytes)
+
+    def test_metrics_endpoint(self):
+        self.assertEqual(self.client.get("/_metrics").status_code, 404)
+
+        app.config['METRICS_ENABLED'] = True
+        try:
+            resp = self.client.get("/_metrics")
+        finally:
+            app.config['METRICS_ENABLED'] = False
+
+        self.assertIn('fragment_cache', resp.json)
+        self.assertIn('user_cache', resp.json)
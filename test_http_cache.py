@@ -0,0 +1,142 @@
+"""Conditional GET and cache header tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_http_cache.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class HttpCacheTestCase(TestCase):
+    """Pages answer If-None-Match with 304 until what they show changes."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        viewer = User.signup("viewer", "viewer@email.com", "password", None)
+        author = User.signup("author", "author@email.com", "password", None)
+        db.session.add(Message(text="first", user=author))
+        db.session.commit()
+
+        self.viewer_id = viewer.id
+        self.author_id = author.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.viewer_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def revalidate(self, url):
+        """GET `url`, then GET it again with the ETag it returned."""
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNotNone(resp.headers.get('ETag'))
+
+        return self.client.get(url, headers={'If-None-Match': resp.headers['ETag']})
+
+    def test_profile_not_modified(self):
+        url = f"/users/{self.author_id}"
+        resp = self.revalidate(url)
+
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b"")
+        self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+        self.assertIn('Cookie', resp.headers['Vary'])
+
+    def test_profile_changes_after_new_message(self):
+        url = f"/users/{self.author_id}"
+        etag = self.client.get(url).headers['ETag']
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.author_id
+        self.client.post("/messages/new", data={"text": "second"})
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.viewer_id
+            sess.pop('_flashes', None)
+
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"second", resp.data)
+
+    def test_home_changes_after_follow(self):
+        etag = self.client.get("/").headers['ETag']
+        self.assertEqual(
+            self.client.get("/", headers={'If-None-Match': etag}).status_code, 304)
+
+        self.client.post(f"/users/follow/{self.author_id}")
+
+        resp = self.client.get("/", headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"first", resp.data)
+
+    def test_home_changes_behind_latest(self):
+        """A followed user's change counts even if another row is newer"""
+
+        self.client.post(f"/users/follow/{self.author_id}")
+        User.query.filter_by(id=self.viewer_id).update(
+            {'updated_at': datetime(2100, 1, 1)})
+        db.session.commit()
+        etag = self.client.get("/").headers['ETag']
+
+        db.session.add(Message(text="second", user_id=self.author_id))
+        User.query.filter_by(id=self.author_id).update(
+            {'messages_count': User.messages_count + 1})
+        db.session.commit()
+
+        resp = self.client.get("/", headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"second", resp.data)
+
+    def test_message_not_modified(self):
+        msg_id = Message.query.one().id
+
+        self.assertEqual(self.revalidate(f"/messages/{msg_id}").status_code, 304)
+
+    def test_pending_flash_renders(self):
+        """A flash message waiting to be shown skips the 304"""
+
+        url = f"/users/{self.author_id}"
+        etag = self.client.get(url).headers['ETag']
+
+        with self.client.session_transaction() as sess:
+            sess['_flashes'] = [('success', 'Hello!')]
+
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"Hello!", resp.data)
+
+    def test_pages_without_validators_not_stored(self):
+        resp = self.client.get("/users/profile")
+
+        self.assertEqual(resp.headers['Cache-Control'], 'no-store')
+
+    def test_versioned_static_files(self):
+        with app.test_request_context():
+            from flask import url_for
+            url = url_for('static', filename='stylesheets/style.css')
+
+        self.assertIn("?v=", url)
+
+        resp = self.client.get(url)
+
+        self.assertIn("immutable", resp.headers['Cache-Control'])
+        self.assertIn("max-age=31536000", resp.headers['Cache-Control'])
@@ -0,0 +1,109 @@
+"""Per-request SQL instrumentation tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_instrumentation.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from instrumentation import (sql_instrumentation, fingerprint,
+                             QueryBudgetExceeded)
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class InstrumentationTestCase(TestCase):
+    """Sampling, per-endpoint stats, slow request logs and query budgets."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        user = User.signup("testuser", "test@test.com", "password", None)
+        db.session.add(Message(text="hello", user=user))
+        db.session.commit()
+        self.user_id = user.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+        sql_instrumentation.reset()
+
+    def tearDown(self):
+        sql_instrumentation.sample_rate = 0
+        sql_instrumentation.slow_request_ms = 500
+        sql_instrumentation.guard = False
+        sql_instrumentation.budget = None
+        sql_instrumentation.budgets = {}
+        db.session.rollback()
+
+    def test_fingerprint(self):
+        """Literals, bind params and IN lists collapse"""
+
+        self.assertEqual(
+            fingerprint("SELECT * FROM users\n WHERE id IN (1, 2, 3) AND name = 'o''k'"),
+            "SELECT * FROM users WHERE id IN (?) AND name = ?")
+        self.assertEqual(
+            fingerprint("SELECT * FROM users WHERE id = %(id_1)s LIMIT %(param_1)s"),
+            "SELECT * FROM users WHERE id = ? LIMIT ?")
+
+    def test_unsampled_requests_not_recorded(self):
+        """With a sample rate of 0 nothing is recorded"""
+
+        self.client.get(f"/users/{self.user_id}")
+
+        self.assertEqual(sql_instrumentation.stats(), {})
+
+    def test_sampled_requests_recorded_per_endpoint(self):
+        sql_instrumentation.sample_rate = 1
+
+        self.client.get(f"/users/{self.user_id}")
+        self.client.get(f"/users/{self.user_id}")
+
+        stats = sql_instrumentation.stats()['users_show']
+        self.assertEqual(stats['requests'], 2)
+        self.assertGreater(stats['queries'], 0)
+        self.assertGreater(stats['db_seconds'], 0)
+        self.assertIsNotNone(stats['slowest'])
+        self.assertIn("= ?", stats['slowest'])
+
+    def test_slow_requests_logged(self):
+        sql_instrumentation.sample_rate = 1
+        sql_instrumentation.slow_request_ms = 0
+
+        with self.assertLogs(app.logger, 'WARNING') as logs:
+            self.client.get(f"/users/{self.user_id}")
+
+        self.assertIn("slow request GET /users/", logs.output[0])
+        self.assertIn("FROM messages", logs.output[0])
+
+    def test_guard_within_budget(self):
+        sql_instrumentation.guard = True
+        sql_instrumentation.budget = 20
+
+        resp = self.client.get(f"/users/{self.user_id}")
+
+        self.assertEqual(resp.status_code, 200)
+
+    def test_guard_over_budget(self):
+        """Going over an endpoint's budget raises"""
+
+        sql_instrumentation.guard = True
+        sql_instrumentation.budgets = {'users_show': 0}
+
+        with self.assertRaises(QueryBudgetExceeded):
+            app.config['PROPAGATE_EXCEPTIONS'] = True
+            try:
+                self.client.get(f"/users/{self.user_id}")
+            finally:
+                app.config['PROPAGATE_EXCEPTIONS'] = None
@@ -0,0 +1,148 @@
+"""Likes tests: idempotent like/unlike and the composite key migration."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_likes.py
+
+
+import importlib
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from models import db, insert_ignoring_duplicates, User, Message, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LikesTestCase(TestCase):
+    """Likes are one upsert or delete, and any number of users can like."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.add(Message(id=1, text="Like me", user=u2))
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def like_count(self):
+        msg = Message.query.get(1)
+        db.session.refresh(msg)
+        return msg.likes_count
+
+    def test_like_twice(self):
+        """Liking again changes nothing"""
+
+        self.login(self.u1_id)
+        self.client.post("/users/add_like/1")
+        self.client.post("/users/add_like/1")
+
+        self.assertEqual(Likes.query.count(), 1)
+        self.assertEqual(self.like_count(), 1)
+
+    def test_many_users_like(self):
+        for user_id in (self.u1_id, self.u2_id):
+            self.login(user_id)
+            self.client.post("/users/add_like/1")
+
+        self.assertEqual(Likes.query.filter_by(message_id=1).count(), 2)
+        self.assertEqual(self.like_count(), 2)
+
+    def test_unlike(self):
+        self.login(self.u1_id)
+        self.client.post("/users/add_like/1")
+        self.client.post("/users/remove_like/1")
+        self.client.post("/users/remove_like/1")
+
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(self.like_count(), 0)
+        self.assertEqual(User.query.get(self.u1_id).likes_count, 0)
+
+    def test_like_missing_message(self):
+        self.login(self.u1_id)
+
+        self.assertEqual(self.client.post("/users/add_like/999").status_code, 404)
+
+    def test_duplicate_insert_on_sqlite(self):
+        """Duplicate likes are skipped on SQLite too"""
+
+        engine = create_engine('sqlite://')
+        db.metadata.create_all(engine)
+        insert = insert_ignoring_duplicates(Likes.__table__, engine.dialect)
+
+        with engine.begin() as conn:
+            first = conn.execute(insert.values(user_id=1, message_id=1))
+            again = conn.execute(insert.values(user_id=1, message_id=1))
+            count = conn.execute("SELECT COUNT(*) FROM likes").scalar()
+
+        self.assertEqual((first.rowcount, again.rowcount, count), (1, 0, 1))
+
+
+class LikesMigrationTestCase(TestCase):
+    """The migration moves a surrogate-keyed likes table to the composite key."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.add(Message(id=1, text="Liked", user=u1))
+        db.session.commit()
+        self.u1_id = u1.id
+        # end the session's read transaction so the DDL isn't blocked
+        db.session.rollback()
+
+        db.engine.execute("""
+            DROP TABLE likes;
+            CREATE TABLE likes (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER REFERENCES users ON DELETE CASCADE,
+                message_id INTEGER UNIQUE REFERENCES messages ON DELETE CASCADE
+            );
+        """)
+        db.engine.execute(f"INSERT INTO likes (user_id, message_id) "
+                          f"VALUES ({self.u1_id}, 1), (NULL, NULL)")
+
+        self.migration = importlib.import_module('migrations.0001_likes_composite_key')
+
+    def test_upgrade(self):
+        with db.engine.begin() as conn:
+            self.migration.upgrade(conn)
+
+        self.assertEqual([(like.user_id, like.message_id) for like in Likes.query],
+                         [(self.u1_id, 1)])
+        self.assertEqual(Message.query.get(1).likes_count, 1)
+        db.session.rollback()
+
+        # the composite key now allows a second liker
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+        Likes.add(u2.id, 1)
+        db.session.commit()
+        self.assertEqual(Likes.query.count(), 2)
+        db.session.rollback()
+
+        # and running it again is a no-op
+        with db.engine.begin() as conn:
+            self.assertFalse(self.migration.needed(conn))
+            self.migration.upgrade(conn)
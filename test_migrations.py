@@ -0,0 +1,138 @@
+"""Schema migration and query plan tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_migrations.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import migrations
+import query_plans
+from search import trigram_available
+
+db.create_all()
+
+
+def index_names(table):
+    return {name for (name,) in db.engine.execute(
+        "SELECT indexname FROM pg_indexes WHERE tablename = %s", (table,))}
+
+
+class MigrationsTestCase(TestCase):
+    """Pending migrations apply in order and only once."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        db.engine.execute("DROP TABLE IF EXISTS schema_migrations")
+
+    def test_discover(self):
+        versions = [version for version, name in migrations.discover()]
+
+        self.assertEqual(versions, sorted(versions))
+        self.assertIn('0002', versions)
+
+    def test_stamp(self):
+        migrations.stamp(db.engine)
+
+        self.assertEqual(migrations.pending(db.engine), [])
+
+    def test_upgrade_builds_indexes(self):
+        db.engine.execute("DROP INDEX ix_messages_user_id_timestamp; "
+                          "DROP INDEX ix_follows_user_following_id")
+
+        self.assertEqual(migrations.upgrade(db.engine, progress=lambda line: None),
+                         len(migrations.discover()))
+
+        self.assertIn('ix_messages_user_id_timestamp', index_names('messages'))
+        self.assertIn('ix_follows_user_following_id', index_names('follows'))
+        self.assertEqual(migrations.pending(db.engine), [])
+        self.assertEqual(migrations.upgrade(db.engine), 0)
+
+    def test_trigram_index(self):
+        """Username search gets its trigram index wherever pg_trgm exists"""
+
+        db.engine.execute("DROP INDEX IF EXISTS ix_users_username_trgm")
+        with db.engine.connect() as conn:
+            available = trigram_available(conn)
+
+        migrations.upgrade(db.engine, progress=lambda line: None)
+
+        self.assertEqual('ix_users_username_trgm' in index_names('users'), available)
+
+    def test_replaces_invalid_index(self):
+        """A failed concurrent build is dropped and built again"""
+
+        db.engine.execute("DROP INDEX ix_follows_user_following_id")
+        db.engine.execute("CREATE INDEX ix_follows_user_following_id ON follows (user_following_id)")
+        db.engine.execute("UPDATE pg_index SET indisvalid = false "
+                          "WHERE indexrelid = 'ix_follows_user_following_id'::regclass")
+
+        with db.engine.connect() as conn:
+            migrations.create_index_concurrently(
+                conn.execution_options(isolation_level='AUTOCOMMIT'),
+                'ix_follows_user_following_id', 'follows',
+                ['user_following_id', 'user_being_followed_id'])
+
+        self.assertTrue(db.engine.execute(
+            "SELECT indisvalid FROM pg_index "
+            "WHERE indexrelid = 'ix_follows_user_following_id'::regclass").scalar())
+
+
+class QueryPlansTestCase(TestCase):
+    """The main pages' queries can all use an index."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        viewer = User.signup("viewer", "viewer@email.com", "password", None)
+        author = User.signup("author", "author@email.com", "password", None)
+        viewer.following.append(author)
+        msg = Message(text="hello", user=author)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.viewer_id = viewer.id
+        self.author_id = author.id
+        self.message_id = msg.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_timestamp_default(self):
+        """Each message gets the time it was made, not the import time"""
+
+        self.assertTrue(Message.__table__.c.timestamp.default.is_callable)
+
+    def test_full_scans(self):
+        plan = query_plans.explain(db.engine, "SELECT * FROM messages WHERE text = %(text)s",
+                                   {'text': "hello"})
+
+        self.assertEqual(query_plans.full_scans(plan), ['messages'])
+
+    def test_filtered_index_scans(self):
+        """Walking a whole index and filtering every row is flagged too"""
+
+        plan = query_plans.explain(
+            db.engine,
+            "SELECT * FROM messages WHERE text = %(text)s ORDER BY id LIMIT 5",
+            {'text': "hello"})
+
+        self.assertEqual(plan['Plans'][0]['Node Type'], 'Index Scan')
+        self.assertEqual(query_plans.full_scans(plan), ['messages'])
+
+    def test_routes_use_indexes(self):
+        with app.app_context():
+            flagged = query_plans.check_routes(
+                query_plans.route_paths(self.author_id, self.message_id),
+                {CURR_USER_KEY: self.viewer_id})
+
+        self.assertEqual(flagged, [])
@@ -0,0 +1,181 @@
+"""Message partitioning and archival tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_partitions.py
+
+
+import gzip
+import os
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import counters
+from instrumentation import QueryCounter
+from pagination import paginate
+import partitions
+import query_plans
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+OLD = datetime.utcnow() - timedelta(days=200)
+
+
+def relations(plan):
+    """Names of every relation a JSON plan reads."""
+
+    found = {plan['Relation Name']} if 'Relation Name' in plan else set()
+    for child in plan.get('Plans', []):
+        found |= relations(child)
+    return found
+
+
+class PartitionsTestCase(TestCase):
+    """Messages split by month still behave like one table."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        user = User.signup("testuser", "test@test.com", "password", None)
+        db.session.commit()
+        db.session.add_all([Message(text=f"old {i}", user=user,
+                                    timestamp=OLD + timedelta(minutes=i))
+                            for i in range(3)])
+        db.session.add(Message(text="new", user=user))
+        db.session.commit()
+        counters.reconcile()
+        db.session.commit()
+        self.user_id = user.id
+
+        # no open transaction may hold a lock on messages
+        db.session.rollback()
+        with db.engine.begin() as conn:
+            self.assertTrue(partitions.convert(conn))
+
+        app.config['MESSAGE_PARTITIONS'] = True
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def tearDown(self):
+        app.config['MESSAGE_PARTITIONS'] = False
+        db.session.rollback()
+        db.engine.execute("DROP TABLE IF EXISTS messages_archive")
+        db.drop_all()
+        db.create_all()
+
+    def test_convert(self):
+        with db.engine.connect() as conn:
+            self.assertTrue(partitions.is_partitioned(conn))
+            months = partitions.partitions(conn)
+            self.assertFalse(partitions.convert(conn))
+
+        self.assertIn(partitions.month_start(OLD), months)
+        self.assertIn(partitions.month_start(datetime.utcnow()), months)
+        self.assertEqual(Message.query.count(), 4)
+        self.assertEqual(db.engine.execute(
+            "SELECT count(*) FROM messages_default").scalar(), 0)
+
+    def test_routes(self):
+        self.client.post("/messages/new", data={"text": "after"})
+        resp = self.client.get(f"/users/{self.user_id}")
+
+        self.assertIn(b"after", resp.data)
+        # the old ones come from the fallback past the recent partitions
+        self.assertIn(b"old 0", resp.data)
+
+    def test_delete_cascades(self):
+        msg_id = Message.query.filter_by(text="new").one().id
+        Likes.add(self.user_id, msg_id)
+        db.session.commit()
+
+        self.client.post(f"/messages/{msg_id}/delete")
+
+        self.assertIsNone(Message.query.get(msg_id))
+        self.assertEqual(Likes.query.count(), 0)
+
+    def test_recent_prunes(self):
+        with app.test_request_context():
+            query = Message.query.filter(partitions.recent())
+            compiled = query.statement.compile(dialect=db.engine.dialect)
+
+        plan = query_plans.explain(db.engine, str(compiled), compiled.params)
+
+        self.assertNotIn(partitions.partition_name(OLD), relations(plan))
+        self.assertIn(partitions.partition_name(datetime.utcnow()), relations(plan))
+
+    def page(self, per_page):
+        keys = [Message.timestamp, Message.id]
+        with app.test_request_context(), QueryCounter() as queries:
+            page = paginate(Message.query, keys, per_page=per_page,
+                            recent=partitions.recent())
+        return [msg.text for msg in page.items], page.next_cursor, queries.count
+
+    def test_recent_window_fills_page(self):
+        """A page the recent partitions fill is one query"""
+
+        user = User.query.get(self.user_id)
+        db.session.add_all([Message(text=f"new {i}", user=user) for i in range(2)])
+        db.session.commit()
+
+        texts, next_cursor, count = self.page(2)
+
+        self.assertEqual(len(texts), 2)
+        self.assertIsNotNone(next_cursor)
+        self.assertEqual(count, 1)
+
+    def test_recent_window_short(self):
+        """Past the window only the missing rows are fetched"""
+
+        texts, next_cursor, count = self.page(2)
+
+        self.assertEqual(texts, ["new", "old 2"])
+        self.assertIsNotNone(next_cursor)
+        self.assertEqual(count, 2)
+
+    def test_recent_skipped_for_small_listings(self):
+        with app.test_request_context():
+            self.assertIsNone(partitions.recent(3))
+            self.assertIsNotNone(partitions.recent(1000))
+
+    def test_create_partitions(self):
+        with db.engine.begin() as conn:
+            self.assertEqual(partitions.create_partitions(conn), [])
+            created = partitions.create_partitions(conn, ahead=5)
+
+        self.assertEqual(len(created), 2)
+
+    def test_archive_to_table(self):
+        with db.engine.begin() as conn:
+            archived = partitions.archive(conn, partitions.archive_cutoff(3))
+
+        self.assertEqual(archived[0], partitions.partition_name(OLD))
+        self.assertNotIn(partitions.partition_name(datetime.utcnow()), archived)
+        self.assertEqual([msg.text for msg in Message.query], ["new"])
+        self.assertEqual(db.engine.execute(
+            "SELECT count(*) FROM messages_archive").scalar(), 3)
+
+        # the author's count drops with them
+        self.assertEqual(User.query.get(self.user_id).messages_count, 1)
+        self.assertEqual(counters.reconcile(), 0)
+
+    def test_archive_to_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with db.engine.begin() as conn:
+                archived = partitions.archive(conn, partitions.archive_cutoff(3),
+                                              directory)
+
+            with gzip.open(os.path.join(directory, f'{archived[0]}.csv.gz'), 'rt') as f:
+                lines = f.read().splitlines()
+
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(Message.query.count(), 1)
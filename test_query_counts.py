@@ -0,0 +1,160 @@
+"""Query count tests for message list pages."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_query_counts.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from instrumentation import QueryCounter
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class QueryCountTestCase(TestCase):
+    """Message list pages run a fixed number of queries however long they are."""
+
+    def setUp(self):
+        """Create a viewer."""
+
+        db.drop_all()
+        db.create_all()
+
+        viewer = User.signup("viewer", "viewer@email.com", "password", None)
+        viewer.id = 1
+        db.session.commit()
+
+        self.next_id = 2
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def add_messages(self, count):
+        """Add `count` messages, each by a new author the viewer follows
+        and each liked by the viewer."""
+
+        viewer = User.query.get(1)
+
+        for i in range(count):
+            new_id = self.next_id
+            self.next_id += 1
+
+            author = User.signup(f"author{new_id}", f"a{new_id}@email.com",
+                                 "password", None)
+            author.id = new_id
+            viewer.following.append(author)
+            msg = Message(text=f"msg {new_id}", user=author)
+            db.session.add(msg)
+            db.session.flush()
+            db.session.add(Likes(user_id=1, message_id=msg.id))
+
+        db.session.commit()
+
+    def count_queries(self, url):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            # warm up process-wide caches like the user cache first
+            c.get(url)
+
+            with QueryCounter() as queries:
+                resp = c.get(url)
+
+            self.assertEqual(resp.status_code, 200)
+            return queries.count
+
+    def assertFixedQueryCount(self, url):
+        """The page runs as many queries listing 2 messages as listing 20."""
+
+        self.add_messages(2)
+        short = self.count_queries(url)
+
+        self.add_messages(18)
+        long = self.count_queries(url)
+
+        self.assertEqual(short, long)
+
+    def test_homepage(self):
+        self.assertFixedQueryCount("/")
+
+    def test_users_show(self):
+        self.add_messages(1)
+
+        for i in range(2):
+            db.session.add(Message(text=f"more {i}", user_id=2))
+        db.session.commit()
+        short = self.count_queries("/users/2")
+
+        for i in range(18):
+            db.session.add(Message(text=f"more {i}", user_id=2))
+        db.session.commit()
+        long = self.count_queries("/users/2")
+
+        self.assertEqual(short, long)
+
+    def test_show_liked_messages(self):
+        self.assertFixedQueryCount("/users/1/likes")
+
+    def test_following(self):
+        self.assertFixedQueryCount("/users/1/following")
+
+    def test_followers(self):
+        def add_followers(count):
+            viewer = User.query.get(1)
+            for i in range(count):
+                follower = User.signup(f"follower{self.next_id}",
+                                       f"f{self.next_id}@email.com", "password", None)
+                follower.id = self.next_id
+                self.next_id += 1
+                viewer.followers.append(follower)
+            db.session.commit()
+
+        add_followers(2)
+        short = self.count_queries("/users/1/followers")
+
+        add_followers(18)
+        long = self.count_queries("/users/1/followers")
+
+        self.assertEqual(short, long)
+
+    def test_follow_lists_projected(self):
+        """The cards' columns are loaded, not whole user rows"""
+
+        self.add_messages(3)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+            with QueryCounter() as queries:
+                resp = c.get("/users/1/following")
+
+        self.assertEqual(resp.data.count(b"Unfollow"), 3)
+        listing = next(statement for statement in queries.statements
+                       if "JOIN follows" in statement)
+        self.assertNotIn("users.bio", listing)
+        self.assertNotIn("users.password", listing)
+
+    def test_following_paginated(self):
+        self.add_messages(3)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+            resp = c.get("/users/1/following?before=4")
+
+        self.assertIn(b"@author2", resp.data)
+        self.assertIn(b"@author3", resp.data)
+        self.assertNotIn(b"@author4", resp.data)
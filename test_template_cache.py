@@ -0,0 +1,81 @@
+"""Template bytecode cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_template_cache.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from jinja2 import FileSystemBytecodeCache
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import template_cache
+
+
+class TemplateCacheTestCase(TestCase):
+    """Templates compile into TEMPLATE_CACHE_DIR and load back from it."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.config = dict(app.config)
+        self.bytecode_cache = app.jinja_env.bytecode_cache
+        app.jinja_env.cache.clear()
+
+    def tearDown(self):
+        app.config.clear()
+        app.config.update(self.config)
+        app.jinja_env.bytecode_cache = self.bytecode_cache
+        app.jinja_env.cache.clear()
+        self.directory.cleanup()
+
+    def test_off_by_default(self):
+        app.config['TEMPLATE_CACHE_DIR'] = ''
+        app.jinja_env.bytecode_cache = None
+        template_cache.init_app(app)
+
+        self.assertIsNone(app.jinja_env.bytecode_cache)
+
+    def test_precompile(self):
+        app.config['TEMPLATE_CACHE_DIR'] = self.directory.name
+        template_cache.init_app(app)
+
+        names = template_cache.compile_templates(app)
+
+        self.assertIn('base.html', names)
+        self.assertIn('users/detail.html', names)
+        self.assertEqual(len(os.listdir(self.directory.name)), len(names))
+
+    def test_loads_bytecode(self):
+        app.config['TEMPLATE_CACHE_DIR'] = self.directory.name
+        template_cache.init_app(app)
+        template_cache.compile_templates(app)
+
+        # as a new worker would: nothing in memory, so from the directory
+        app.jinja_env.cache.clear()
+        cache = app.jinja_env.bytecode_cache
+        loaded = []
+        load_bytecode = cache.load_bytecode
+
+        def record(bucket):
+            load_bytecode(bucket)
+            loaded.append(bucket.code is not None)
+
+        cache.load_bytecode = record
+        app.jinja_env.get_template('home-anon.html')
+
+        self.assertIsInstance(cache, FileSystemBytecodeCache)
+        self.assertTrue(loaded)
+        self.assertTrue(all(loaded))
+
+    def test_warmup(self):
+        app.config['TEMPLATE_CACHE_DIR'] = ''
+        app.config['TEMPLATE_WARMUP'] = True
+        template_cache.init_app(app)
+
+        cached = {name for (_, name) in app.jinja_env.cache.keys()}
+        self.assertEqual(cached, set(app.jinja_env.list_templates()))
@@ -0,0 +1,161 @@
+"""Materialized timeline tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_timelines.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import timelines
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineTestCase(TestCase):
+    """Test fan-out on write timelines."""
+
+    def setUp(self):
+        """Create two users where u1 follows u2, with fan-out turned on."""
+
+        db.drop_all()
+        db.create_all()
+
+        app.config['TIMELINE_FANOUT'] = True
+
+        u1 = User.signup("test", "test1@email.com", "password", None)
+        u1.id = 1111
+        u2 = User.signup("test2", "test2@email.com", "password", None)
+        u2.id = 2222
+        db.session.commit()
+
+        self.u1_id = 1111
+        self.u2_id = 2222
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        app.config['TIMELINE_FANOUT'] = False
+        return res
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def timeline_ids(self, user_id):
+        return [m.id for m in timelines.home_query(user_id).all()]
+
+    def test_new_message_fans_out(self):
+        """A new message lands in the author's and followers' timelines"""
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post("/users/follow/2222")
+
+            self.login(c, self.u2_id)
+            c.post("/messages/new", data={"text": "Hello followers"})
+
+        msg = Message.query.one()
+        self.assertEqual(self.timeline_ids(self.u1_id), [msg.id])
+        self.assertEqual(self.timeline_ids(self.u2_id), [msg.id])
+
+    def test_follow_and_unfollow(self):
+        """Following backfills a timeline and unfollowing clears it"""
+
+        msg = Message(id=1234, text="Before the follow", user_id=self.u2_id)
+        db.session.add(msg)
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+
+            c.post("/users/follow/2222")
+            self.assertEqual(self.timeline_ids(self.u1_id), [1234])
+
+            c.post("/users/stop-following/2222")
+            self.assertEqual(self.timeline_ids(self.u1_id), [])
+
+    def test_delete_message(self):
+        """Deleting a message removes it from timelines"""
+
+        with self.client as c:
+            self.login(c, self.u2_id)
+            c.post("/messages/new", data={"text": "Short lived"})
+            msg_id = Message.query.one().id
+
+            c.post(f"/messages/{msg_id}/delete")
+
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_homepage_reads_timeline(self):
+        """The home page shows messages from the materialized timeline"""
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post("/users/follow/2222")
+
+            self.login(c, self.u2_id)
+            c.post("/messages/new", data={"text": "Fanned out"})
+
+            self.login(c, self.u1_id)
+            resp = c.get("/")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Fanned out", html)
+
+    def test_rebuild(self):
+        """Rebuilding backfills timelines from follows and messages"""
+
+        u1 = User.query.get(self.u1_id)
+        u1.following.append(User.query.get(self.u2_id))
+        db.session.add(Message(id=1, text="Mine", user_id=self.u1_id))
+        db.session.add(Message(id=2, text="Theirs", user_id=self.u2_id))
+        db.session.commit()
+
+        self.assertEqual(timelines.rebuild(), 3)
+        self.assertEqual(sorted(self.timeline_ids(self.u1_id)), [1, 2])
+        self.assertEqual(self.timeline_ids(self.u2_id), [2])
+
+    def test_pages_past_first_page(self):
+        """Paging back reaches every message, with fan-out and without"""
+
+        start = datetime(2020, 1, 1)
+        for n in range(1, 151):
+            db.session.add(Message(id=n, text=f"msg {n}", user_id=self.u2_id,
+                                   timestamp=start + timedelta(minutes=n)))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post("/users/follow/2222")
+
+            def page_through():
+                ids = []
+                resp = c.get("/api/v1/timeline?fields=id").get_json()
+                ids += [item['id'] for item in resp['items']]
+                while resp['next_cursor']:
+                    resp = c.get("/api/v1/timeline?fields=id&before="
+                                 + resp['next_cursor']).get_json()
+                    ids += [item['id'] for item in resp['items']]
+                return ids
+
+            newest_first = list(range(150, 0, -1))
+            self.assertEqual(page_through(), newest_first)
+
+            timelines.rebuild()
+            self.assertEqual(page_through(), newest_first)
+
+            app.config['TIMELINE_FANOUT'] = False
+            self.assertEqual(page_through(), newest_first)
@@ -0,0 +1,95 @@
+"""Current user cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_user_cache.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from instrumentation import QueryCounter
+from user_cache import user_cache
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class UserCacheTestCase(TestCase):
+    """Test the per-process cache behind add_user_to_g."""
+
+    def setUp(self):
+        """Create a logged in test client."""
+
+        db.drop_all()
+        db.create_all()
+
+        u1 = User.signup("test", "test1@email.com", "password", None)
+        u1.id = 1111
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1111
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def test_second_request_hits_cache(self):
+        """Only the first request looks the user up"""
+
+        self.client.get("/messages/new")
+        before = user_cache.stats()
+
+        with QueryCounter() as queries:
+            resp = self.client.get("/messages/new")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(queries.count, 0)
+        self.assertEqual(user_cache.stats()['hits'], before['hits'] + 1)
+
+    def test_counters_stay_fresh(self):
+        """Cached users still show current message counts"""
+
+        self.client.get("/")
+        db.session.add(Message(text="New", user_id=1111))
+        User.query.filter_by(id=1111).update({'messages_count': 1})
+        db.session.commit()
+
+        html = self.client.get("/").get_data(as_text=True)
+
+        self.assertIn('<a href="/users/1111">1</a>', html)
+
+    def test_profile_edit_invalidates(self):
+        """Editing the profile drops the cached user"""
+
+        self.client.get("/")
+        self.client.post("/users/profile", data={"username": "renamed",
+                                                 "email": "test1@email.com",
+                                                 "password": "password"})
+
+        html = self.client.get("/").get_data(as_text=True)
+
+        self.assertIn("@renamed", html)
+
+    def test_deleted_behind_cache(self):
+        """A cached user deleted by another process is logged out"""
+
+        self.client.get("/")
+        with db.engine.begin() as conn:
+            conn.execute("DELETE FROM users WHERE id = 1111")
+
+        resp = self.client.get("/")
+
+        self.assertNotEqual(resp.status_code, 500)
+        self.assertIsNone(user_cache.get(1111))
+        with self.client.session_transaction() as sess:
+            self.assertNotIn(CURR_USER_KEY, sess)
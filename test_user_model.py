@@ -9,7 +9,8 @@ import os
 from unittest import TestCase
 from sqlalchemy import exc
 
-from models import db, User, Message, Follows
+from models import db, hasher, User, Message, Follows
+from passwords import hash_cost
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -58,9 +59,11 @@ class UserModelTestCase(TestCase):
         self.u2_id = u2_id
 
         self.client = app.test_client()
+        self.rounds = hasher.rounds
     
     def tearDown(self):
         res = super().tearDown()
+        hasher.rounds = self.rounds
         db.session.rollback()
         return res
 
@@ -159,3 +162,24 @@ class UserModelTestCase(TestCase):
         not_authentic = User.authenticate("test2", "wrongpassword")
 
         self.assertEqual(not_authentic, False)
+
+    def test_authenticate_rehashes_outdated_cost(self):
+        """User.authenticate upgrades a hash made at a lower bcrypt cost"""
+        hasher.rounds = 4
+        self.u2.password = hasher.hash("password")
+        db.session.commit()
+
+        hasher.rounds = 5
+        user = User.authenticate("test2", "password")
+
+        self.assertEqual(hash_cost(user.password), 5)
+        self.assertEqual(User.authenticate("test2", "password"), self.u2)
+
+    def test_authenticate_keeps_stronger_cost(self):
+        """Lowering the bcrypt cost doesn't downgrade existing hashes"""
+        cost = hash_cost(self.u2.password)
+        hasher.rounds = 4
+
+        user = User.authenticate("test2", "password")
+
+        self.assertEqual(hash_cost(user.password), cost)
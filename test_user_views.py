@@ -135,6 +135,25 @@ class UserViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn("testuser", html)
         
+    def test_users_search(self):
+        """Searching ranks prefix matches first and only matches literally"""
+        with self.client as c:
+            resp = c.get("/users?q=user2")
+            html = resp.get_data(as_text=True)
+
+            self.assertIn("@testuser2", html)
+            self.assertNotIn("@testuser<", html)
+
+            resp = c.get("/users?q=TEST")
+            html = resp.get_data(as_text=True)
+
+            self.assertLess(html.index("@testuser<"), html.index("@testuser2<"))
+
+            resp = c.get("/users?q=%25")
+            html = resp.get_data(as_text=True)
+
+            self.assertIn("Sorry, no users found", html)
+
     def test_user_profile(self):
         """Tests that the user profile shows up"""
         with self.client as c:
@@ -259,6 +278,35 @@ class UserViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertEqual(len(likes), 1)
 
+    def test_user_profile_pagination(self):
+        """Profile pages past the first are reached with a before cursor"""
+        for i in range(101):
+            db.session.add(Message(id=i + 1, text=f"warble {i + 1}", user_id=self.testuser_id))
+        db.session.commit()
+
+        with self.client as c:
+            resp = c.get("/users/1111")
+            html = resp.get_data(as_text=True)
+
+            self.assertIn("warble 101<", html)
+            self.assertNotIn("warble 1<", html)
+            self.assertIn("Older", html)
+
+            cursor = html.split("before=")[1].split('"')[0]
+            resp = c.get(f"/users/1111?before={cursor}")
+            html = resp.get_data(as_text=True)
+
+            self.assertIn("warble 1<", html)
+            self.assertNotIn("warble 2<", html)
+            self.assertNotIn("Older", html)
+
+    def test_users_list_bad_cursor(self):
+        """A malformed cursor is a bad request"""
+        with self.client as c:
+            resp = c.get("/users?before=yesterday")
+
+            self.assertEqual(resp.status_code, 400)
+
 
 
 
@@ -0,0 +1,136 @@
+"""Write-behind (group commit) tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_write_behind.py
+
+
+import os
+import threading
+from unittest import TestCase
+
+from models import db, User, Message, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from instrumentation import QueryCounter
+from write_behind import write_behind
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class WriteBehindTestCase(TestCase):
+    """Queued likes and messages land in batches, counters included."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        users = [User.signup(f"user{i}", f"user{i}@email.com", "password", None)
+                 for i in range(5)]
+        msg = Message(text="Hot take", user=users[0])
+        db.session.add(msg)
+        db.session.commit()
+        self.user_ids = [user.id for user in users]
+        self.message_id = msg.id
+
+        write_behind.likes_enabled = True
+        write_behind.messages_enabled = True
+        # flushed by hand below
+        write_behind.interval_ms = 60 * 60 * 1000
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        write_behind.stop()
+        write_behind.likes_enabled = False
+        write_behind.messages_enabled = False
+        write_behind.interval_ms = app.config['WRITE_BEHIND_INTERVAL_MS']
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_likes_batched(self):
+        for user_id in self.user_ids:
+            self.login(user_id)
+            self.client.post(f"/users/add_like/{self.message_id}")
+
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(write_behind.pending(), 5)
+
+        with QueryCounter() as queries:
+            write_behind.flush()
+
+        self.assertEqual(len([statement for statement in queries.statements
+                              if statement.lstrip().startswith("INSERT INTO likes")]), 1)
+        self.assertEqual(Likes.query.count(), 5)
+        self.assertEqual(Message.query.get(self.message_id).likes_count, 5)
+        self.assertEqual(User.query.get(self.user_ids[1]).likes_count, 1)
+
+    def test_last_write_wins(self):
+        self.login(self.user_ids[1])
+        self.client.post(f"/users/add_like/{self.message_id}")
+        self.client.post(f"/users/remove_like/{self.message_id}")
+        self.client.post(f"/users/add_like/{self.message_id}")
+        self.client.post(f"/users/add_like/{self.message_id}")
+        write_behind.flush()
+
+        self.assertEqual(Likes.query.count(), 1)
+        self.assertEqual(Message.query.get(self.message_id).likes_count, 1)
+
+    def test_unlike(self):
+        write_behind.like(self.user_ids[1], self.message_id)
+        write_behind.flush()
+
+        write_behind.like(self.user_ids[1], self.message_id, -1)
+        write_behind.like(self.user_ids[2], self.message_id, -1)
+        write_behind.flush()
+
+        self.assertEqual(Likes.query.count(), 0)
+        # only the unlike that removed something counts
+        self.assertEqual(Message.query.get(self.message_id).likes_count, 0)
+        self.assertEqual(User.query.get(self.user_ids[2]).likes_count, 0)
+
+    def test_deleted_message_skipped(self):
+        write_behind.like(self.user_ids[1], self.message_id)
+        write_behind.like(self.user_ids[1], self.message_id + 1)
+        write_behind.flush()
+
+        self.assertEqual(Likes.query.count(), 1)
+        self.assertEqual(write_behind.pending(), 0)
+
+    def test_messages(self):
+        self.login(self.user_ids[1])
+        self.client.post("/messages/new", data={"text": "first"})
+        self.client.post("/messages/new", data={"text": "second"})
+
+        self.assertEqual(Message.query.count(), 1)
+        write_behind.flush()
+
+        msgs = (Message.query
+                .filter(Message.user_id == self.user_ids[1])
+                .order_by(Message.timestamp).all())
+        self.assertEqual([msg.text for msg in msgs], ["first", "second"])
+        self.assertEqual(User.query.get(self.user_ids[1]).messages_count, 2)
+
+    def test_flush_on_stop(self):
+        write_behind.like(self.user_ids[1], self.message_id)
+        write_behind.stop()
+
+        self.assertEqual(Likes.query.count(), 1)
+
+    def test_background_flush(self):
+        write_behind.interval_ms = 10
+        write_behind.like(self.user_ids[1], self.message_id)
+
+        for _ in range(100):
+            if write_behind.pending() == 0 and write_behind.flushed:
+                break
+            threading.Event().wait(0.05)
+
+        self.assertEqual(Likes.query.count(), 1)
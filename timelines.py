@@ -0,0 +1,143 @@
+"""Materialized home timelines (fan-out on write).
+
+When `TIMELINE_FANOUT` is enabled, every new message is pushed into the
+`timeline_entries` rows of its author and each of the author's followers,
+so the home page becomes a single index range scan on one user's entries
+instead of an `IN (...)` over everyone they follow.
+
+Timelines hold a user's whole home history, like the query they replace,
+so paging back with `?before=` reaches the same messages either way.
+Follows and unfollows keep the entries in sync, and a deleted message's
+entries go with it by foreign key cascade. After turning fan-out on for an
+existing database, run `flask rebuild-timelines` to backfill entries from
+the `follows` and `messages` tables.
+"""
+
+from flask import current_app
+from sqlalchemy import select, literal, literal_column, union_all, func, cast
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+from models import db, Follows, Message, TimelineEntry, User
+
+ENTRY_COLUMNS = ['user_id', 'message_id', 'timestamp']
+
+# Sort key of a materialized timeline, served by its (user_id, timestamp) index
+HOME_KEYS = [TimelineEntry.timestamp, TimelineEntry.message_id]
+
+
+def enabled():
+    """Is fan-out on write turned on for this app?"""
+
+    return current_app.config.get('TIMELINE_FANOUT', False)
+
+
+def home_query(user_id):
+    """Query for the messages in `user_id`'s materialized timeline.
+
+    Unordered; paginate it on HOME_KEYS to walk it newest first.
+    """
+
+    return (Message
+            .with_authors()
+            .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+            .filter(TimelineEntry.user_id == user_id))
+
+
+def home_user_ids(user_id):
+    """Select of `user_id` and the ids of the users they follow."""
+
+    # one IN over a union, not `id = ... OR id IN (...)`, which Postgres
+    # can only answer by scanning the whole table
+    return (select([Follows.user_being_followed_id])
+            .where(Follows.user_following_id == user_id)
+            .union(select([literal(user_id)])))
+
+
+def home_version_query(user_id):
+    """Select of the validators of `user_id`'s home timeline.
+
+    (count, digest, latest updated_at) of `user_id` and the users they
+    follow. The digest hashes every `updated_at`, so any post, delete,
+    follow or profile edit changes it even when the latest doesn't move,
+    with or without fan-out; the latest is for Last-Modified.
+    """
+
+    stamps = func.string_agg(cast(User.updated_at, db.Text),
+                             aggregate_order_by(literal_column("','"), User.id))
+
+    return (select([func.count(User.id), func.md5(stamps), func.max(User.updated_at)])
+            .where(User.id.in_(home_user_ids(user_id))))
+
+
+def home_version(user_id):
+    """The validators of `user_id`'s home timeline (see home_version_query)."""
+
+    return db.session.execute(home_version_query(user_id)).first()
+
+
+def fan_out(message):
+    """Push a new (flushed) message to its author's and followers' timelines."""
+
+    followers = (select([Follows.user_following_id,
+                         literal(message.id),
+                         literal(message.timestamp, db.DateTime)])
+                 .where(Follows.user_being_followed_id == message.user_id))
+    author = select([literal(message.user_id),
+                     literal(message.id),
+                     literal(message.timestamp, db.DateTime)])
+
+    db.session.execute(
+        TimelineEntry.__table__
+        .insert()
+        .from_select(ENTRY_COLUMNS, union_all(followers, author)))
+
+
+def add_follow(follower_id, followed_id):
+    """Copy the followed user's messages into the follower's timeline."""
+
+    theirs = (select([literal(follower_id), Message.id, Message.timestamp])
+              .where(Message.user_id == followed_id))
+
+    db.session.execute(
+        TimelineEntry.__table__
+        .insert()
+        .from_select(ENTRY_COLUMNS, theirs))
+
+
+def remove_follow(follower_id, followed_id):
+    """Drop the unfollowed user's messages from the follower's timeline."""
+
+    their_messages = select([Message.id]).where(Message.user_id == followed_id)
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.user_id == follower_id,
+             TimelineEntry.message_id.in_(their_messages))
+     .delete(synchronize_session=False))
+
+
+def rebuild():
+    """Rebuild every timeline from scratch from follows and messages.
+
+    Returns the number of entries written.
+    """
+
+    followed = (select([Follows.user_following_id.label('user_id'),
+                        Message.id.label('message_id'),
+                        Message.timestamp.label('timestamp')])
+                .select_from(Follows.__table__.join(
+                    Message.__table__,
+                    Message.user_id == Follows.user_being_followed_id)))
+    own = select([Message.user_id.label('user_id'),
+                  Message.id.label('message_id'),
+                  Message.timestamp.label('timestamp')])
+    entries = union_all(followed, own)
+
+    TimelineEntry.query.delete(synchronize_session=False)
+    result = db.session.execute(
+        TimelineEntry.__table__
+        .insert()
+        .from_select(ENTRY_COLUMNS, entries))
+    db.session.commit()
+
+    return result.rowcount
@@ -0,0 +1,145 @@
+"""Per-process cache of logged-in users.
+
+`add_user_to_g` looks up the current user on every request. This keeps the
+column values of recently seen users in memory, keyed by id, so the auth
+path usually skips the database:
+
+- entries live for at most USER_CACHE_TTL seconds, which bounds how stale
+  a profile edit made by another process can look here
+- at most USER_CACHE_SIZE users are kept, least recently used evicted first
+- updating or deleting a user through the ORM drops their entry when the
+  session commits, so profile() edits and delete_user are seen at once
+- a user deleted by another process shows as ObjectDeletedError once the
+  request loads one of their uncached columns; `reload` then drops the
+  entry and looks them up again (see app.py)
+
+The counter columns and `updated_at` change on almost every write, so they
+aren't cached; pages that show them load them with one query on first
+access.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from counters import COUNTERS
+from models import db, User
+
+USER_CACHE_SIZE = 10000
+
+USER_CACHE_TTL = 30
+
+CACHED_COLUMNS = [column.key for column in User.__table__.columns
+                  if column.key not in COUNTERS + ('updated_at',)]
+
+
+class UserCache:
+    """LRU + TTL cache of user column values."""
+
+    def __init__(self, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """The user with `user_id`, attached to the current session, or None."""
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                values = entry[1]
+            else:
+                self.misses += 1
+                values = None
+
+        if values is None:
+            user = User.query.get(user_id)
+            if user is not None:
+                self.put(user)
+            return user
+
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def reload(self, user_id):
+        """Drop `user_id`'s entry and look them up again, or None if gone."""
+
+        self.invalidate(user_id)
+        return self.get(user_id)
+
+    def put(self, user):
+        values = {key: getattr(user, key) for key in CACHED_COLUMNS}
+
+        with self._lock:
+            self._entries[user.id] = (time.monotonic(), values)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counts and current size, for metrics."""
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+            }
+
+
+user_cache = UserCache()
+
+
+##############################################################################
+# Drop entries for users changed through the ORM once the change commits
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _queue_invalidation(mapper, connection, user):
+    Session.object_session(user).info.setdefault('stale_users', set()).add(user.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate(session):
+    for user_id in session.info.pop('stale_users', ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidations(session):
+    # nothing changed, but dropping the entries anyway is harmless
+    for user_id in session.info.pop('stale_users', ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_bulk_delete')
+def _clear_on_bulk_delete(delete_context):
+    if delete_context.mapper.local_table.name == 'users':
+        user_cache.clear()
+
+
+@event.listens_for(User.metadata, 'after_drop')
+def _clear_on_drop(target, connection, **kw):
+    user_cache.clear()
@@ -0,0 +1,247 @@
+"""Group commit for likes and new messages.
+
+With WRITE_BEHIND_LIKES (and optionally WRITE_BEHIND_MESSAGES) on, the
+routes don't commit their own write. They append it to an in-process
+queue and answer straight away. A background thread writes the queue out
+every WRITE_BEHIND_INTERVAL_MS, or as soon as WRITE_BEHIND_BATCH writes are
+waiting, as one transaction of multi-row statements. A like storm on one
+hot message is then a few transactions a second instead of one per click.
+
+Guarantees, and what is traded away:
+
+- durability: a queued write is acknowledged before it is committed. A
+  clean shutdown writes the queue out (atexit), but if the process is
+  killed or crashes, up to one interval of writes is lost. Leave this off
+  where that isn't acceptable.
+- visibility: the writer's own next page may not show the write yet, for
+  up to one interval.
+- ordering: writes from one process are applied in the order they were
+  queued. Within a batch a user's likes and unlikes of a message collapse
+  to the last one. There is no ordering between processes.
+- failures: if the database can't be reached the batch goes back on the
+  queue and is retried next time. Writes that can't be applied, like a
+  like of a message deleted meanwhile, are skipped; any other error drops
+  the batch and logs it.
+
+Counters, and timeline fan-out for messages, are updated in the same
+transaction as the rows they count.
+"""
+
+import atexit
+from collections import deque, namedtuple
+from datetime import datetime
+import logging
+import threading
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import counters
+from models import db, Message, User
+import timelines
+
+WRITE_BEHIND_INTERVAL_MS = 50
+
+WRITE_BEHIND_BATCH = 500
+
+logger = logging.getLogger(__name__)
+
+QueuedLike = namedtuple('QueuedLike', ['user_id', 'message_id', 'delta'])
+
+QueuedMessage = namedtuple('QueuedMessage', ['user_id', 'text', 'timestamp'])
+
+# each statement takes all of a batch's pairs as two arrays; pairs whose
+# user or message no longer exists are skipped rather than failing the batch
+ADD_LIKES_SQL = text("""
+    INSERT INTO likes (user_id, message_id)
+    SELECT pairs.user_id, pairs.message_id
+    FROM unnest(CAST(:user_ids AS integer[]), CAST(:message_ids AS integer[]))
+         AS pairs (user_id, message_id)
+    WHERE EXISTS (SELECT 1 FROM users WHERE users.id = pairs.user_id)
+      AND EXISTS (SELECT 1 FROM messages WHERE messages.id = pairs.message_id)
+    ON CONFLICT DO NOTHING
+    RETURNING user_id, message_id
+""")
+
+REMOVE_LIKES_SQL = text("""
+    DELETE FROM likes
+    USING unnest(CAST(:user_ids AS integer[]), CAST(:message_ids AS integer[]))
+          AS pairs (user_id, message_id)
+    WHERE likes.user_id = pairs.user_id AND likes.message_id = pairs.message_id
+    RETURNING likes.user_id, likes.message_id
+""")
+
+
+class WriteBehind:
+    """Queue of likes and messages written out in batches by a thread."""
+
+    def __init__(self, interval_ms=WRITE_BEHIND_INTERVAL_MS,
+                 batch=WRITE_BEHIND_BATCH):
+        self.likes_enabled = False
+        self.messages_enabled = False
+        self.interval_ms = interval_ms
+        self.batch = batch
+
+        self._app = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._queue = deque()
+        self._thread = None
+        self._stopping = False
+
+        self.flushes = 0
+        self.flushed = 0
+        self.dropped = 0
+
+    def init_app(self, app):
+        self._app = app
+        self.likes_enabled = app.config.get('WRITE_BEHIND_LIKES', False)
+        self.messages_enabled = app.config.get('WRITE_BEHIND_MESSAGES', False)
+        self.interval_ms = app.config.get('WRITE_BEHIND_INTERVAL_MS', self.interval_ms)
+        self.batch = app.config.get('WRITE_BEHIND_BATCH', self.batch)
+
+    def like(self, user_id, message_id, delta=1):
+        """Queue `user_id` liking (1) or unliking (-1) `message_id`."""
+
+        self._enqueue(QueuedLike(user_id, message_id, delta))
+
+    def add_message(self, user_id, text):
+        """Queue a new message, stamped with the time it was queued."""
+
+        self._enqueue(QueuedMessage(user_id, text, datetime.utcnow()))
+
+    def pending(self):
+        return len(self._queue)
+
+    def _enqueue(self, write):
+        with self._lock:
+            self._queue.append(write)
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(
+                    target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+        if len(self._queue) >= self.batch:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.interval_ms / 1000)
+            self._wake.clear()
+            self.flush()
+
+    def stop(self):
+        """Stop the thread and write out whatever is still queued."""
+
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+
+        if thread is not None:
+            self._wake.set()
+            thread.join()
+            atexit.unregister(self.stop)
+
+        self.flush()
+
+    def flush(self):
+        """Write every queued write, a batch per transaction. Returns how many."""
+
+        written = 0
+
+        with self._flush_lock:
+            while self._queue:
+                with self._lock:
+                    writes = [self._queue.popleft()
+                              for _ in range(min(self.batch, len(self._queue)))]
+
+                with self._app.app_context():
+                    try:
+                        self._write(writes)
+                        db.session.commit()
+                    except OperationalError:
+                        db.session.rollback()
+                        logger.exception("write-behind: database unavailable, "
+                                         "retrying %d writes", len(writes))
+                        with self._lock:
+                            self._queue.extendleft(reversed(writes))
+                        break
+                    except Exception:
+                        db.session.rollback()
+                        self.dropped += len(writes)
+                        logger.exception("write-behind: dropped %d writes",
+                                         len(writes))
+                        continue
+                    finally:
+                        db.session.remove()
+
+                self.flushes += 1
+                self.flushed += len(writes)
+                written += len(writes)
+
+        return written
+
+    def _write(self, writes):
+        # a user's last like or unlike of a message wins, in queue order
+        likes = {}
+        messages = []
+        for write in writes:
+            if isinstance(write, QueuedLike):
+                likes[(write.user_id, write.message_id)] = write.delta
+            else:
+                messages.append(write)
+
+        if messages:
+            self._write_messages(messages)
+
+        changes = []
+        for delta, sql in ((1, ADD_LIKES_SQL), (-1, REMOVE_LIKES_SQL)):
+            pairs = [pair for pair, pair_delta in likes.items() if pair_delta == delta]
+            if pairs:
+                user_ids, message_ids = zip(*pairs)
+                changed = db.session.execute(sql, {'user_ids': list(user_ids),
+                                                   'message_ids': list(message_ids)})
+                changes.extend((user_id, message_id, delta)
+                               for user_id, message_id in changed)
+        counters.count_likes(changes)
+
+    def _write_messages(self, messages):
+        # messages of users deleted since are skipped, like likes are
+        user_ids = {msg.user_id for msg in messages}
+        existing = {user_id for (user_id,) in
+                    db.session.query(User.id).filter(User.id.in_(user_ids))}
+        messages = [msg for msg in messages if msg.user_id in existing]
+        if not messages:
+            return
+
+        table = Message.__table__
+        rows = db.session.execute(
+            table
+            .insert()
+            .values([{'user_id': msg.user_id, 'text': msg.text,
+                      'timestamp': msg.timestamp} for msg in messages])
+            .returning(table.c.id, table.c.user_id, table.c.timestamp)).fetchall()
+
+        per_user = {}
+        for row in rows:
+            per_user[row.user_id] = per_user.get(row.user_id, 0) + 1
+        for user_id, count in per_user.items():
+            counters.bump(user_id, messages_count=count)
+
+        if timelines.enabled():
+            for row in rows:
+                timelines.fan_out(row)
+
+    def stats(self):
+        return {
+            'pending': self.pending(),
+            'flushes': self.flushes,
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+        }
+
+
+write_behind = WriteBehind()